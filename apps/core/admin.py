@@ -1,37 +1,98 @@
 from django import forms 
-from django.contrib import admin
-from django.utils.html import format_html
+from django.contrib import admin, messages
+from django.contrib.admin import helpers
+from django.utils.html import format_html, format_html_join
 from django.contrib.auth.models import User
 from django.contrib.auth.admin import UserAdmin
 from django.db import models 
+from django.db.models import Exists, ExpressionWrapper, F, OuterRef, Value
+from django.db.models.functions import Concat, Greatest
 
-# --- IMPORTS PARA PDF (RECETAS) ---
-import io
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
-
-# --- IMPORTS PARA EXCEL ---
-import xlwt
-from django.http import HttpResponse
+# --- IMPORTS PARA EXPORTACIONES Y DESCARGAS ---
+import os
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
 from datetime import datetime
+from django.utils import timezone
 
 # IMPORTAMOS TODOS LOS MODELOS (INCLUYENDO LOS NUEVOS)
-from .models import Servicio, Cita, Paciente, Documento, Pago, Insumo, Receta, FichaMedica, Producto
+from .models import (
+    Servicio, Cita, Paciente, Documento, Pago, Insumo, Receta, FichaMedica, Producto, CorreoPendiente, Exportacion, MovimientoStock, MaterialServicio, ArchivoDeduplicado,
+    Pedido, ItemPedido, PagoPedido,
+)
+from . import agenda, analitica, busqueda, caja, exportacion, imagenes, inventario, paginacion, pedidos, portal, recetas_pdf, resumenes
+
+# Deudores que se listan en el cierre de caja (los de mayor saldo)
+MAX_DEUDORES_CIERRE = 20
+# Movimientos del kardex que se muestran en la ficha del insumo
+MAX_MOVIMIENTOS_FICHA = 10
+
+# ---------------------------------------------------------------
+# BÚSQUEDA DE TEXTO COMPLETO (ver busqueda.py)
+# ---------------------------------------------------------------
+class BusquedaIndexadaMixin:
+    """
+    La caja de búsqueda consulta el índice FTS (sin acentos, por prefijos) en
+    vez de hacer icontains sobre `search_fields`, que solo quedan para que
+    el admin muestre la caja.
+    """
+    indice_busqueda = None
+    campo_busqueda = 'pk'
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        return busqueda.filtrar(queryset, self.indice_busqueda, search_term, self.campo_busqueda), False
+
+# ---------------------------------------------------------------
+# LISTADOS GRANDES: PAGINACIÓN POR CURSOR (ver paginacion.py)
+# ---------------------------------------------------------------
+class PaginacionKeysetMixin:
+    """
+    Sin COUNT(*) de toda la tabla ni OFFSET: conteo acotado o estimado y, con
+    el `ordering` del admin (campos indexados terminados en la pk), páginas
+    por cursor que cuestan lo mismo al principio que al final del listado.
+    """
+    paginator = paginacion.PaginadorEstimado
+    show_full_result_count = False
+
+    def get_changelist(self, request, **kwargs):
+        return paginacion.ChangeListKeyset
+
+def es_autocompletado(request):
+    """ Petición del buscador de los selectores con autocompletado (admin/autocomplete/) """
+    return request.resolver_match is not None and request.resolver_match.url_name == 'autocomplete'
 
 # ---------------------------------------------------------------
 # 0. INLINES
 # ---------------------------------------------------------------
+def enlace_documento(obj):
+    """ Los archivos clínicos no se sirven desde /media/: se abren por la vista protegida """
+    if not obj.pk or not obj.archivo:
+        return "-"
+    return format_html('<a href="{}" target="_blank">🩻 Ver archivo</a>', reverse('descargar_documento', args=[obj.pk]))
+enlace_documento.short_description = "Archivo"
+
 class DocumentoInline(admin.TabularInline):
     model = Documento
     extra = 1
-    fields = ('titulo', 'archivo', 'notas', 'fecha_subida')
-    readonly_fields = ('fecha_subida',)
+    fields = ('titulo', 'archivo', enlace_documento, 'notas', 'fecha_subida')
+    readonly_fields = (enlace_documento, 'fecha_subida')
 
 class PagoInline(admin.StackedInline):
     model = Pago
     can_delete = False
     verbose_name_plural = 'Registro de Pago (Caja)'
 
+class MaterialServicioInline(admin.TabularInline):
+    model = MaterialServicio
+    extra = 1
+    verbose_name_plural = "🧪 Materiales que consume cada cita"
+
 # NUEVO: Ficha Médica dentro del Paciente
 class FichaMedicaInline(admin.StackedInline):
     model = FichaMedica
@@ -53,6 +114,82 @@ class PacienteAdminForm(forms.ModelForm):
                 raise forms.ValidationError("¡Error! Este correo pertenece a otro usuario.")
         return email
 
+class CierreCajaForm(forms.Form):
+    desde = forms.DateField(label="Desde", required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    hasta = forms.DateField(label="Hasta", required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+
+    def clean(self):
+        datos = super().clean()
+        if datos.get('desde') and datos.get('hasta') and datos['desde'] > datos['hasta']:
+            raise forms.ValidationError("La fecha inicial no puede ser posterior a la final.")
+        return datos
+
+class ProductoAdminForm(forms.ModelForm):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # El stock que vio el admin viaja oculto en el formulario (initial-stock)
+        self.fields['stock'].show_hidden_initial = True
+
+    def diferencia_stock(self):
+        """ Lo que el admin sumó o restó al stock que tenía en pantalla """
+        visto = self.fields['stock'].to_python(self.data.get(self.add_initial_prefix('stock')))
+        return self.cleaned_data['stock'] - (self.initial['stock'] if visto is None else visto)
+
+class MovimientoStockForm(forms.ModelForm):
+    class Meta:
+        model = MovimientoStock
+        fields = ('tipo', 'cantidad', 'motivo')
+
+    def clean_cantidad(self):
+        cantidad = self.cleaned_data['cantidad']
+        if cantidad == 0:
+            raise forms.ValidationError("La cantidad no puede ser cero.")
+        return cantidad
+
+    def cantidad_con_signo(self):
+        """ Consumo siempre resta, entrada siempre suma; el ajuste va con su signo """
+        cantidad = self.cleaned_data['cantidad']
+        if self.cleaned_data['tipo'] == MovimientoStock.CONSUMO:
+            return -abs(cantidad)
+        if self.cleaned_data['tipo'] == MovimientoStock.ENTRADA:
+            return abs(cantidad)
+        return cantidad
+
+class MovimientoStockFormSet(forms.BaseInlineFormSet):
+    def movimientos(self):
+        """ Formularios con un movimiento nuevo, en el orden en que se registran """
+        return [formulario for formulario in self.forms if formulario.has_changed()]
+
+    def clean(self):
+        super().clean()
+        if any(self.errors) or self.instance.pk is None:
+            return
+        # El admin valida y guarda en una sola transacción: con la fila del insumo
+        # bloqueada nadie consume ese stock antes de save_formset
+        stock = Insumo.objects.select_for_update().values_list('cantidad', flat=True).get(pk=self.instance.pk)
+        for formulario in self.movimientos():
+            stock += formulario.cantidad_con_signo()
+            if stock < 0:
+                raise forms.ValidationError(
+                    f"No hay {-formulario.cantidad_con_signo()} unidades de {self.instance} en stock: faltan {-stock}."
+                )
+
+# ---------------------------------------------------------------
+# 1.1 FILTROS
+# ---------------------------------------------------------------
+class EstadoPagoFilter(admin.SimpleListFilter):
+    """ Estado del pago evaluado en SQL (mismo criterio que Pago.estado_pago) """
+    title = 'Estado del Pago'
+    parameter_name = 'estado_pago'
+
+    def lookups(self, request, model_admin):
+        return caja.ESTADOS_PAGO
+
+    def queryset(self, request, queryset):
+        if self.value() in caja.CONDICIONES_ESTADO:
+            return caja.filtrar_por_estado(queryset, self.value())
+        return queryset
+
 # ---------------------------------------------------------------
 # 2. CONFIGURACIÓN DE MODELOS
 # ---------------------------------------------------------------
@@ -60,27 +197,57 @@ class PacienteAdminForm(forms.ModelForm):
 class ServicioAdmin(admin.ModelAdmin):
     list_display = ('titulo', 'precio_estimado')
     search_fields = ('titulo',)
+    ordering = ('titulo',)
+    inlines = [MaterialServicioInline]
 
 @admin.register(Cita)
-class CitaAdmin(admin.ModelAdmin):
+class CitaAdmin(PaginacionKeysetMixin, BusquedaIndexadaMixin, admin.ModelAdmin):
     list_display = ('paciente_nombre', 'boton_whatsapp', 'servicio', 'fecha', 'hora', 'estado_pago_visual', 'estado')
     list_filter = ('estado', 'fecha', 'servicio')
     date_hierarchy = 'fecha'
+    # Las más recientes primero (también en el autocompletado); índice cita_fecha_hora_idx: paginación por cursor
+    ordering = ('-fecha', '-hora', '-id')
     inlines = [PagoInline] 
-    actions = ['marcar_como_finalizada', 'marcar_como_cancelada', 'exportar_a_excel']
+    # Selectores con búsqueda (paginados de 20 en 20) en vez de <select> con todos los pacientes
+    autocomplete_fields = ('paciente', 'servicio')
+    # Las citas se buscan por su paciente (índice de búsqueda, ver busqueda.py)
+    search_fields = ('paciente__first_name', 'paciente__last_name')
+    search_help_text = "Nombre, correo o ficha médica del paciente"
+    indice_busqueda = 'paciente'
+    campo_busqueda = 'paciente'
+    actions = ['marcar_como_finalizada', 'marcar_como_cancelada', 'exportar_a_excel', 'exportar_a_csv', 'exportar_en_segundo_plano']
+
+    # Paciente y servicio en el mismo JOIN (el checkbox de acciones y WhatsApp usan el paciente)
+    list_select_related = ('paciente', 'servicio')
+
+    # Nombre, saldo y estado de pago salen como anotaciones de la MISMA consulta
+    # del listado: ninguna columna vuelve a la base de datos por fila
+    def get_queryset(self, request):
+        if es_autocompletado(request):
+            # El texto de cada opción (Cita.__str__) usa el paciente: mismo JOIN
+            return super().get_queryset(request).select_related('paciente')
+        return super().get_queryset(request).annotate(
+            paciente_nombre_completo=Concat('paciente__first_name', Value(' '), 'paciente__last_name'),
+            saldo_pago=ExpressionWrapper(
+                F('pago__monto_total') - F('pago__monto_pagado'),
+                output_field=models.DecimalField(max_digits=10, decimal_places=2),
+            ),
+        )
 
     def paciente_nombre(self, obj):
-        return f"{obj.paciente.first_name} {obj.paciente.last_name}"
-    
+        return obj.paciente_nombre_completo
+    paciente_nombre.short_description = "Paciente"
+    paciente_nombre.admin_order_field = 'paciente_nombre_completo'
+
     def estado_pago_visual(self, obj):
-        if hasattr(obj, 'pago'):
-            saldo = obj.pago.saldo_pendiente
-            if saldo <= 0:
-                return format_html('<span style="color: green; font-weight: bold;">PAGADO</span>')
-            else:
-                return format_html(f'<span style="color: red; font-weight: bold;">DEBE S/ {saldo}</span>')
-        return "Sin registro"
+        saldo = obj.saldo_pago
+        if saldo is None:
+            return "Sin registro"
+        if saldo <= 0:
+            return format_html('<span style="color: green; font-weight: bold;">PAGADO</span>')
+        return format_html('<span style="color: red; font-weight: bold;">DEBE S/ {}</span>', f"{saldo:.2f}")
     estado_pago_visual.short_description = "Estado de Pago"
+    estado_pago_visual.admin_order_field = 'saldo_pago'
 
     def boton_whatsapp(self, obj):
         telefono = getattr(obj.paciente, 'telefono', '') 
@@ -89,139 +256,277 @@ class CitaAdmin(admin.ModelAdmin):
         url = f"https://wa.me/51{telefono}?text={mensaje}"
         return format_html('<a href="{}" target="_blank" style="background-color: #25D366; color: white; padding: 4px 12px; border-radius: 20px; text-decoration: none; font-weight: bold; font-size: 12px;">WhatsApp</a>', url)
 
+    def _actualizar_estado(self, queryset, estado):
+        # update() no dispara señales: sincronizamos a mano la agenda y el portal
+        afectadas = list(queryset.values_list('pk', 'fecha', 'paciente_id'))
+        queryset.update(estado=estado)
+        agenda.recalcular_fechas(fecha for _, fecha, _ in afectadas)
+        resumenes.recalcular_citas(fecha for _, fecha, _ in afectadas)
+        portal.invalidar_pacientes(paciente for _, _, paciente in afectadas)
+        return [pk for pk, _, _ in afectadas]
+
     @admin.action(description='✅ Finalizar Citas')
     def marcar_como_finalizada(self, request, queryset):
-        queryset.update(estado='finalizada')
+        citas = self._actualizar_estado(queryset, 'finalizada')
+        inventario.descontar_materiales(citas, request.user) # un descuento de stock para todo el lote
 
     @admin.action(description='❌ Cancelar Citas')
     def marcar_como_cancelada(self, request, queryset):
-        queryset.update(estado='cancelada')
+        self._actualizar_estado(queryset, 'cancelada') # también libera los turnos en la agenda
+
+    # --- EXPORTACIONES (ver exportacion.py): una sola consulta y envío en streaming ---
+    def _exportar(self, request, queryset, formato):
+        # Selecciones enormes (p. ej. un año completo) se generan en segundo plano
+        if queryset.count() > getattr(settings, 'EXPORTACION_MAX_DIRECTA', 50000):
+            return self.exportar_en_segundo_plano(request, queryset, formato)
+        return exportacion.respuesta_exportacion(queryset, formato)
 
     @admin.action(description='📊 Exportar a Excel')
     def exportar_a_excel(self, request, queryset):
-        response = HttpResponse(content_type='application/ms-excel')
-        response['Content-Disposition'] = f'attachment; filename="Reporte_{datetime.now().strftime("%Y%m%d")}.xls"'
-        wb = xlwt.Workbook(encoding='utf-8')
-        ws = wb.add_sheet('Citas')
-        headers = ['Paciente', 'Servicio', 'Fecha', 'Hora', 'Estado', 'Pago', 'Monto']
-        for col, h in enumerate(headers): ws.write(0, col, h, xlwt.XFStyle())
-        for row, obj in enumerate(queryset, 1):
-            pago_info = "Sin pago"
-            monto = 0
-            if hasattr(obj, 'pago'):
-                pago_info = obj.pago.estado_pago
-                monto = obj.pago.monto_pagado
-            ws.write(row, 0, f"{obj.paciente.first_name} {obj.paciente.last_name}")
-            ws.write(row, 1, obj.servicio.titulo)
-            ws.write(row, 2, str(obj.fecha))
-            ws.write(row, 3, str(obj.hora))
-            ws.write(row, 4, obj.get_estado_display())
-            ws.write(row, 5, pago_info)
-            ws.write(row, 6, str(monto))
-        wb.save(response)
-        return response
+        return self._exportar(request, queryset, 'xlsx')
+
+    @admin.action(description='📄 Exportar a CSV')
+    def exportar_a_csv(self, request, queryset):
+        return self._exportar(request, queryset, 'csv')
+
+    @admin.action(description='⏳ Exportar a Excel en segundo plano')
+    def exportar_en_segundo_plano(self, request, queryset, formato='xlsx'):
+        # Se encola la descripción de la selección (filtros del listado + marcados), no la consulta
+        todas = request.POST.get('select_across') == '1'
+        seleccion = None if todas else [int(pk) for pk in request.POST.getlist(helpers.ACTION_CHECKBOX_NAME)]
+        trabajo = exportacion.solicitar_exportacion(formato, request.user, dict(request.GET.lists()), seleccion)
+        url = reverse('admin:core_exportacion_changelist')
+        self.message_user(request, format_html(
+            'La exportación #{} quedó en cola. Podrás descargarla desde <a href="{}">Exportaciones de Citas</a> en unos segundos.',
+            trabajo.id, url,
+        ))
+
+    # --- ANALÍTICA (ver analitica.py): reportes calculados con NumPy ---
+    def get_urls(self):
+        return [
+            path('analitica/', self.admin_site.admin_view(self.analitica), name='core_cita_analitica'),
+        ] + super().get_urls()
+
+    def analitica(self, request):
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        contexto = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Analítica de la Clínica',
+            'informe': analitica.informe(actualizar='actualizar' in request.GET),
+        }
+        return TemplateResponse(request, 'admin/core/cita/analitica.html', contexto)
 
 @admin.register(Pago)
-class PagoAdmin(admin.ModelAdmin):
-    list_display = ('cita', 'monto_total', 'monto_pagado', 'saldo_pendiente', 'metodo', 'fecha_pago')
-    list_filter = ('metodo', 'fecha_pago')
+class PagoAdmin(PaginacionKeysetMixin, admin.ModelAdmin):
+    list_display = ('cita', 'monto_total', 'monto_pagado', 'saldo_visual', 'metodo', 'fecha_pago')
+    list_filter = (EstadoPagoFilter, 'metodo', 'fecha_pago')
+    ordering = ('-fecha_pago', '-id')  # índice pago_fecha_idx
+    list_select_related = ('cita__paciente',)
+    autocomplete_fields = ('cita',)
+
+    def get_queryset(self, request):
+        # Saldo y estado calculados en SQL (ver caja.py): se pueden filtrar y ordenar
+        return caja.con_saldo(super().get_queryset(request))
+
+    def saldo_visual(self, obj):
+        return f"{obj.saldo:.2f}"
+    saldo_visual.short_description = "Saldo Pendiente"
+    saldo_visual.admin_order_field = 'saldo'
+
+    # --- CIERRE DE CAJA (reporte por rango de fechas) ---
+    def get_urls(self):
+        return [
+            path('cierre-de-caja/', self.admin_site.admin_view(self.cierre_de_caja), name='core_pago_cierre'),
+        ] + super().get_urls()
+
+    def cierre_de_caja(self, request):
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        hoy = timezone.localdate()
+        desde, hasta = hoy.replace(day=1), hoy  # por defecto, el mes en curso
+        form = CierreCajaForm(request.GET or None)
+        if form.is_valid():
+            desde = form.cleaned_data['desde'] or desde
+            hasta = form.cleaned_data['hasta'] or hasta
+        contexto = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Cierre de Caja',
+            'form': form,
+            'cierre': caja.cierre_de_caja(desde, hasta),
+            'cuentas': caja.cuentas_por_cobrar(),
+            'deudores': caja.deudores()[:MAX_DEUDORES_CIERRE],
+        }
+        return TemplateResponse(request, 'admin/core/pago/cierre_caja.html', contexto)
 
 @admin.register(Documento)
 class DocumentoAdmin(admin.ModelAdmin):
-    list_display = ('titulo', 'paciente', 'fecha_subida')
+    list_display = ('titulo', 'paciente', 'fecha_subida', enlace_documento)
+    list_select_related = ('paciente',)
+    readonly_fields = (enlace_documento,)
+    autocomplete_fields = ('paciente',)
+
+@admin.register(ArchivoDeduplicado)
+class ArchivoDeduplicadoAdmin(admin.ModelAdmin):
+    """ Solo lectura: las referencias las llevan las señales y la limpieza `manage.py limpiar_archivos` """
+    list_display = ('nombre', 'tamano', 'referencias', 'creado', 'usado')
+    list_filter = ('referencias',)
+    search_fields = ('nombre',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
 
 # ---------------------------------------------------------
 # 3. CONFIGURACIÓN DE INVENTARIO 📦
 # ---------------------------------------------------------
+class MovimientoStockInline(admin.TabularInline):
+    """ Solo para registrar movimientos nuevos; el historial no se edita """
+    model = MovimientoStock
+    form = MovimientoStockForm
+    formset = MovimientoStockFormSet
+    extra = 1
+    can_delete = False
+    verbose_name_plural = "Registrar movimiento (entrada, consumo o ajuste)"
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).none()
+
 @admin.register(Insumo)
 class InsumoAdmin(admin.ModelAdmin):
-    list_display = ('nombre', 'cantidad_visual', 'unidad', 'fecha_vencimiento', 'estado_visual')
-    list_filter = ('unidad',)
+    list_display = ('nombre', 'cantidad_visual', 'unidad', 'fecha_vencimiento', 'estado_visual', 'agotamiento_estimado')
+    list_filter = ('estado_stock', 'unidad')
     search_fields = ('nombre',)
     ordering = ('cantidad',)
+    inlines = [MovimientoStockInline]
+
+    def get_readonly_fields(self, request, obj=None):
+        # Una vez creado, el stock solo cambia por movimientos del kardex (inventario.py)
+        if obj is None:
+            return ()
+        return ('cantidad', 'demanda_programada', 'reposicion_estimada', 'agotamiento_estimado', 'ultimos_movimientos')
+
+    def get_inlines(self, request, obj):
+        return self.inlines if obj else []
+
+    def changelist_view(self, request, extra_context=None):
+        extra_context = {**(extra_context or {}), 'alertas': inventario.alertas()}
+        return super().changelist_view(request, extra_context=extra_context)
+
+    def save_formset(self, request, form, formset, change):
+        if formset.model is not MovimientoStock:
+            return super().save_formset(request, form, formset, change)
+        formset.save(commit=False)  # deja listos los datos del historial del admin
+        # El stock ya se comprobó en MovimientoStockFormSet.clean (con la fila bloqueada)
+        formset.new_objects = [
+            inventario.registrar_movimiento(
+                form.instance, formulario.cleaned_data['tipo'], formulario.cantidad_con_signo(),
+                formulario.cleaned_data['motivo'], request.user,
+            )
+            for formulario in formset.movimientos()
+        ]
 
     def cantidad_visual(self, obj):
         if obj.cantidad <= obj.stock_minimo:
             return format_html('<span style="color: red; font-weight: bold;">{}</span>', obj.cantidad)
         return obj.cantidad
     cantidad_visual.short_description = "Stock Actual"
+    cantidad_visual.admin_order_field = 'cantidad'
 
     def estado_visual(self, obj):
-        if obj.cantidad == 0:
+        if obj.estado_stock == 'AGOTADO':
             return format_html('<span style="background-color: red; color: white; padding: 3px 10px; border-radius: 10px;">AGOTADO</span>')
-        elif obj.cantidad <= obj.stock_minimo:
+        elif obj.estado_stock == 'BAJO':
             return format_html('<span style="background-color: orange; color: black; padding: 3px 10px; border-radius: 10px;">BAJO STOCK</span>')
         return format_html('<span style="color: green;">✔ Disponible</span>')
     estado_visual.short_description = "Estado"
+    estado_visual.admin_order_field = 'estado_stock'
+
+    def ultimos_movimientos(self, obj):
+        movimientos = obj.movimientos.select_related('usuario')[:MAX_MOVIMIENTOS_FICHA]
+        filas = format_html_join(
+            '', '<tr><td>{}</td><td>{}</td><td style="text-align: right;">{:+d}</td><td style="text-align: right;">{}</td><td>{}</td><td>{}</td></tr>',
+            (
+                (timezone.localtime(m.creado).strftime('%d/%m/%Y %H:%M'), m.get_tipo_display(), m.cantidad,
+                 m.stock_resultante, m.motivo, m.usuario or '-')
+                for m in movimientos
+            ),
+        )
+        enlace = reverse('admin:core_movimientostock_changelist') + f'?insumo__id__exact={obj.pk}'
+        return format_html(
+            '<table class="table table-sm"><thead><tr><th>Fecha</th><th>Tipo</th><th>Cantidad</th><th>Stock</th>'
+            '<th>Motivo</th><th>Usuario</th></tr></thead><tbody>{}</tbody></table><a href="{}">Ver kardex completo</a>',
+            filas, enlace,
+        )
+    ultimos_movimientos.short_description = "Últimos movimientos"
+
+@admin.register(MovimientoStock)
+class MovimientoStockAdmin(admin.ModelAdmin):
+    """ Kardex de solo lectura: los movimientos se registran desde la ficha del insumo """
+    list_display = ('creado', 'insumo', 'tipo', 'cantidad', 'stock_resultante', 'motivo', 'usuario')
+    list_filter = ('tipo', 'creado', 'insumo')
+    list_select_related = ('insumo', 'usuario')
+    search_fields = ('insumo__nombre', 'motivo')
+    date_hierarchy = 'creado'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
 
 # ---------------------------------------------------------
 # 4. CONFIGURACIÓN DE RECETAS 💊 (CON PDF)
 # ---------------------------------------------------------
 @admin.register(Receta)
-class RecetaAdmin(admin.ModelAdmin):
+class RecetaAdmin(PaginacionKeysetMixin, BusquedaIndexadaMixin, admin.ModelAdmin):
     list_display = ('paciente', 'cita', 'fecha_emision', 'proxima_cita')
     list_filter = ('fecha_emision',)
-    search_fields = ('paciente__first_name', 'diagnostico', 'medicamentos')
+    ordering = ('-fecha_emision', '-id')  # índice receta_fecha_idx
+    search_fields = ('paciente__first_name', 'paciente__last_name', 'diagnostico', 'medicamentos')
+    search_help_text = "Nombre del paciente, diagnóstico o medicamentos (sin importar tildes)"
+    indice_busqueda = 'receta'
+    autocomplete_fields = ('paciente', 'cita')
+    list_select_related = ('paciente', 'cita__paciente')
     readonly_fields = ('fecha_emision',)
     
-    actions = ['imprimir_receta_pdf'] 
+    actions = ['imprimir_receta_pdf', 'imprimir_recetas_zip'] 
     
     formfield_overrides = {
         models.TextField: {'widget': forms.Textarea(attrs={'rows': 10, 'cols': 80})},
     }
 
-    # --- FUNCIÓN GENERADORA DE PDF ---
+    # --- PDF (mismo dibujo y caché que el portal del paciente, ver recetas_pdf.py) ---
     @admin.action(description='🖨️ Imprimir Receta (PDF)')
     def imprimir_receta_pdf(self, request, queryset):
-        buffer = io.BytesIO()
-        p = canvas.Canvas(buffer, pagesize=A4)
-        width, height = A4
-
-        for receta in queryset:
-            # ENCABEZADO
-            p.setFont("Helvetica-Bold", 16)
-            p.drawString(50, height - 50, "CLÍNICA DENTAL DRA. JAZMIN")
-            p.setFont("Helvetica", 10)
-            p.drawString(50, height - 70, "Av. Principal 123 - Lima, Perú | Tel: 999-999-999")
-            p.line(50, height - 80, width - 50, height - 80)
-
-            # DATOS PACIENTE
-            p.setFont("Helvetica-Bold", 12)
-            p.drawString(50, height - 110, f"PACIENTE: {receta.paciente.first_name} {receta.paciente.last_name}")
-            p.setFont("Helvetica", 10)
-            p.drawString(400, height - 110, f"FECHA: {receta.fecha_emision.strftime('%d/%m/%Y')}")
-            
-            # DIAGNÓSTICO
-            p.setFont("Helvetica-Bold", 11)
-            p.drawString(50, height - 150, "DIAGNÓSTICO:")
-            p.setFont("Helvetica", 10)
-            p.drawString(50, height - 165, receta.diagnostico)
-
-            # MEDICAMENTOS
-            p.setFont("Helvetica-Bold", 11)
-            p.drawString(50, height - 200, "INDICACIONES MÉDICAS (RP):")
-            
-            text_object = p.beginText(50, height - 220)
-            text_object.setFont("Helvetica", 10)
-            lines = receta.medicamentos.split('\n')
-            for line in lines:
-                text_object.textLine(line)
-            p.drawText(text_object)
-
-            # PIE DE PÁGINA
-            p.line(50, 150, 250, 150)
-            p.setFont("Helvetica", 9)
-            p.drawString(80, 135, "Firma Dra. Jazmín")
-            p.drawString(50, 50, "Nota: Esta receta es válida por 30 días.")
-            if receta.proxima_cita:
-                p.drawString(50, 35, f"Próxima cita sugerida: {receta.proxima_cita}")
-            
-            p.showPage()
-
-        p.save()
-        buffer.seek(0)
-        response = HttpResponse(buffer, content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="Receta_{datetime.now().strftime("%Y%m%d")}.pdf"'
+        total = queryset.count()
+        if total > recetas_pdf.MAX_RECETAS_PDF_COMBINADO:
+            return self.imprimir_recetas_zip(request, queryset)
+
+        nombre = f"Receta_{datetime.now().strftime('%Y%m%d')}.pdf"
+        recetas = list(queryset.select_related('paciente'))
+        if total == 1:
+            return recetas_pdf.respuesta_pdf(request, recetas[0], nombre, adjunto=True)
+
+        response = HttpResponse(recetas_pdf.renderizar_recetas(recetas), content_type='application/pdf')
+        response['Content-Disposition'] = f'attachment; filename="{nombre}"'
+        return response
+
+    # --- IMPRESIÓN MASIVA: ZIP con un PDF por paciente, generado en paralelo y enviado en streaming ---
+    @admin.action(description='🗂️ Imprimir recetas por paciente (ZIP)')
+    def imprimir_recetas_zip(self, request, queryset):
+        response = StreamingHttpResponse(recetas_pdf.zip_recetas(queryset), content_type='application/zip')
+        response['Content-Disposition'] = f'attachment; filename="Recetas_{datetime.now().strftime("%Y%m%d")}.zip"'
         return response
 
 # ---------------------------------------------------------
@@ -229,22 +534,135 @@ class RecetaAdmin(admin.ModelAdmin):
 # ---------------------------------------------------------
 @admin.register(Producto)
 class ProductoAdmin(admin.ModelAdmin):
+    form = ProductoAdminForm
     list_display = ('nombre', 'precio', 'stock', 'imagen_preview')
     search_fields = ('nombre',)
-    
+
+    def save_model(self, request, obj, form, change):
+        # La tienda reserva stock mientras el formulario está abierto: guardamos
+        # solo los campos editados y el stock como diferencia con F(), sin pisar esas reservas
+        if not change:
+            return super().save_model(request, obj, form, change)
+        campos = [campo for campo in form.changed_data if campo != 'stock']
+        if campos:
+            obj.save(update_fields=campos)
+        if 'stock' in form.changed_data:
+            Producto.objects.filter(pk=obj.pk).update(stock=Greatest(F('stock') + form.diferencia_stock(), 0))
+        obj.refresh_from_db(fields=['stock'])
+
     def imagen_preview(self, obj):
         if obj.imagen:
-            return format_html('<img src="{}" width="50" height="50" style="border-radius:5px;" />', obj.imagen.url)
+            # Miniatura de 50x50 (y 100x100 para pantallas retina), no la foto original
+            return imagenes.picture(obj.imagen, 'miniatura', alt=obj.nombre, clase='rounded')
         return "No img"
     imagen_preview.short_description = "Vista Previa"
 
+# ---------------------------------------------------------
+# 4.1 PEDIDOS DE LA TIENDA 🧾
+# ---------------------------------------------------------
+class ItemPedidoInline(admin.TabularInline):
+    model = ItemPedido
+    fields = ('producto', 'cantidad', 'precio_unitario')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False  # los productos los fija la reserva (pedidos.py)
+
+class PagoPedidoInline(admin.StackedInline):
+    model = PagoPedido
+    can_delete = False
+    verbose_name_plural = 'Registro de Pago (Caja)'
+
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super().get_formset(request, obj, **kwargs)
+        if obj is not None:
+            formset.form.base_fields['monto_total'].initial = obj.total
+        return formset
+
+@admin.register(Pedido)
+class PedidoAdmin(admin.ModelAdmin):
+    list_display = ('id', 'cliente', 'total', 'estado', 'creado', 'reservado_hasta', 'pagado_en')
+    list_filter = ('estado', 'creado')
+    list_select_related = ('cliente',)
+    search_fields = ('id', 'cliente__first_name', 'cliente__last_name', 'cliente__username')
+    readonly_fields = ('cliente', 'total', 'estado', 'creado', 'reservado_hasta', 'pagado_en')
+    inlines = [ItemPedidoInline, PagoPedidoInline]
+    actions = ['cancelar_pedidos']
+
+    def has_add_permission(self, request):
+        return False  # se crean desde la tienda
+
+    @admin.action(description='❌ Cancelar y devolver el stock')
+    def cancelar_pedidos(self, request, queryset):
+        reservados = queryset.filter(estado=Pedido.RESERVADO).annotate(
+            con_abono=Exists(PagoPedido.objects.filter(pedido=OuterRef('pk')))
+        )
+        cancelados = [pedido for pedido in reservados if pedidos.cancelar_pedido(pedido, con_abono=True)]
+        mensaje = f"{len(cancelados)} pedido(s) cancelado(s) y su stock devuelto. Los pagados no se tocan."
+        a_devolver = [f"#{pedido.pk}" for pedido in cancelados if pedido.con_abono]
+        if a_devolver:
+            mensaje += f" Tenían un abono que hay que devolver al cliente: {', '.join(a_devolver)}."
+        self.message_user(request, mensaje, messages.WARNING if a_devolver else messages.SUCCESS)
+
+# ---------------------------------------------------------
+# 5.1 BANDEJA DE SALIDA DE CORREOS ✉️
+# ---------------------------------------------------------
+@admin.register(CorreoPendiente)
+class CorreoPendienteAdmin(admin.ModelAdmin):
+    list_display = ('asunto', 'destinatarios', 'estado', 'intentos', 'proximo_intento', 'enviado_en')
+    list_filter = ('estado',)
+    search_fields = ('destinatarios', 'asunto')
+    readonly_fields = ('intentos', 'ultimo_error', 'creado', 'enviado_en')
+    actions = ['reintentar_envio']
+
+    @admin.action(description='🔁 Reintentar envío')
+    def reintentar_envio(self, request, queryset):
+        queryset.exclude(estado=CorreoPendiente.ENVIADO).update(
+            estado=CorreoPendiente.PENDIENTE, intentos=0, proximo_intento=timezone.now(), lote_envio=''
+        )
+
+# ---------------------------------------------------------
+# 5.2 EXPORTACIONES EN SEGUNDO PLANO 📤
+# ---------------------------------------------------------
+@admin.register(Exportacion)
+class ExportacionAdmin(admin.ModelAdmin):
+    list_display = ('id', 'formato', 'estado', 'filas', 'solicitado_por', 'creado', 'terminado', 'boton_descarga')
+    list_filter = ('estado', 'formato')
+    readonly_fields = ('formato', 'estado', 'filas', 'intentos', 'solicitado_por', 'error', 'creado', 'terminado')
+    exclude = ('archivo',)
+
+    def has_add_permission(self, request):
+        return False  # se crean desde las acciones de exportación de Citas
+
+    def get_urls(self):
+        return [
+            path('<int:pk>/descargar/', self.admin_site.admin_view(self.descargar), name='core_exportacion_descargar'),
+        ] + super().get_urls()
+
+    def descargar(self, request, pk):
+        trabajo = get_object_or_404(Exportacion, pk=pk, estado=Exportacion.LISTA)
+        if not self.has_view_permission(request, trabajo):
+            raise PermissionDenied
+        return FileResponse(trabajo.archivo.open('rb'), as_attachment=True, filename=os.path.basename(trabajo.archivo.name))
+
+    def boton_descarga(self, obj):
+        if obj.estado != Exportacion.LISTA:
+            return "-"
+        return format_html('<a href="{}">⬇️ Descargar</a>', reverse('admin:core_exportacion_descargar', args=[obj.pk]))
+    boton_descarga.short_description = "Archivo"
+
 # ---------------------------------------------------------------
 # 6. USUARIOS
 # ---------------------------------------------------------------
 @admin.register(Paciente)
-class PacienteAdmin(admin.ModelAdmin):
+class PacienteAdmin(BusquedaIndexadaMixin, admin.ModelAdmin):
     form = PacienteAdminForm 
     list_display = ('username', 'first_name', 'last_name', 'email', 'es_activo')
+    search_fields = ('username', 'first_name', 'last_name', 'email', 'ficha_medica__alergias_detalle', 'ficha_medica__enfermedad_detalle')
+    search_help_text = "Nombre, correo, alergias, enfermedades o medicamentos de la ficha médica"
+    indice_busqueda = 'paciente'
     
     # AGREGAMOS FichaMedicaInline AQUÍ
     inlines = [FichaMedicaInline, DocumentoInline]
@@ -263,6 +681,17 @@ try: admin.site.unregister(User)
 except admin.sites.NotRegistered: pass
 
 @admin.register(User)
-class StaffUserAdmin(UserAdmin):
+class StaffUserAdmin(BusquedaIndexadaMixin, UserAdmin):
+    indice_busqueda = 'paciente'  # el índice tiene a todos los usuarios
+
     def get_queryset(self, request):
-        return super().get_queryset(request).filter(is_staff=True)
\ No newline at end of file
+        if es_autocompletado(request):
+            # Los selectores "Paciente" de citas, recetas y documentos buscan aquí (el modelo es User)
+            return super().get_queryset(request).filter(is_staff=False)
+        return super().get_queryset(request).filter(is_staff=True)
+
+    def has_view_permission(self, request, obj=None):
+        # Quien puede ver pacientes puede elegirlos en un selector, aunque no gestione al personal
+        if es_autocompletado(request) and request.user.has_perm('core.view_paciente'):
+            return True
+        return super().has_view_permission(request, obj)
\ No newline at end of file
@@ -0,0 +1,238 @@
+"""
+Índice de disponibilidad de la agenda.
+
+Cada día de atención se divide en turnos de DURACION_TURNO_MINUTOS a partir
+del HORARIO_CLINICA. Los turnos ocupados de un día se guardan como un mapa de
+bits en una sola fila de `Disponibilidad` (bit i = turno i ocupado), de modo
+que validar una reserva o listar los huecos libres de un rango de fechas no
+requiere recorrer la tabla de citas.
+"""
+import random
+import time as reloj
+from datetime import date, datetime, time, timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, OperationalError, transaction
+from django.db.models import F
+from django.db.models.lookups import Exact
+
+# Estados que NO bloquean el turno en la agenda
+ESTADOS_LIBERADOS = ('cancelada',)
+
+# El mapa se guarda en un BigIntegerField con signo: usamos como máximo 63 bits
+MAX_TURNOS_POR_DIA = 63
+
+# Reintentos ante bloqueos de la base de datos (SQLite "database is locked",
+# deadlocks/serialización en PostgreSQL) al reservar
+REINTENTOS_RESERVA = 5
+ESPERA_BASE_SEGUNDOS = 0.02
+
+
+class TurnoOcupado(Exception):
+    """ El turno solicitado ya fue tomado por otra reserva """
+
+
+def _a_time(valor):
+    if isinstance(valor, time):
+        return valor
+    return datetime.strptime(valor, '%H:%M').time()
+
+
+def duracion_turno():
+    return timedelta(minutes=getattr(settings, 'DURACION_TURNO_MINUTOS', 30))
+
+
+def horario_del_dia(fecha):
+    """ Devuelve (apertura, cierre) del día o None si la clínica no atiende """
+    horario = getattr(settings, 'HORARIO_CLINICA', {}).get(fecha.weekday())
+    if not horario:
+        return None
+    return _a_time(horario[0]), _a_time(horario[1])
+
+
+def turnos_del_dia(fecha):
+    """ Lista de horas de inicio de cada turno del día (vacía si está cerrado) """
+    horario = horario_del_dia(fecha)
+    if horario is None:
+        return []
+    apertura, cierre = horario
+    paso = duracion_turno()
+    actual = datetime.combine(fecha, apertura)
+    fin = datetime.combine(fecha, cierre)
+    turnos = []
+    while actual + paso <= fin and len(turnos) < MAX_TURNOS_POR_DIA:
+        turnos.append(actual.time())
+        actual += paso
+    return turnos
+
+
+def indice_turno(fecha, hora):
+    """ Posición del turno que contiene `hora`, o None si cae fuera del horario """
+    if not isinstance(fecha, date) or not isinstance(hora, time):
+        return None
+    horario = horario_del_dia(fecha)
+    if horario is None:
+        return None
+    apertura = horario[0]
+    segundos = (
+        datetime.combine(fecha, hora) - datetime.combine(fecha, apertura)
+    ).total_seconds()
+    if segundos < 0:
+        return None
+    indice = int(segundos // duracion_turno().total_seconds())
+    if indice >= len(turnos_del_dia(fecha)):
+        return None
+    return indice
+
+
+def inicio_turno(fecha, hora):
+    """ Hora de inicio del turno que contiene `hora` (fuera de horario, la propia hora) """
+    indice = indice_turno(fecha, hora)
+    return hora if indice is None else turnos_del_dia(fecha)[indice]
+
+
+def rango_turno(fecha, hora):
+    """ (inicio, fin) del turno que contiene `hora` """
+    inicio = turnos_del_dia(fecha)[indice_turno(fecha, hora)]
+    fin = (datetime.combine(fecha, inicio) + duracion_turno()).time()
+    return inicio, fin
+
+
+def calcular_mapa(fecha, horas):
+    """ Construye el mapa de bits de un día a partir de las horas ocupadas """
+    mapa = 0
+    for hora in horas:
+        indice = indice_turno(fecha, hora)
+        if indice is not None:
+            mapa |= 1 << indice
+    return mapa
+
+
+def mapa_del_dia(fecha):
+    from .models import Disponibilidad
+    mapa = Disponibilidad.objects.filter(fecha=fecha).values_list('ocupados', flat=True).first()
+    return mapa or 0
+
+
+def turno_ocupado(fecha, hora):
+    """
+    True/False según el índice. Devuelve None cuando la hora no pertenece a
+    ningún turno (fuera de horario) y el índice no puede responder.
+    """
+    indice = indice_turno(fecha, hora)
+    if indice is None:
+        return None
+    return bool(mapa_del_dia(fecha) & (1 << indice))
+
+
+def recalcular_dia(fecha):
+    """
+    Reconstruye el mapa de un día desde la tabla de citas. Primero bloquea la
+    fila del día: una reserva en curso (que la actualiza en _tomar_turno) ya
+    terminó y su cita se lee, o espera y marca su bit sobre el mapa nuevo.
+    Sin el bloqueo, el mapa escrito podría borrar el bit de esa reserva.
+    """
+    from .models import Cita, Disponibilidad
+    if not isinstance(fecha, date):
+        return
+    with transaction.atomic():
+        # La fila se conserva aunque quede en 0: reservar_cita hace un UPDATE
+        # condicional sobre ella y no debe desaparecer entre dos reservas
+        dia, _ = Disponibilidad.objects.select_for_update().get_or_create(fecha=fecha)
+        horas = (
+            Cita.objects.filter(fecha=fecha)
+            .exclude(estado__in=ESTADOS_LIBERADOS)
+            .values_list('hora', flat=True)
+        )
+        Disponibilidad.objects.filter(pk=dia.pk).update(ocupados=calcular_mapa(fecha, horas))
+
+
+def recalcular_fechas(fechas):
+    for fecha in set(fechas):
+        recalcular_dia(fecha)
+
+
+def turnos_libres(desde, hasta):
+    """
+    Diccionario {fecha: [horas libres]} para el rango [desde, hasta].
+    Una sola consulta trae los mapas de todo el rango.
+    """
+    from .models import Disponibilidad
+    mapas = dict(
+        Disponibilidad.objects.filter(fecha__range=(desde, hasta)).values_list('fecha', 'ocupados')
+    )
+    return _libres_por_dia(desde, hasta, mapas)
+
+
+async def aturnos_libres(desde, hasta):
+    """ Versión asíncrona de `turnos_libres` (ORM asíncrono, para las vistas ASGI) """
+    from .models import Disponibilidad
+    consulta = Disponibilidad.objects.filter(fecha__range=(desde, hasta)).values_list('fecha', 'ocupados')
+    mapas = {fecha: ocupados async for fecha, ocupados in consulta}
+    return _libres_por_dia(desde, hasta, mapas)
+
+
+def _libres_por_dia(desde, hasta, mapas):
+    resultado = {}
+    fecha = desde
+    while fecha <= hasta:
+        mapa = mapas.get(fecha, 0)
+        resultado[fecha] = [
+            hora for i, hora in enumerate(turnos_del_dia(fecha))
+            if not mapa & (1 << i)
+        ]
+        fecha += timedelta(days=1)
+    return resultado
+
+
+# ---------------------------------------------------------
+# RESERVA ATÓMICA DE TURNOS
+# ---------------------------------------------------------
+def _tomar_turno(fecha, indice):
+    """
+    Marca el bit del turno con un UPDATE condicional:
+        UPDATE ... SET ocupados = ocupados | bit WHERE fecha = X AND ocupados & bit = 0
+    Si otra reserva ganó el turno, la fila no cumple la condición y no se toca.
+    """
+    from .models import Disponibilidad
+    bit = 1 << indice
+    actualizadas = (
+        Disponibilidad.objects
+        .filter(Exact(F('ocupados').bitand(bit), 0), fecha=fecha)
+        .update(ocupados=F('ocupados').bitor(bit))
+    )
+    return actualizadas == 1
+
+
+def reservar_cita(paciente, servicio, fecha, hora, estado='pendiente'):
+    """
+    Crea la cita garantizando que nadie más se quede con el mismo turno,
+    aunque la petición llegue a la vez a varios workers de gunicorn.
+
+    1. Se toma el turno en el índice con un UPDATE condicional (el que pierde
+       se entera en ese momento, sin recorrer la tabla de citas).
+    2. Se inserta la cita en la misma transacción; la restricción única de
+       (fecha, turno) en la base de datos es la última barrera.
+    Los bloqueos transitorios de la base de datos se reintentan con espera
+    exponencial. Lanza TurnoOcupado si el turno ya no está libre.
+    """
+    from .models import Cita, Disponibilidad
+
+    indice = indice_turno(fecha, hora)
+    for intento in range(REINTENTOS_RESERVA):
+        try:
+            if indice is not None:
+                Disponibilidad.objects.get_or_create(fecha=fecha)
+            with transaction.atomic():
+                if indice is not None and not _tomar_turno(fecha, indice):
+                    raise TurnoOcupado(fecha, hora)
+                cita = Cita(paciente=paciente, servicio=servicio, fecha=fecha, hora=hora, estado=estado)
+                cita._turno_reservado = True
+                cita.save()
+                return cita
+        except IntegrityError:
+            raise TurnoOcupado(fecha, hora)
+        except OperationalError:
+            if intento == REINTENTOS_RESERVA - 1:
+                raise
+            reloj.sleep(ESPERA_BASE_SEGUNDOS * (2 ** intento) * (1 + random.random()))
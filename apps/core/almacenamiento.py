@@ -0,0 +1,153 @@
+"""
+Almacén deduplicado de los documentos clínicos (Documento.archivo).
+
+El personal suele subir la misma radiografía varias veces (a otro paciente
+de la familia, otra vez al mismo estudio...). Antes cada subida era una copia
+más en historias_clinicas/; ahora:
+
+  * _save() calcula el SHA-256 de la subida leyéndola por bloques de
+    TAMANO_BLOQUE, sin cargarla en memoria. Las subidas grandes ya están en
+    un temporal de Django: se leen una vez para el hash y se mueven (rename);
+    las pequeñas se copian a un temporal calculando el hash en la misma
+    pasada. El nombre final es historias_clinicas/ab/<sha256>.<ext>: si ya
+    existe, el temporal se descarta y el Documento apunta al mismo archivo.
+  * Cada archivo único tiene una fila ArchivoDeduplicado con cuántos
+    Documento lo usan (`referencias`); las señales de Documento la suben y
+    la bajan con UPDATE ... F() al crear, cambiar o borrar documentos.
+  * recolectar() (`manage.py limpiar_archivos`) borra los archivos sin
+    referencias. Un archivo recién subido todavía no tiene su Documento
+    guardado, por eso solo se recogen los que llevan GRACIA sin usarse.
+
+Los archivos subidos antes de este cambio conservan su nombre y no entran en
+la recolección (no tienen fila ArchivoDeduplicado).
+"""
+import hashlib
+import os
+import posixpath
+import tempfile
+from datetime import timedelta
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+TAMANO_BLOQUE = 1024 * 1024
+CARPETA_TEMPORAL = '.subiendo'
+
+# Un archivo sin referencias se conserva este tiempo desde su última subida
+GRACIA = timedelta(hours=1)
+
+
+class AlmacenDeduplicado(FileSystemStorage):
+    """ FileSystemStorage que guarda cada contenido una sola vez, bajo su SHA-256 """
+
+    def get_available_name(self, name, max_length=None):
+        return name  # el nombre final sale del contenido (ver _save)
+
+    def _save(self, name, content):
+        # Importación diferida: models.py usa este almacén en Documento
+        from .models import ArchivoDeduplicado
+
+        if hasattr(content, 'temporary_file_path'):
+            # Subida grande que Django ya dejó en disco: se lee solo para el hash y luego se mueve
+            origen, propio = content.temporary_file_path(), False
+            clave, tamano = _hash_archivo(origen)
+        else:
+            (origen, clave, tamano), propio = self._volcar(content), True
+        try:
+            extension = os.path.splitext(name)[1].lower()[:10]
+            nombre = posixpath.join(posixpath.dirname(name), clave[:2], clave + extension)
+            ruta = self.path(nombre)
+
+            # La fila primero, con un UPDATE que la bloquea: si recolectar() la está
+            # borrando, espera a que termine y no encuentra nada (se crea de nuevo y
+            # se vuelve a escribir el archivo); si no, la deja usada ahora y el
+            # DELETE condicional de recolectar() ya no la toma. Un SELECT previo
+            # (get_or_create) no basta: con READ COMMITTED la fila puede borrarse
+            # entre la lectura y el UPDATE.
+            with transaction.atomic():
+                if not ArchivoDeduplicado.objects.filter(nombre=nombre).update(usado=timezone.now()):
+                    ArchivoDeduplicado.objects.get_or_create(nombre=nombre, defaults={'tamano': tamano})
+                if not os.path.exists(ruta):
+                    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+                    file_move_safe(origen, ruta, allow_overwrite=True)  # un rename si está en el mismo disco
+                    if self.file_permissions_mode is not None:
+                        os.chmod(ruta, self.file_permissions_mode)
+        finally:
+            if propio and os.path.exists(origen):
+                os.remove(origen)
+        return nombre
+
+    def _volcar(self, content):
+        """ Copia la subida a un temporal del almacén calculando el hash en la misma pasada """
+        carpeta_temporal = self.path(CARPETA_TEMPORAL)
+        os.makedirs(carpeta_temporal, exist_ok=True)
+        descriptor, temporal = tempfile.mkstemp(dir=carpeta_temporal)
+        try:
+            digest = hashlib.sha256()
+            with os.fdopen(descriptor, 'wb') as destino:
+                for bloque in content.chunks(TAMANO_BLOQUE):
+                    digest.update(bloque)
+                    destino.write(bloque)
+                return temporal, digest.hexdigest(), destino.tell()
+        except BaseException:
+            os.remove(temporal)
+            raise
+
+
+def _hash_archivo(ruta):
+    digest, tamano = hashlib.sha256(), 0
+    with open(ruta, 'rb') as origen:
+        while bloque := origen.read(TAMANO_BLOQUE):
+            digest.update(bloque)
+            tamano += len(bloque)
+    return digest.hexdigest(), tamano
+
+
+def almacen_documentos():
+    return AlmacenDeduplicado()
+
+
+# ---------------------------------------------------------
+# REFERENCIAS Y RECOLECCIÓN
+# ---------------------------------------------------------
+def cambiar_referencias(anterior, actual):
+    """ Un Documento dejó de usar `anterior` y pasó a usar `actual` (nombres; '' si ninguno) """
+    from .models import ArchivoDeduplicado
+
+    if anterior == actual:
+        return
+    if actual:
+        ArchivoDeduplicado.objects.filter(nombre=actual).update(referencias=F('referencias') + 1)
+    if anterior:
+        ArchivoDeduplicado.objects.filter(nombre=anterior, referencias__gt=0).update(referencias=F('referencias') - 1)
+
+
+def recontar():
+    """ Recalcula todas las referencias desde los Documento (por si algo las desfasó). Devuelve cuántas cambiaron """
+    from .models import ArchivoDeduplicado, Documento
+
+    usos = Documento.objects.filter(archivo=OuterRef('nombre')).values('archivo').annotate(total=Count('pk')).values('total')
+    reales = Coalesce(Subquery(usos), Value(0))
+    return ArchivoDeduplicado.objects.annotate(reales=reales).exclude(referencias=F('reales')).update(referencias=reales)
+
+
+def recolectar(gracia=GRACIA):
+    """ Borra los archivos sin referencias que llevan `gracia` sin subirse. Devuelve (archivos, bytes) """
+    from .models import ArchivoDeduplicado
+
+    almacen = almacen_documentos()
+    limite = timezone.now() - gracia
+    borrados = liberados = 0
+    for pk, nombre, tamano in ArchivoDeduplicado.objects.filter(referencias=0, usado__lt=limite).values_list('pk', 'nombre', 'tamano'):
+        with transaction.atomic():
+            # Misma condición en el DELETE: una subida o un Documento pudieron llegar entretanto.
+            # El DELETE bloquea la fila hasta borrar el archivo, así _save() no lo da por existente
+            if ArchivoDeduplicado.objects.filter(pk=pk, referencias=0, usado__lt=limite).delete()[0]:
+                almacen.delete(nombre)
+                borrados += 1
+                liberados += tamano
+    return borrados, liberados
@@ -2,4 +2,7 @@ from django.apps import AppConfig
 
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'apps.core'  # <--- AQUÍ ESTÁ EL CAMBIO IMPORTANTE
\ No newline at end of file
+    name = 'apps.core'  # <--- AQUÍ ESTÁ EL CAMBIO IMPORTANTE
+
+    def ready(self):
+        from . import signals  # noqa: F401  (registra los receivers)
@@ -0,0 +1,176 @@
+"""
+Búsqueda de texto completo del admin: pacientes (con su ficha médica) y recetas.
+
+Antes, buscar en Recetas era un `icontains` sobre diagnóstico y medicamentos
+(LIKE '%...%': recorre la tabla entera) y en Pacientes no había búsqueda.
+Ahora cada paciente y cada receta tiene una fila en un índice invertido:
+
+  * SQLite: tablas virtuales FTS5 con el tokenizador `unicode61
+    remove_diacritics 2` (sin distinguir mayúsculas ni acentos: "latex"
+    encuentra "Látex") e índices de prefijos para buscar mientras se escribe.
+  * PostgreSQL: tabla con una columna tsvector (configuración 'spanish', con
+    raíces: "diabético" encuentra "diabetes") y un índice GIN.
+
+El `rowid` / `id` de cada fila es el pk del paciente o de la receta, así que
+actualizar o quitar una entrada es una búsqueda por clave. Los textos se pasan
+sin acentos y en minúsculas (normalizar()) en los dos motores, también las
+consultas: cada palabra buscada es un prefijo y deben estar todas.
+
+Las señales (signals.py) mantienen el índice al guardar o borrar pacientes,
+fichas médicas y recetas; `manage.py reconstruir_busqueda` lo rehace entero
+(p. ej. tras cargas masivas con queryset.update() o SQL directo).
+"""
+import re
+import unicodedata
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models.expressions import RawSQL
+
+TABLAS = {
+    'paciente': 'core_busqueda_paciente',
+    'receta': 'core_busqueda_receta',
+}
+
+SQL = {
+    'sqlite': {
+        'crear': [
+            "CREATE VIRTUAL TABLE IF NOT EXISTS {tabla} USING fts5("
+            "texto, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')",
+        ],
+        'eliminar_tabla': "DROP TABLE IF EXISTS {tabla}",
+        'quitar': "DELETE FROM {tabla} WHERE rowid IN ({marcas})",
+        'vaciar': "DELETE FROM {tabla}",
+        'guardar': "INSERT INTO {tabla} (rowid, texto) VALUES (%s, %s)",
+        'buscar': "SELECT rowid FROM {tabla} WHERE {tabla} MATCH %s",
+    },
+    'postgresql': {
+        'crear': [
+            "CREATE TABLE IF NOT EXISTS {tabla} (id bigint PRIMARY KEY, documento tsvector NOT NULL)",
+            "CREATE INDEX IF NOT EXISTS {tabla}_documento_idx ON {tabla} USING gin (documento)",
+        ],
+        'eliminar_tabla': "DROP TABLE IF EXISTS {tabla}",
+        'quitar': "DELETE FROM {tabla} WHERE id IN ({marcas})",
+        'vaciar': "DELETE FROM {tabla}",
+        'guardar': "INSERT INTO {tabla} (id, documento) VALUES (%s, to_tsvector('spanish', %s))",
+        'buscar': "SELECT id FROM {tabla} WHERE documento @@ to_tsquery('spanish', %s)",
+    },
+}
+
+# Campos de cada índice (también sirven a las migraciones con modelos históricos)
+CAMPOS_PACIENTE = [
+    'username', 'first_name', 'last_name', 'email',
+    'ficha_medica__alergias_detalle', 'ficha_medica__enfermedad_detalle',
+    'ficha_medica__medicamentos_detalle', 'ficha_medica__observaciones',
+]
+CAMPOS_RECETA = ['paciente__first_name', 'paciente__last_name', 'diagnostico', 'medicamentos']
+
+LOTE = 1000
+
+
+def _sql(conexion, clave, indice, marcas=''):
+    sentencias = SQL[conexion.vendor][clave]
+    if isinstance(sentencias, str):
+        return sentencias.format(tabla=TABLAS[indice], marcas=marcas)
+    return [s.format(tabla=TABLAS[indice], marcas=marcas) for s in sentencias]
+
+
+def normalizar(texto):
+    """ Minúsculas y sin acentos ("Ñandú" -> "nandu"), igual al indexar y al buscar """
+    descompuesto = unicodedata.normalize('NFKD', texto.lower())
+    return ''.join(c for c in descompuesto if not unicodedata.combining(c))
+
+
+# ---------------------------------------------------------
+# TABLAS DEL ÍNDICE (MIGRACIÓN)
+# ---------------------------------------------------------
+def crear_tablas(conexion):
+    with conexion.cursor() as cursor:
+        for indice in TABLAS:
+            for sentencia in _sql(conexion, 'crear', indice):
+                cursor.execute(sentencia)
+
+
+def eliminar_tablas(conexion):
+    with conexion.cursor() as cursor:
+        for indice in TABLAS:
+            cursor.execute(_sql(conexion, 'eliminar_tabla', indice))
+
+
+# ---------------------------------------------------------
+# MANTENIMIENTO DEL ÍNDICE
+# ---------------------------------------------------------
+def _guardar(indice, filas, using):
+    """ filas: [(pk, valor, valor, ...)] con los CAMPOS del índice """
+    conexion = connections[using]
+    with conexion.cursor() as cursor:
+        for inicio in range(0, len(filas), LOTE):
+            lote = filas[inicio:inicio + LOTE]
+            cursor.execute(_sql(conexion, 'quitar', indice, ', '.join(['%s'] * len(lote))), [fila[0] for fila in lote])
+            cursor.executemany(
+                _sql(conexion, 'guardar', indice),
+                [(fila[0], normalizar(' '.join(v for v in fila[1:] if v))) for fila in lote],
+            )
+
+
+def quitar(indice, pks, using=DEFAULT_DB_ALIAS):
+    pks = list(pks)
+    if pks:
+        conexion = connections[using]
+        with conexion.cursor() as cursor:
+            cursor.execute(_sql(conexion, 'quitar', indice, ', '.join(['%s'] * len(pks))), pks)
+
+
+def actualizar_pacientes(pks, using=DEFAULT_DB_ALIAS):
+    from django.contrib.auth.models import User
+
+    _guardar('paciente', list(User.objects.using(using).filter(pk__in=list(pks)).values_list('pk', *CAMPOS_PACIENTE)), using)
+
+
+def actualizar_recetas(recetas, using=DEFAULT_DB_ALIAS):
+    """ `recetas`: pks o un queryset de Receta """
+    from .models import Receta
+
+    _guardar('receta', list(Receta.objects.using(using).filter(pk__in=recetas).values_list('pk', *CAMPOS_RECETA)), using)
+
+
+def reconstruir(User, Receta, using=DEFAULT_DB_ALIAS):
+    """ Rehace los dos índices desde cero (modelos reales o históricos). Devuelve (pacientes, recetas) """
+    conexion = connections[using]
+    with conexion.cursor() as cursor:
+        for indice in TABLAS:
+            cursor.execute(_sql(conexion, 'vaciar', indice))
+    totales = []
+    for indice, consulta in (
+        ('paciente', User.objects.using(using).order_by('pk').values_list('pk', *CAMPOS_PACIENTE)),
+        ('receta', Receta.objects.using(using).order_by('pk').values_list('pk', *CAMPOS_RECETA)),
+    ):
+        filas = list(consulta)
+        _guardar(indice, filas, using)
+        totales.append(len(filas))
+    return tuple(totales)
+
+
+# ---------------------------------------------------------
+# CONSULTAS
+# ---------------------------------------------------------
+def coincidencias(indice, consulta, using=DEFAULT_DB_ALIAS):
+    """
+    Subconsulta con los pks que contienen todas las palabras de `consulta`
+    (cada una como prefijo), para usar en .filter(pk__in=...). None si la
+    consulta no tiene ninguna palabra.
+    """
+    palabras = re.findall(r'\w+', normalizar(consulta))
+    if not palabras:
+        return None
+    conexion = connections[using]
+    if conexion.vendor == 'postgresql':
+        expresion = ' & '.join(f"{palabra}:*" for palabra in palabras)
+    else:
+        expresion = ' '.join(f'"{palabra}"*' for palabra in palabras)
+    return RawSQL(_sql(conexion, 'buscar', indice), [expresion])
+
+
+def filtrar(queryset, indice, consulta, campo='pk'):
+    """ `campo`: columna del queryset que apunta al índice (p. ej. 'paciente' para buscar citas por paciente) """
+    subconsulta = coincidencias(indice, consulta, queryset.db)
+    return queryset.none() if subconsulta is None else queryset.filter(**{f'{campo}__in': subconsulta})
@@ -0,0 +1,138 @@
+"""
+Cuentas por cobrar y cierre de caja, calculados en la base de datos.
+
+`Pago.saldo_pendiente` y `Pago.estado_pago` son propiedades de Python: sirven
+para mostrar un pago, pero no para responder "quién debe" o "cuánto entró este
+mes" sin cargar todos los pagos. Aquí el mismo criterio está escrito como
+expresiones SQL:
+  * CONDICIONES_ESTADO / ESTADO_PAGO: el estado de Pago.calcular_estado como
+    WHERE y como CASE (filtro del admin, anotaciones);
+  * cuentas_por_cobrar(): totales y deudores en un único aggregate();
+  * cierre_de_caja(): cobrado por día y método de un rango de fechas con un
+    único GROUP BY (usa el índice de fecha_pago). Los subtotales se suman en
+    Python sobre esas filas agrupadas (a lo sumo días x métodos), no sobre los
+    pagos.
+
+Los pagos cuentan en el día de `fecha_pago` (hora local), igual que en los
+resúmenes del tablero (resumenes.py).
+"""
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db.models import Case, CharField, Count, DecimalField, ExpressionWrapper, F, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .models import Pago
+
+COMPLETO, PARCIAL, PENDIENTE = 'COMPLETO', 'PARCIAL', 'PENDIENTE'
+ESTADOS_PAGO = [
+    (COMPLETO, 'Completo'),
+    (PARCIAL, 'Parcial (abonó una parte)'),
+    (PENDIENTE, 'Pendiente (sin abonos)'),
+]
+
+_DINERO = DecimalField(max_digits=12, decimal_places=2)
+_CERO = Value(Decimal('0.00'), output_field=_DINERO)
+
+SALDO = ExpressionWrapper(F('monto_total') - F('monto_pagado'), output_field=_DINERO)
+CON_DEUDA = Q(monto_pagado__lt=F('monto_total'))
+
+# Mismo criterio que Pago.calcular_estado
+CONDICIONES_ESTADO = {
+    COMPLETO: Q(monto_pagado__gte=F('monto_total')),
+    PARCIAL: CON_DEUDA & Q(monto_pagado__gt=0),
+    PENDIENTE: CON_DEUDA & Q(monto_pagado__lte=0),
+}
+ESTADO_PAGO = Case(
+    *[When(condicion, then=Value(estado)) for estado, condicion in CONDICIONES_ESTADO.items()],
+    output_field=CharField(),
+)
+
+
+def _suma(expresion, **extra):
+    return Coalesce(Sum(expresion, **extra), _CERO, output_field=_DINERO)
+
+
+def con_saldo(queryset):
+    """ Anota `saldo` y `estado` (COMPLETO / PARCIAL / PENDIENTE) calculados en SQL """
+    return queryset.annotate(saldo=SALDO, estado=ESTADO_PAGO)
+
+
+def filtrar_por_estado(queryset, estado):
+    return queryset.filter(CONDICIONES_ESTADO[estado])
+
+
+# ---------------------------------------------------------
+# CUENTAS POR COBRAR
+# ---------------------------------------------------------
+def cuentas_por_cobrar(queryset=None):
+    """ Totales de facturado, cobrado y por cobrar (una sola consulta) """
+    queryset = Pago.objects.all() if queryset is None else queryset
+    return queryset.aggregate(
+        pagos=Count('id'),
+        facturado=_suma('monto_total'),
+        cobrado=_suma('monto_pagado'),
+        por_cobrar=_suma(SALDO, filter=CON_DEUDA),
+        pacientes_con_deuda=Count('cita__paciente', filter=CON_DEUDA, distinct=True),
+        parciales=Count('id', filter=CONDICIONES_ESTADO[PARCIAL]),
+        saldo_parciales=_suma(SALDO, filter=CONDICIONES_ESTADO[PARCIAL]),
+        pendientes=Count('id', filter=CONDICIONES_ESTADO[PENDIENTE]),
+        saldo_pendientes=_suma(SALDO, filter=CONDICIONES_ESTADO[PENDIENTE]),
+    )
+
+
+def deudores(queryset=None):
+    """ Pacientes que deben dinero, de mayor a menor saldo (una sola consulta) """
+    queryset = Pago.objects.all() if queryset is None else queryset
+    return (
+        queryset.filter(CON_DEUDA)
+        .values('cita__paciente_id', 'cita__paciente__first_name', 'cita__paciente__last_name')
+        .annotate(pagos=Count('id'), saldo=_suma(SALDO))
+        .order_by('-saldo', 'cita__paciente__last_name')
+    )
+
+
+# ---------------------------------------------------------
+# CIERRE DE CAJA
+# ---------------------------------------------------------
+def _limites(desde, hasta):
+    """ [desde 00:00, hasta+1 00:00) en hora local: filtra por rango y aprovecha el índice """
+    inicio = timezone.make_aware(datetime.combine(desde, time.min))
+    fin = timezone.make_aware(datetime.combine(hasta + timedelta(days=1), time.min))
+    return inicio, fin
+
+
+def cierre_de_caja(desde, hasta):
+    """
+    Cierre de caja entre dos fechas (inclusive). Devuelve las filas por día y
+    método, los subtotales por día y por método y los totales del rango.
+    """
+    inicio, fin = _limites(desde, hasta)
+    filas = list(
+        Pago.objects.filter(fecha_pago__gte=inicio, fecha_pago__lt=fin)
+        .annotate(dia=TruncDate('fecha_pago'))
+        .values('dia', 'metodo')
+        .annotate(pagos=Count('id'), facturado=_suma('monto_total'), cobrado=_suma('monto_pagado'), saldo=_suma(SALDO))
+        .order_by('dia', 'metodo')
+    )
+
+    metodos = dict(Pago.METODOS)
+    vacio = {'pagos': 0, 'facturado': Decimal('0.00'), 'cobrado': Decimal('0.00'), 'saldo': Decimal('0.00')}
+    por_dia, por_metodo, totales = {}, {}, dict(vacio)
+    for fila in filas:
+        fila['metodo_nombre'] = metodos.get(fila['metodo'], fila['metodo'])
+        dia = por_dia.setdefault(fila['dia'], dict(vacio, dia=fila['dia']))
+        metodo = por_metodo.setdefault(fila['metodo'], dict(vacio, metodo=fila['metodo_nombre']))
+        for acumulado in (dia, metodo, totales):
+            for campo in vacio:
+                acumulado[campo] += fila[campo]
+
+    return {
+        'desde': desde,
+        'hasta': hasta,
+        'filas': filas,
+        'por_dia': list(por_dia.values()),
+        'por_metodo': sorted(por_metodo.values(), key=lambda m: m['cobrado'], reverse=True),
+        'totales': totales,
+    }
@@ -0,0 +1,222 @@
+"""
+Motor de intenciones del chatbot de la home (`bot_respuesta`).
+
+  * La tabla INTENCIONES (palabras/frases -> respuesta) se compila una sola
+    vez, al importar el módulo, en un autómata Aho-Corasick: cada mensaje se
+    recorre una única vez sin importar cuántas frases haya.
+  * El texto se normaliza (minúsculas, sin tildes, solo letras y números), así
+    "Ubicación" y "ubicacion" son lo mismo.
+  * Las palabras mal escritas se corrigen contra el vocabulario con un índice
+    de borrados que propone candidatos, confirmados con la distancia de
+    Damerau-Levenshtein (1 error): "horaio" -> "horario", pero "otra" no es "hora".
+  * Los precios salen del catálogo cacheado del portal, no de una consulta.
+  * `aresponder` es la variante asíncrona que usa la vista ASGI: lo único que
+    espera es la lectura del catálogo en la caché.
+"""
+import re
+import unicodedata
+from collections import deque
+
+from .portal import aservicios_catalogo, servicios_catalogo
+
+# Orden = prioridad (igual que la cadena de if/elif original)
+INTENCIONES = [
+    {
+        'nombre': 'saludo',
+        'frases': ['hola', 'buenos', 'buenas', 'buen dia'],
+        'respuesta': "¡Hola! Soy el asistente virtual de la Dra. Jazmin. ¿En qué puedo ayudarte hoy?",
+    },
+    {
+        'nombre': 'cita',
+        'frases': ['cita', 'turno', 'agendar', 'reservar'],
+        'respuesta': "¡Claro! Puedes agendar tu cita llenando el formulario que está más arriba en esta página, o registrándote en nuestro portal para gestionarlas mejor.",
+    },
+    {
+        'nombre': 'precio',
+        'frases': ['precio', 'costo', 'servicio', 'cuanto cuesta', 'tarifa'],
+        'respuesta': None,  # se arma con el catálogo (respuesta_precios)
+    },
+    {
+        'nombre': 'ubicacion',
+        'frases': ['donde', 'ubicacion', 'direccion', 'como llego'],
+        'respuesta': "Estamos en Av. Principal 123, Lima. Justo frente al parque. ¡Es muy fácil llegar!",
+    },
+    {
+        'nombre': 'horario',
+        'frases': ['horario', 'hora', 'atienden'],
+        'respuesta': "Atendemos de Lunes a Viernes de 9am a 8pm, y Sábados hasta las 6pm.",
+    },
+    {
+        'nombre': 'cuenta',
+        'frases': ['entrar', 'login', 'cuenta', 'iniciar sesion'],
+        'respuesta': "Puedes acceder a tu cuenta haciendo clic en el botón 'Ingresar' del menú superior.",
+    },
+]
+
+RESPUESTA_POR_DEFECTO = "Lo siento, no entendí bien. ¿Puedes intentar con las opciones del menú?"
+MAX_LARGO_MENSAJE = 500
+MIN_LARGO_DIFUSO = 4  # palabras más cortas no se corrigen (evita falsos positivos)
+# Palabras frecuentes que están a un error de una palabra clave y no deben "corregirse"
+PALABRAS_COMUNES = {
+    'ahora', 'cuando', 'cuento', 'todos', 'costa', 'donde', 'hoja', 'bueno', 'buena',
+    'sola', 'bola', 'cola', 'mora', 'bien', 'cosa', 'cesto', 'corto', 'luego',
+}
+
+_NO_ALFANUMERICO = re.compile(r'[^a-z0-9]+')
+
+
+def normalizar(texto):
+    """ minúsculas, sin tildes ni signos, palabras separadas por un espacio """
+    texto = unicodedata.normalize('NFKD', texto[:MAX_LARGO_MENSAJE].lower())
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return _NO_ALFANUMERICO.sub(' ', texto).strip()
+
+
+# ---------------------------------------------------------
+# AUTÓMATA AHO-CORASICK
+# ---------------------------------------------------------
+class Automata:
+    """ Busca todas las frases a la vez en una sola pasada sobre el texto """
+
+    def __init__(self, frases):
+        self.transiciones = [{}]
+        self.fallo = [0]
+        self.salidas = [[]]
+        for frase, valor in frases.items():
+            self._agregar(frase, valor)
+        self._construir_fallos()
+
+    def _agregar(self, frase, valor):
+        estado = 0
+        for caracter in frase:
+            siguiente = self.transiciones[estado].get(caracter)
+            if siguiente is None:
+                siguiente = len(self.transiciones)
+                self.transiciones[estado][caracter] = siguiente
+                self.transiciones.append({})
+                self.fallo.append(0)
+                self.salidas.append([])
+            estado = siguiente
+        self.salidas[estado].append((len(frase), valor))
+
+    def _construir_fallos(self):
+        cola = deque(self.transiciones[0].values())
+        while cola:
+            estado = cola.popleft()
+            for caracter, siguiente in self.transiciones[estado].items():
+                cola.append(siguiente)
+                fallo = self.fallo[estado]
+                while fallo and caracter not in self.transiciones[fallo]:
+                    fallo = self.fallo[fallo]
+                self.fallo[siguiente] = self.transiciones[fallo].get(caracter, 0)
+                self.salidas[siguiente] = self.salidas[siguiente] + self.salidas[self.fallo[siguiente]]
+
+    def buscar(self, texto):
+        """ Genera los valores de las frases que empiezan al inicio de una palabra """
+        estado = 0
+        for posicion, caracter in enumerate(texto):
+            while estado and caracter not in self.transiciones[estado]:
+                estado = self.fallo[estado]
+            estado = self.transiciones[estado].get(caracter, 0)
+            for largo, valor in self.salidas[estado]:
+                inicio = posicion - largo + 1
+                if inicio == 0 or texto[inicio - 1] == ' ':
+                    yield valor
+
+
+# ---------------------------------------------------------
+# CORRECCIÓN DE ERRORES DE TIPEO
+# ---------------------------------------------------------
+def _borrados(palabra):
+    return {palabra[:i] + palabra[i + 1:] for i in range(len(palabra))}
+
+
+def distancia(a, b):
+    """ Damerau-Levenshtein (inserción, borrado, sustitución o transposición de dos letras vecinas) """
+    anterior, fila = None, list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        actual = [i]
+        for j, cb in enumerate(b, 1):
+            costo = min(fila[j] + 1, actual[j - 1] + 1, fila[j - 1] + (ca != cb))
+            if anterior is not None and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                costo = min(costo, anterior[j - 2] + 1)
+            actual.append(costo)
+        anterior, fila = fila, actual
+    return fila[-1]
+
+
+class Corrector:
+    """
+    Índice de borrados: dos palabras a distancia 1 comparten alguna variante,
+    pero compartir una variante no basta ("otra" y "hora" comparten "ora" y
+    están a distancia 2), así que cada candidato se confirma con `distancia`.
+    """
+
+    def __init__(self, vocabulario):
+        self.vocabulario = set(vocabulario)
+        self.indice = {}
+        for palabra in sorted(self.vocabulario):
+            if len(palabra) < MIN_LARGO_DIFUSO:
+                continue
+            for variante in _borrados(palabra) | {palabra}:
+                self.indice.setdefault(variante, []).append(palabra)
+
+    def corregir(self, palabra):
+        if palabra in self.vocabulario or palabra in PALABRAS_COMUNES or len(palabra) < MIN_LARGO_DIFUSO:
+            return palabra
+        for variante in [palabra, *sorted(_borrados(palabra))]:
+            for candidata in self.indice.get(variante, ()):
+                if distancia(palabra, candidata) == 1:
+                    return candidata
+        return palabra
+
+
+def _compilar():
+    frases = {}
+    for prioridad, intencion in enumerate(INTENCIONES):
+        for frase in intencion['frases']:
+            frases.setdefault(normalizar(frase), prioridad)
+    vocabulario = {palabra for frase in frases for palabra in frase.split()}
+    return Automata(frases), Corrector(vocabulario)
+
+
+AUTOMATA, CORRECTOR = _compilar()
+
+
+# ---------------------------------------------------------
+# RESPUESTAS
+# ---------------------------------------------------------
+def detectar_intencion(mensaje):
+    """ Nombre de la intención de mayor prioridad presente en el mensaje, o None """
+    texto = ' '.join(CORRECTOR.corregir(p) for p in normalizar(mensaje).split())
+    prioridad = min(AUTOMATA.buscar(texto), default=None)
+    return None if prioridad is None else INTENCIONES[prioridad]['nombre']
+
+
+def respuesta_precios(servicios=None):
+    servicios = (servicios_catalogo() if servicios is None else servicios)[:3]
+    if not servicios:
+        return "La consulta básica cuesta S/ 30. Para tratamientos específicos, necesitamos evaluarte."
+    texto_servicios = ", ".join(f"{s.titulo} (S/ {s.precio_estimado})" for s in servicios)
+    return f"Nuestros precios referenciales son: {texto_servicios}... y más. Puedes ver todos en la sección de Servicios."
+
+
+_RESPUESTAS = {i['nombre']: i['respuesta'] for i in INTENCIONES}
+
+
+def responder(mensaje):
+    intencion = detectar_intencion(mensaje)
+    if intencion is None:
+        return RESPUESTA_POR_DEFECTO
+    if intencion == 'precio':
+        return respuesta_precios()
+    return _RESPUESTAS[intencion]
+
+
+async def aresponder(mensaje):
+    intencion = detectar_intencion(mensaje)
+    if intencion is None:
+        return RESPUESTA_POR_DEFECTO
+    if intencion == 'precio':
+        return respuesta_precios(await aservicios_catalogo())
+    return _RESPUESTAS[intencion]
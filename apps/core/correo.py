@@ -0,0 +1,141 @@
+"""
+Bandeja de salida de correos.
+
+Las vistas solo encolan el mensaje (una fila en `CorreoPendiente`) y responden
+de inmediato; el comando `manage.py enviar_correos` los despacha en lotes
+sobre una única conexión SMTP, con reintentos y espera exponencial.
+"""
+import logging
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db.models import F
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.html import strip_tags
+
+from .models import CorreoPendiente
+
+logger = logging.getLogger(__name__)
+
+# Tiempo que un lote queda reservado para un despachador antes de que otro pueda tomarlo
+RESERVA_LOTE = timedelta(minutes=10)
+
+
+def encolar_correo(asunto, destinatarios, template=None, contexto=None, texto=None, html=None, remitente=None):
+    """ Guarda el mensaje en la bandeja de salida (renderiza el template si se indica) """
+    if template:
+        html = render_to_string(template, contexto or {})
+    if texto is None:
+        texto = strip_tags(html or '')
+    return CorreoPendiente.objects.create(
+        asunto=asunto,
+        remitente=remitente or settings.EMAIL_HOST_USER,
+        destinatarios=",".join(destinatarios),
+        cuerpo_texto=texto,
+        cuerpo_html=html or '',
+    )
+
+
+def espera_reintento(intentos):
+    base = getattr(settings, 'CORREO_ESPERA_BASE_SEGUNDOS', 60)
+    return timedelta(seconds=base * 2 ** max(intentos - 1, 0))
+
+
+def _construir_mensaje(correo, conexion):
+    mensaje = EmailMultiAlternatives(
+        subject=correo.asunto,
+        body=correo.cuerpo_texto,
+        from_email=correo.remitente,
+        to=correo.lista_destinatarios(),
+        connection=conexion,
+    )
+    if correo.cuerpo_html:
+        mensaje.attach_alternative(correo.cuerpo_html, 'text/html')
+    return mensaje
+
+
+def _reservar_lote(tamanio):
+    """
+    Marca hasta `tamanio` correos vencidos con un identificador de lote, de modo
+    que dos despachadores en paralelo nunca envíen el mismo mensaje.
+    """
+    ahora = timezone.now()
+    lote = uuid.uuid4().hex
+    vencidos = (
+        CorreoPendiente.objects
+        .filter(estado=CorreoPendiente.PENDIENTE, proximo_intento__lte=ahora)
+        .order_by('proximo_intento')
+        .values_list('id', flat=True)[:tamanio]
+    )
+    CorreoPendiente.objects.filter(
+        id__in=list(vencidos), estado=CorreoPendiente.PENDIENTE, proximo_intento__lte=ahora,
+    ).update(lote_envio=lote, proximo_intento=ahora + RESERVA_LOTE)
+    return list(CorreoPendiente.objects.filter(lote_envio=lote))
+
+
+def despachar_lote(tamanio=None):
+    """
+    Envía un lote de correos pendientes sobre una sola conexión SMTP.
+    Devuelve (enviados, fallidos).
+    """
+    tamanio = tamanio or getattr(settings, 'CORREO_LOTE', 50)
+    max_intentos = getattr(settings, 'CORREO_MAX_INTENTOS', 5)
+    correos = _reservar_lote(tamanio)
+    if not correos:
+        return 0, 0
+
+    enviados, fallidos = 0, []
+    conexion = get_connection(fail_silently=False)
+    try:
+        conexion.open()
+        for correo in correos:
+            try:
+                conexion.send_messages([_construir_mensaje(correo, conexion)])
+            except Exception as e:
+                correo.ultimo_error = str(e)
+                fallidos.append(correo)
+                continue
+            # Marcado apenas sale, no al final del lote: una caída posterior no lo reenvía
+            CorreoPendiente.objects.filter(pk=correo.pk).update(
+                estado=CorreoPendiente.ENVIADO, enviado_en=timezone.now(), intentos=F('intentos') + 1, lote_envio='',
+            )
+            enviados += 1
+    except Exception as e:
+        # No se pudo abrir la conexión: todo el lote vuelve a la cola
+        logger.warning("No se pudo conectar al servidor de correo: %s", e)
+        enviados, fallidos = 0, correos
+        for correo in correos:
+            correo.ultimo_error = str(e)
+    finally:
+        try:
+            conexion.close()
+        except Exception:
+            pass
+
+    ahora = timezone.now()
+    for correo in fallidos:
+        correo.intentos += 1
+        correo.lote_envio = ''
+        if correo.intentos >= max_intentos:
+            correo.estado = CorreoPendiente.FALLIDO
+            logger.error("Correo %s descartado tras %s intentos: %s", correo.pk, correo.intentos, correo.ultimo_error)
+        else:
+            correo.proximo_intento = ahora + espera_reintento(correo.intentos)
+    CorreoPendiente.objects.bulk_update(fallidos, ['estado', 'intentos', 'lote_envio', 'ultimo_error', 'proximo_intento'])
+    return enviados, len(fallidos)
+
+
+def despachar_pendientes(tamanio=None, max_lotes=None):
+    """ Despacha lotes hasta vaciar la cola de correos vencidos """
+    total_enviados = total_fallidos = lotes = 0
+    while max_lotes is None or lotes < max_lotes:
+        enviados, fallidos = despachar_lote(tamanio)
+        if not enviados and not fallidos:
+            break
+        total_enviados += enviados
+        total_fallidos += fallidos
+        lotes += 1
+    return total_enviados, total_fallidos
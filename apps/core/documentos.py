@@ -0,0 +1,132 @@
+"""
+Descarga protegida de los documentos clínicos (radiografías y PDFs).
+
+Los archivos de Documento ya no salen por /media/: solo por la vista
+documento/<id>/, que comprueba que quien los pide es el paciente dueño (o
+personal con permiso para ver documentos) y luego los envía de una de dos
+formas, según DOCUMENTOS_ENVIO:
+
+  * '' (por defecto): Django transmite el archivo en bloques (FileResponse),
+    sin cargarlo en memoria. Responde Range de un tramo (206 / 416), para
+    que el visor pueda saltar dentro de una radiografía o un PDF grande y
+    reanudar descargas cortadas, y peticiones condicionales con ETag y
+    Last-Modified (304 / 412).
+  * 'x-accel' (nginx) o 'x-sendfile' (Apache, lighttpd): Django solo
+    autoriza y devuelve una cabecera; el servidor web lee y envía el archivo
+    (con sus propios Range y 304) y el worker de Python queda libre al instante.
+"""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from django.utils.text import slugify
+
+RANGO = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class Tramo:
+    """ Archivo recortado a `largo` bytes desde la posición actual (respuestas 206) """
+
+    def __init__(self, archivo, largo):
+        self.archivo = archivo
+        self.restante = largo
+
+    def read(self, tamano=-1):
+        if tamano < 0 or tamano > self.restante:
+            tamano = self.restante
+        datos = self.archivo.read(tamano)
+        self.restante -= len(datos)
+        return datos
+
+    def close(self):
+        self.archivo.close()
+
+
+def nombre_descarga(documento):
+    """ El archivo se guarda con su SHA-256 (almacenamiento.py): al paciente le llega con el título """
+    return (slugify(documento.titulo) or 'documento') + os.path.splitext(documento.archivo.name)[1]
+
+
+def puede_ver(usuario, documento):
+    return documento.paciente_id == usuario.pk or usuario.has_perm('core.view_documento')
+
+
+def _tramo_pedido(request, tamano, etag, modificado):
+    """
+    (inicio, fin) del Range pedido, None si hay que enviar el archivo entero o
+    False si el tramo no existe (416). Solo se atiende un tramo por petición;
+    varios tramos o una cabecera mal formada reciben el archivo completo.
+    """
+    cabecera = request.headers.get('Range')
+    if not cabecera or request.method not in ('GET', 'HEAD'):
+        return None
+    # If-Range: si el archivo cambió desde la copia parcial del cliente, va entero
+    condicion = request.headers.get('If-Range')
+    if condicion and condicion != etag and parse_http_date_safe(condicion) != modificado:
+        return None
+    coincidencia = RANGO.match(cabecera.strip())
+    if not coincidencia or coincidencia.groups() == ('', ''):
+        return None
+    inicio, fin = coincidencia.groups()
+    if not inicio:  # bytes=-500: los últimos 500
+        inicio, fin = max(0, tamano - int(fin)), tamano - 1
+    else:
+        inicio, fin = int(inicio), min(int(fin), tamano - 1) if fin else tamano - 1
+    if inicio >= tamano or inicio > fin:
+        return False
+    return inicio, fin
+
+
+def _delegar(documento, envio):
+    """ Respuesta vacía con X-Accel-Redirect / X-Sendfile: el servidor web envía el archivo """
+    respuesta = HttpResponse(content_type=mimetypes.guess_type(documento.archivo.name)[0] or 'application/octet-stream')
+    if envio == 'x-accel':
+        respuesta['X-Accel-Redirect'] = quote(settings.DOCUMENTOS_ACCEL_PREFIJO + documento.archivo.name)
+    else:
+        respuesta['X-Sendfile'] = documento.archivo.path
+    respuesta['Content-Disposition'] = f"inline; filename*=UTF-8''{quote(nombre_descarga(documento))}"
+    return respuesta
+
+
+def respuesta_documento(request, documento):
+    envio = settings.DOCUMENTOS_ENVIO
+    if envio:
+        return _delegar(documento, envio)
+
+    try:
+        archivo = documento.archivo.open('rb')
+    except FileNotFoundError:
+        raise Http404("El archivo del documento no existe")
+    estado = os.fstat(archivo.fileno())
+    tamano, modificado = estado.st_size, int(estado.st_mtime)
+    etag = f'"{estado.st_mtime_ns:x}-{tamano:x}"'
+
+    condicional = get_conditional_response(request, etag=etag, last_modified=modificado)
+    if condicional is not None:
+        archivo.close()
+        condicional['ETag'] = etag
+        return condicional
+
+    tramo = _tramo_pedido(request, tamano, etag, modificado)
+    if tramo is False:
+        archivo.close()
+        respuesta = HttpResponse(status=416)
+        respuesta['Content-Range'] = f'bytes */{tamano}'
+    elif tramo:
+        inicio, fin = tramo
+        archivo.seek(inicio)
+        respuesta = FileResponse(Tramo(archivo, fin - inicio + 1), status=206, filename=nombre_descarga(documento))
+        respuesta['Content-Length'] = fin - inicio + 1
+        respuesta['Content-Range'] = f'bytes {inicio}-{fin}/{tamano}'
+    else:
+        # Archivo real: bajo gunicorn se envía con sendfile() sin pasar por Python
+        respuesta = FileResponse(archivo, filename=nombre_descarga(documento))
+    respuesta['Accept-Ranges'] = 'bytes'
+    respuesta['ETag'] = etag
+    respuesta['Last-Modified'] = http_date(modificado)
+    return respuesta
@@ -2,6 +2,7 @@ from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError # <--- Necesario para el error de correo duplicado
+from .models import Servicio
 
 class RegistroPacienteForm(UserCreationForm):
     class Meta:
@@ -41,4 +42,13 @@ class RegistroPacienteForm(UserCreationForm):
         
         # Simplificamos el texto de ayuda de la contraseña
         if 'password1' in self.fields:
-             self.fields['password1'].help_text = "Usa al menos 8 caracteres, combina letras y números."
\ No newline at end of file
+             self.fields['password1'].help_text = "Usa al menos 8 caracteres, combina letras y números."
+
+
+# ---------------------------------------------------------
+# RESERVA DE CITA (PORTAL DEL PACIENTE)
+# ---------------------------------------------------------
+class ReservaCitaForm(forms.Form):
+    servicio = forms.ModelChoiceField(queryset=Servicio.objects.all(), error_messages={'invalid_choice': 'El tratamiento elegido no existe.'})
+    fecha = forms.DateField(error_messages={'invalid': 'Ingresa una fecha válida.'})
+    hora = forms.TimeField(error_messages={'invalid': 'Ingresa una hora válida.'})
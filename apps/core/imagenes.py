@@ -0,0 +1,205 @@
+"""
+Versiones reducidas de las fotos de Servicio y Producto.
+
+Las páginas públicas mostraban la foto original subida al admin (a menudo
+varios MB, directo del celular o de la cámara) en tarjetas de ~300px. Aquí cada
+foto se reduce con Pillow a unos pocos anchos fijos (PRESETS), en WebP y en
+JPEG para los navegadores sin WebP, y las plantillas emiten un <picture> con
+`srcset`/`sizes`: el navegador baja solo el tamaño que va a pintar.
+
+  * Las versiones se generan al subir la foto (señal post_save) o, si faltan
+    (fotos anteriores a este cambio, caché borrada), la primera vez que una
+    página las pide. Quedan en MEDIA_ROOT/derivadas/ y no se recalculan.
+  * La carpeta de cada foto sale de su nombre en el storage; como Django no
+    reutiliza nombres al subir otra foto, una foto nueva es otra carpeta. Cambiar
+    los presets o la calidad solo requiere subir VERSION.
+  * Un pequeño manifiesto JSON por preset guarda los anchos generados (nunca se
+    amplía una foto más chica que el ancho pedido).
+"""
+import io
+import json
+import logging
+import os
+import posixpath
+import tempfile
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils.html import format_html, format_html_join
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Subir este número cuando cambien los presets o la calidad
+VERSION = 1
+CARPETA = 'derivadas'
+
+CALIDAD_WEBP = 80
+CALIDAD_JPEG = 82
+
+# anchos: versiones a generar; sizes: ancho en pantalla (atributo `sizes`);
+# cuadrado: recorte fijo (ancho x ancho), se sirve con descriptores 1x/2x
+PRESETS = {
+    'servicio': {'anchos': (320, 640, 960), 'sizes': '(min-width: 768px) 33vw, 100vw'},
+    'producto': {'anchos': (240, 480, 720), 'sizes': '(min-width: 1024px) 25vw, (min-width: 640px) 50vw, 100vw'},
+    'miniatura': {'anchos': (50, 100), 'cuadrado': True},
+}
+
+# (extensión, formato de Pillow, tipo MIME); el último es el de respaldo del <img>
+FORMATOS = [('webp', 'WEBP', 'image/webp'), ('jpg', 'JPEG', 'image/jpeg')]
+
+
+def _carpeta(nombre):
+    return posixpath.join(CARPETA, f'v{VERSION}', os.path.splitext(nombre)[0])
+
+
+def _ruta(nombre, preset, ancho, extension):
+    return posixpath.join(_carpeta(nombre), f'{preset}-{ancho}.{extension}')
+
+
+def _ruta_manifiesto(nombre, preset):
+    return posixpath.join(_carpeta(nombre), f'{preset}.json')
+
+
+def _guardar(ruta, contenido):
+    """
+    Escribe (o reemplaza) la versión en `ruta`. Dos peticiones pueden generar la
+    misma versión a la vez: se escribe a un temporal de la misma carpeta y se
+    mueve con os.replace, así nunca queda una copia renombrada (name_abc123.webp).
+    """
+    try:
+        destino = default_storage.path(ruta)
+    except NotImplementedError:
+        # Storage remoto: si otro la guardó primero, el storage renombra la nuestra
+        guardado = default_storage.save(ruta, ContentFile(contenido))
+        if guardado != ruta:
+            default_storage.delete(guardado)
+        return
+    carpeta = os.path.dirname(destino)
+    os.makedirs(carpeta, exist_ok=True)
+    descriptor, temporal = tempfile.mkstemp(dir=carpeta, suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'wb') as archivo:
+            archivo.write(contenido)
+        os.chmod(temporal, default_storage.file_permissions_mode or 0o644)
+        os.replace(temporal, destino)
+    except BaseException:
+        os.unlink(temporal)
+        raise
+
+
+# ---------------------------------------------------------
+# GENERACIÓN
+# ---------------------------------------------------------
+def _codificar(imagen, formato):
+    salida = io.BytesIO()
+    if formato == 'WEBP':
+        imagen.save(salida, 'WEBP', quality=CALIDAD_WEBP, method=4)
+    else:
+        imagen.save(salida, 'JPEG', quality=CALIDAD_JPEG, optimize=True, progressive=True)
+    return salida.getvalue()
+
+
+def generar(archivo, presets):
+    """
+    Genera las versiones de `archivo` (un ImageField) para cada preset y
+    devuelve {preset: [anchos generados]}. Abre y decodifica la foto una sola vez.
+    """
+    with archivo.open('rb') as original:
+        foto = Image.open(original)
+        foto = ImageOps.exif_transpose(foto)  # fotos de celular: respetar la orientación
+        foto = foto.convert('RGB')
+    manifiestos = {}
+    for preset in presets:
+        config = PRESETS[preset]
+        anchos = [a for a in config['anchos'] if a <= foto.width] or [min(foto.width, config['anchos'][0])]
+        for ancho in anchos:
+            if config.get('cuadrado'):
+                version = ImageOps.fit(foto, (ancho, ancho), Image.LANCZOS)
+            else:
+                version = foto.resize((ancho, max(1, round(foto.height * ancho / foto.width))), Image.LANCZOS)
+            for extension, formato, _ in FORMATOS:
+                _guardar(_ruta(archivo.name, preset, ancho, extension), _codificar(version, formato))
+        _guardar(_ruta_manifiesto(archivo.name, preset), json.dumps(anchos).encode())
+        manifiestos[preset] = anchos
+    return manifiestos
+
+
+def anchos_disponibles(archivo, preset):
+    """ Anchos ya generados del preset; los genera si faltan. None si la foto no se puede leer """
+    ruta = _ruta_manifiesto(archivo.name, preset)
+    try:
+        with default_storage.open(ruta) as manifiesto:
+            return json.load(manifiesto)
+    except (FileNotFoundError, ValueError):
+        pass
+    try:
+        return generar(archivo, [preset])[preset]
+    except FileNotFoundError:
+        return None  # el original no está en el storage: no hay nada que reducir
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        logger.warning("No se pudieron generar las versiones de %s: %s", archivo.name, e)
+        return None
+
+
+def preparar(archivo, presets):
+    """ Deja listas las versiones que falten (al guardar el registro con una foto nueva) """
+    if archivo:
+        for preset in presets:
+            anchos_disponibles(archivo, preset)
+
+
+def borrar(nombre):
+    """ Elimina todas las versiones de una foto (al borrar su registro) """
+    carpeta = _carpeta(nombre)
+    try:
+        _, archivos = default_storage.listdir(carpeta)
+    except FileNotFoundError:
+        return
+    for archivo in archivos:
+        default_storage.delete(posixpath.join(carpeta, archivo))
+
+
+# ---------------------------------------------------------
+# HTML (<picture> con srcset)
+# ---------------------------------------------------------
+def picture(archivo, preset, alt='', clase=''):
+    """
+    <picture> con las versiones WebP y JPEG del preset. Si la foto no se puede
+    procesar devuelve un <img> con el original, como antes.
+    """
+    if not archivo:
+        return ''
+    anchos = anchos_disponibles(archivo, preset)
+    if not anchos:
+        return format_html('<img src="{}" alt="{}" class="{}" loading="lazy">', archivo.url, alt, clase)
+
+    config = PRESETS[preset]
+    if config.get('cuadrado'):
+        descriptores = [f'{round(ancho / anchos[0])}x' for ancho in anchos]
+        sizes, medidas = None, (anchos[0], anchos[0])
+    else:
+        descriptores = [f'{ancho}w' for ancho in anchos]
+        sizes, medidas = config['sizes'], (None, None)
+
+    def srcset(extension):
+        return ', '.join(
+            f'{default_storage.url(_ruta(archivo.name, preset, ancho, extension))} {descriptor}'
+            for ancho, descriptor in zip(anchos, descriptores)
+        )
+
+    fuentes = format_html_join(
+        '', '<source type="{}" srcset="{}"{}>',
+        ((mime, srcset(extension), format_html(' sizes="{}"', sizes) if sizes else '') for extension, _, mime in FORMATOS[:-1]),
+    )
+    respaldo, _, _ = FORMATOS[-1]
+    return format_html(
+        '<picture style="display: contents">{}<img src="{}" srcset="{}"{}{} alt="{}" class="{}" loading="lazy" decoding="async"></picture>',
+        fuentes,
+        default_storage.url(_ruta(archivo.name, preset, anchos[0] if config.get('cuadrado') else anchos[len(anchos) // 2], respaldo)),
+        srcset(respaldo),
+        format_html(' sizes="{}"', sizes) if sizes else '',
+        format_html(' width="{}" height="{}"', *medidas) if medidas[0] else '',
+        alt,
+        clase,
+    )
@@ -0,0 +1,224 @@
+"""
+Stock de los insumos: kardex de movimientos y alertas.
+
+El stock (`Insumo.cantidad`) ya no se escribe a mano. Cada entrada, consumo o
+ajuste pasa por registrar_movimiento(), que:
+  * aplica el cambio con UPDATE ... SET cantidad = cantidad + n (F()), sin
+    leer y reescribir el valor: dos movimientos simultáneos nunca se pisan;
+  * en las salidas pone la condición `cantidad >= n` en el mismo UPDATE, así
+    el stock no queda negativo aunque dos consumos lleguen a la vez;
+  * deja el movimiento en MovimientoStock con el stock resultante.
+
+`Insumo.estado_stock` (OK / BAJO / AGOTADO) es una columna generada por la base
+de datos e indexada, igual que `fecha_vencimiento`: las alertas son consultas
+por índice, no una evaluación de cada insumo en Python.
+
+Consumo por tratamiento: cada Servicio tiene su lista de materiales
+(MaterialServicio). Al finalizar citas, descontar_materiales() junta TODAS las
+citas del lote y hace un solo UPDATE por insumo (no uno por cita y material).
+
+Pronóstico: actualizar_pronostico() cruza la agenda futura (citas por día y
+servicio, un GROUP BY) con la lista de materiales como matrices de NumPy:
+demanda diaria = citas x materiales, acumulada por día y comparada con el stock
+para hallar el primer día en que no alcanza.
+"""
+from collections import Counter
+from datetime import timedelta
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from .models import Cita, Insumo, MaterialServicio, MovimientoStock
+
+# Insumos que vencen dentro de estos días aparecen en las alertas
+DIAS_AVISO_VENCIMIENTO = 30
+
+MOTIVO_STOCK_INICIAL = "Stock inicial"
+
+# Días de agenda futura que mira el pronóstico de agotamiento
+DIAS_PRONOSTICO = 90
+# Citas que todavía van a consumir materiales
+ESTADOS_PROGRAMADOS = ['pendiente', 'confirmada']
+
+
+class StockInsuficiente(Exception):
+    """ La salida pedida es mayor que el stock disponible """
+
+
+def registrar_movimiento(insumo, tipo, cantidad, motivo='', usuario=None):
+    """
+    Suma `cantidad` (negativa para las salidas) al stock del insumo y registra
+    el movimiento. Lanza StockInsuficiente si la salida dejaría el stock en
+    negativo. Devuelve el MovimientoStock creado.
+    """
+    insumo_id = getattr(insumo, 'pk', insumo)
+    with transaction.atomic():
+        filas = Insumo.objects.filter(pk=insumo_id)
+        if cantidad < 0:
+            filas = filas.filter(cantidad__gte=-cantidad)
+        if not filas.update(cantidad=F('cantidad') + cantidad):
+            raise StockInsuficiente(f"No hay {-cantidad} unidades de {insumo} en stock")
+        # La fila queda bloqueada por nuestro UPDATE hasta el commit: este valor es el nuestro
+        stock = Insumo.objects.values_list('cantidad', flat=True).get(pk=insumo_id)
+        movimiento = MovimientoStock.objects.create(
+            insumo_id=insumo_id, tipo=tipo, cantidad=cantidad, stock_resultante=stock, motivo=motivo, usuario=usuario,
+        )
+    if isinstance(insumo, Insumo):
+        insumo.cantidad = stock
+    return movimiento
+
+
+def entrada(insumo, cantidad, motivo='', usuario=None):
+    return registrar_movimiento(insumo, MovimientoStock.ENTRADA, abs(cantidad), motivo, usuario)
+
+
+def consumo(insumo, cantidad, motivo='', usuario=None):
+    return registrar_movimiento(insumo, MovimientoStock.CONSUMO, -abs(cantidad), motivo, usuario)
+
+
+def ajustar(insumo, contado, motivo='', usuario=None):
+    """ Deja el stock en `contado` (conteo físico). No hace nada si ya coincide """
+    insumo_id = getattr(insumo, 'pk', insumo)
+    with transaction.atomic():
+        # Bloqueamos la fila: la diferencia se calcula sobre el stock vigente
+        actual = Insumo.objects.select_for_update().values_list('cantidad', flat=True).get(pk=insumo_id)
+        if contado == actual:
+            return None
+        return registrar_movimiento(insumo, MovimientoStock.AJUSTE, contado - actual, motivo or "Conteo físico", usuario)
+
+
+# ---------------------------------------------------------
+# CONSUMO POR TRATAMIENTO
+# ---------------------------------------------------------
+def descontar_materiales(citas, usuario=None):
+    """
+    Descuenta del stock los materiales de las citas finalizadas (ids) que aún
+    no lo hicieron, en lote: un movimiento por insumo. Si el stock no alcanza
+    se descuenta lo que hay y el faltante queda anotado en el motivo. Devuelve
+    cuántas citas se procesaron.
+    """
+    with transaction.atomic():
+        pendientes = dict(
+            Cita.objects.select_for_update()
+            .filter(pk__in=list(citas), estado='finalizada', materiales_descontados=False)
+            .values_list('pk', 'servicio_id')
+        )
+        if not pendientes:
+            return 0
+        Cita.objects.filter(pk__in=pendientes).update(materiales_descontados=True)
+
+        citas_por_servicio = Counter(pendientes.values())
+        totales = Counter()
+        for servicio_id, insumo_id, cantidad in MaterialServicio.objects.filter(
+            servicio_id__in=citas_por_servicio,
+        ).values_list('servicio_id', 'insumo_id', 'cantidad'):
+            totales[insumo_id] += cantidad * citas_por_servicio[servicio_id]
+
+        stocks = dict(Insumo.objects.select_for_update().filter(pk__in=totales).values_list('pk', 'cantidad'))
+        motivo = f"Consumo de {len(pendientes)} cita(s) finalizada(s)"
+        movimientos = []
+        for insumo_id, necesario in totales.items():
+            descontado = min(necesario, stocks[insumo_id])
+            if descontado:
+                Insumo.objects.filter(pk=insumo_id).update(cantidad=F('cantidad') - descontado)
+            faltante = f" (faltaron {necesario - descontado})" if descontado < necesario else ""
+            if descontado or faltante:
+                movimientos.append(MovimientoStock(
+                    insumo_id=insumo_id, tipo=MovimientoStock.CONSUMO, cantidad=-descontado,
+                    stock_resultante=stocks[insumo_id] - descontado, motivo=motivo + faltante, usuario=usuario,
+                ))
+        MovimientoStock.objects.bulk_create(movimientos)
+    return len(pendientes)
+
+
+# ---------------------------------------------------------
+# PRONÓSTICO DE AGOTAMIENTO
+# ---------------------------------------------------------
+def _primer_dia(condicion):
+    """ Por columna: índice de la primera fila True, o -1 si ninguna lo es """
+    return np.where(condicion.any(axis=0), condicion.argmax(axis=0), -1)
+
+
+def pronosticar(dias=DIAS_PRONOSTICO):
+    """
+    Proyecta el stock de cada insumo con las citas programadas de los
+    próximos `dias`. Devuelve {insumo_id: (agotamiento, reposicion, demanda)}:
+    el día en que ya no alcanza para las citas, el día en que baja del stock
+    mínimo (None si no ocurre en el horizonte) y el total que se va a gastar.
+    """
+    hoy = timezone.localdate()
+    insumos = np.array(list(Insumo.objects.order_by('pk').values_list('pk', 'cantidad', 'stock_minimo')), dtype=np.int64).reshape(-1, 3)
+    materiales = np.array(list(MaterialServicio.objects.values_list('servicio_id', 'insumo_id', 'cantidad')), dtype=np.int64).reshape(-1, 3)
+    agenda = np.array([
+        ((fecha - hoy).days, servicio_id, citas)
+        for fecha, servicio_id, citas in Cita.objects.filter(
+            fecha__gte=hoy, fecha__lt=hoy + timedelta(days=dias), estado__in=ESTADOS_PROGRAMADOS,
+            servicio_id__in=MaterialServicio.objects.values('servicio_id'),
+        ).values_list('fecha', 'servicio_id').annotate(citas=Count('id')).order_by()
+    ], dtype=np.int64).reshape(-1, 3)
+
+    # Servicios e insumos a posiciones 0..n-1 de las matrices
+    servicios = np.unique(materiales[:, 0])
+    columna = np.searchsorted(insumos[:, 0], materiales[:, 1])
+    receta = np.zeros((len(servicios), len(insumos)), dtype=np.int64)
+    np.add.at(receta, (np.searchsorted(servicios, materiales[:, 0]), columna), materiales[:, 2])
+    citas = np.zeros((dias, len(servicios)), dtype=np.int64)
+    np.add.at(citas, (agenda[:, 0], np.searchsorted(servicios, agenda[:, 1])), agenda[:, 2])
+
+    # Demanda acumulada al cierre de cada día (días x insumos)
+    acumulado = np.cumsum(citas @ receta, axis=0)
+    stock, minimo = insumos[:, 1], insumos[:, 2]
+    agotamiento = _primer_dia(acumulado > stock)
+    reposicion = _primer_dia(stock - acumulado <= minimo)  # 0 si ya está en el mínimo
+    demanda = acumulado[-1]
+
+    def fecha(indice):
+        return hoy + timedelta(days=int(indice)) if indice >= 0 else None
+
+    return {
+        int(insumo_id): (fecha(a), fecha(r), int(d))
+        for insumo_id, a, r, d in zip(insumos[:, 0], agotamiento, reposicion, demanda)
+    }
+
+
+def actualizar_pronostico(dias=DIAS_PRONOSTICO):
+    """ Guarda el pronóstico en los insumos (un bulk_update). Devuelve cuántos se agotan en el horizonte """
+    pronostico = pronosticar(dias)
+    insumos = list(Insumo.objects.only('pk').filter(pk__in=pronostico))
+    for insumo in insumos:
+        insumo.agotamiento_estimado, insumo.reposicion_estimada, insumo.demanda_programada = pronostico[insumo.pk]
+    Insumo.objects.bulk_update(insumos, ['agotamiento_estimado', 'reposicion_estimada', 'demanda_programada'], batch_size=500)
+    return sum(1 for agotamiento, _, _ in pronostico.values() if agotamiento)
+
+
+# ---------------------------------------------------------
+# ALERTAS
+# ---------------------------------------------------------
+def bajo_stock():
+    """ Agotados primero y luego los que están en o bajo el mínimo (índice estado_stock + nombre) """
+    return Insumo.objects.filter(estado_stock__in=['AGOTADO', 'BAJO']).order_by('estado_stock', 'nombre')
+
+
+def por_vencer(dias=DIAS_AVISO_VENCIMIENTO):
+    """ Insumos con stock que vencen en los próximos `dias` (o ya vencidos), por fecha (índice fecha_vencimiento) """
+    limite = timezone.localdate() + timedelta(days=dias)
+    return Insumo.objects.filter(fecha_vencimiento__lte=limite, cantidad__gt=0).order_by('fecha_vencimiento', 'nombre')
+
+
+def se_agotan():
+    """ Insumos que no alcanzan para la agenda programada, el más urgente primero (índice agotamiento_estimado) """
+    return Insumo.objects.filter(agotamiento_estimado__isnull=False).order_by('agotamiento_estimado', 'nombre')
+
+
+def alertas(dias=DIAS_AVISO_VENCIMIENTO):
+    hoy = timezone.localdate()
+    vencimientos = list(por_vencer(dias))
+    return {
+        'bajo_stock': list(bajo_stock()),
+        'se_agotan': list(se_agotan()),
+        'vencidos': [insumo for insumo in vencimientos if insumo.fecha_vencimiento < hoy],
+        'por_vencer': [insumo for insumo in vencimientos if insumo.fecha_vencimiento >= hoy],
+        'dias': dias,
+    }
@@ -0,0 +1,99 @@
+"""
+Benchmark de subida de documentos clínicos: almacén deduplicado frente al
+FileSystemStorage de siempre.
+
+Genera --archivos archivos aleatorios de --mb MB en disco (nunca en memoria)
+y sube cada uno --copias veces con los dos almacenes. Cada subida llega como
+en el admin: un TemporaryUploadedFile que Django ya escribió en disco (esa
+copia previa no se cronometra). Muestra el tiempo por archivo de la primera
+subida y de las repetidas, y el espacio que ocupa cada carpeta al final.
+FileSystemStorage solo renombra el temporal; el almacén deduplicado además
+lo lee una vez para el SHA-256.
+
+    python manage.py benchmark_almacenamiento
+    python manage.py benchmark_almacenamiento --mb 800 --archivos 2 --copias 4
+"""
+import os
+import shutil
+import tempfile
+import time
+
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from apps.core.almacenamiento import TAMANO_BLOQUE, AlmacenDeduplicado
+
+CARPETA = 'historias_clinicas'
+
+
+def _ocupado(carpeta):
+    return sum(os.path.getsize(os.path.join(raiz, nombre)) for raiz, _, nombres in os.walk(carpeta) for nombre in nombres)
+
+
+class Command(BaseCommand):
+    help = "Mide MB/s y espacio en disco al subir documentos grandes con y sin deduplicación"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mb', type=int, default=300, help="Tamaño de cada archivo")
+        parser.add_argument('--archivos', type=int, default=3)
+        parser.add_argument('--copias', type=int, default=3, help="Veces que se sube cada archivo")
+
+    def handle(self, *args, **opts):
+        nombre_original = connection.settings_dict['NAME']
+        carpeta = tempfile.mkdtemp(prefix='benchmark_almacenamiento_')
+        self.stdout.write("Creando base de prueba ...")
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self._medir(carpeta, opts['mb'], opts['archivos'], opts['copias'])
+        finally:
+            connection.creation.destroy_test_db(nombre_original, verbosity=0)
+            shutil.rmtree(carpeta, ignore_errors=True)
+
+    def _subida(self, ruta):
+        """ Lo que recibe el almacén cuando el admin sube un archivo grande """
+        subida = TemporaryUploadedFile(os.path.basename(ruta), 'application/octet-stream', os.path.getsize(ruta), None)
+        with open(ruta, 'rb') as origen:
+            shutil.copyfileobj(origen, subida, TAMANO_BLOQUE)
+        subida.flush()
+        return subida
+
+    def _medir(self, carpeta, mb, total_archivos, copias):
+        self.stdout.write(f"Generando {total_archivos} archivo(s) de {mb} MB ...")
+        origenes = []
+        for i in range(total_archivos):
+            ruta = os.path.join(carpeta, f'radiografia{i}.dcm')
+            with open(ruta, 'wb') as destino:
+                for _ in range(mb * 1024 * 1024 // TAMANO_BLOQUE):
+                    destino.write(os.urandom(TAMANO_BLOQUE))
+            origenes.append(ruta)
+
+        almacenes = {
+            'FileSystemStorage': FileSystemStorage(location=os.path.join(carpeta, 'simple')),
+            'AlmacenDeduplicado': AlmacenDeduplicado(location=os.path.join(carpeta, 'deduplicado')),
+        }
+        self.stdout.write(
+            f"\n{'almacén':<20}{'1ª subida (por archivo)':>26}{'repetidas (por archivo)':>26}{'archivos':>10}{'en disco MB':>13}"
+        )
+        for nombre, almacen in almacenes.items():
+            primeras, repetidas = [], []
+            for copia in range(copias):
+                for ruta in origenes:
+                    subida = self._subida(ruta)
+                    inicio = time.perf_counter()
+                    almacen.save(f'{CARPETA}/{subida.name}', subida)
+                    (repetidas if copia else primeras).append(time.perf_counter() - inicio)
+                    subida.close()
+
+            def medida(tiempos):
+                if not tiempos:
+                    return "-"
+                media = sum(tiempos) / len(tiempos)
+                return f"{media:.3f}s ({mb / media:,.0f} MB/s)"
+
+            raiz = almacen.path(CARPETA)
+            archivos = sum(len(nombres) for _, _, nombres in os.walk(raiz))
+            self.stdout.write(
+                f"{nombre:<20}{medida(primeras):>26}{medida(repetidas):>26}{archivos:>10}{_ocupado(raiz) / 1024 / 1024:>13.0f}"
+            )
@@ -0,0 +1,243 @@
+"""
+Benchmark de la analítica (analitica.py) sobre una base SQLite sintética.
+
+Crea una base temporal con el esquema real, la llena con --citas filas
+(1.000.000 por defecto) repartidas en ~3 años y mide:
+  * la lectura: columnas() (una pasada con values_list) frente a recorrer
+    objetos Cita con select_related('pago');
+  * cada reporte: versión NumPy frente a la misma cuenta con bucles por fila
+    en Python (sobre las mismas columnas), comprobando que den lo mismo.
+
+    python manage.py benchmark_analitica
+    python manage.py benchmark_analitica --citas 3000000 --pacientes 80000
+
+En la base de prueba se quita la restricción de turno único (una sola silla
+no llega a 1M de citas en 3 años); el resto del esquema es el de producción.
+"""
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+
+import numpy as np
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from apps.core import analitica
+from apps.core.models import Cita
+
+ALIAS = 'benchmark'
+
+
+class Command(BaseCommand):
+    help = "Mide los reportes de analítica (NumPy) frente a bucles por fila con 1M+ citas"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--citas', type=int, default=1_000_000)
+        parser.add_argument('--pacientes', type=int, default=40_000)
+        parser.add_argument('--dias', type=int, default=3 * 365, help="Días de historia (hacia atrás desde hoy)")
+        parser.add_argument('--semilla', type=int, default=2026)
+
+    def handle(self, *args, **opts):
+        random.seed(opts['semilla'])
+        carpeta = tempfile.mkdtemp(prefix='benchmark_analitica_')
+        ruta = os.path.join(carpeta, 'benchmark.sqlite3')
+        connections.settings[ALIAS] = {**connections.settings['default'], 'NAME': ruta}
+
+        try:
+            self.stdout.write(f"Creando esquema en {ruta} ...")
+            call_command('migrate', database=ALIAS, verbosity=0)
+            with connections[ALIAS].schema_editor() as editor:
+                for restriccion in Cita._meta.constraints:
+                    editor.remove_constraint(Cita, restriccion)
+            self._cargar_datos(opts['citas'], opts['pacientes'], opts['dias'])
+            self._medir()
+        finally:
+            connections[ALIAS].close()
+            del connections.settings[ALIAS]
+            if os.path.exists(ruta):
+                os.remove(ruta)
+            os.rmdir(carpeta)
+
+    # ---------------------------------------------------------
+    # DATOS SINTÉTICOS
+    # ---------------------------------------------------------
+    def _cargar_datos(self, total_citas, total_pacientes, dias):
+        inicio_carga = time.perf_counter()
+        hoy = date.today()
+        ahora = timezone.now().isoformat(sep=' ')
+        horas = [f"{h:02d}:{m:02d}:00" for h in range(9, 20) for m in (0, 30)]
+        # Las cancelaciones varían por servicio para que el reporte tenga algo que mostrar
+        estados = ['pendiente', 'confirmada', 'finalizada', 'cancelada']
+        metodos = ['efectivo', 'transferencia', 'yape_plin', 'tarjeta']
+
+        with connections[ALIAS].cursor() as cursor:
+            cursor.execute("PRAGMA synchronous = OFF")
+            cursor.execute("PRAGMA journal_mode = MEMORY")
+            cursor.executemany(
+                "INSERT INTO auth_user (id, password, is_superuser, username, first_name, last_name, email, is_staff, is_active, date_joined) "
+                "VALUES (%s, '', 0, %s, %s, '', '', 0, 1, %s)",
+                [(i, f"paciente{i}", f"Paciente {i}", ahora) for i in range(1, total_pacientes + 1)],
+            )
+            cursor.executemany(
+                "INSERT INTO core_servicio (id, titulo, descripcion, imagen, precio_estimado, created_at) VALUES (%s, %s, '', '', %s, %s)",
+                [(i, f"Servicio {i}", 50 * i, ahora) for i in range(1, 9)],
+            )
+
+            # Cada paciente "entra" un día al azar y sus citas caen desde entonces
+            entrada = [random.randint(0, dias) for _ in range(total_pacientes + 1)]
+            citas, pagos = [], []
+            for i in range(1, total_citas + 1):
+                paciente = random.randint(1, total_pacientes)
+                servicio = random.randint(1, 8)
+                atras = random.randint(0, entrada[paciente])
+                fecha = (hoy - timedelta(days=atras)).isoformat()
+                estado = estados[3] if random.random() < servicio * 0.02 else random.choice(estados[:3])
+                hora = random.choice(horas)
+                citas.append((i, paciente, servicio, fecha, hora, hora, estado))
+                if i % 2 == 0:
+                    pagos.append((i, 100, random.choice((0, 50, 100)), random.choice(metodos), ahora, i))
+                if len(citas) >= 50_000:
+                    self._insertar(cursor, citas, pagos)
+                    citas, pagos = [], []
+            self._insertar(cursor, citas, pagos)
+            cursor.execute("ANALYZE")
+
+        self.stdout.write(f"Datos cargados ({total_citas} citas) en {time.perf_counter() - inicio_carga:.1f}s")
+
+    def _insertar(self, cursor, citas, pagos):
+        cursor.executemany(
+            # Las horas son inicios de turno: turno = hora
+            "INSERT INTO core_cita (id, paciente_id, servicio_id, fecha, hora, turno, estado, materiales_descontados) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s, FALSE)",
+            citas,
+        )
+        cursor.executemany(
+            "INSERT INTO core_pago (id, monto_total, monto_pagado, metodo, fecha_pago, cita_id) VALUES (%s, %s, %s, %s, %s, %s)",
+            pagos,
+        )
+
+    # ---------------------------------------------------------
+    # MEDICIONES
+    # ---------------------------------------------------------
+    def _tiempo(self, funcion):
+        inicio = time.perf_counter()
+        resultado = funcion()
+        return resultado, time.perf_counter() - inicio
+
+    def _medir(self):
+        citas = Cita.objects.using(ALIAS)
+
+        self.stdout.write("\n=== LECTURA ===")
+        c, t_columnas = self._tiempo(lambda: analitica.columnas(citas))
+        self.stdout.write(f"{'columnas() (values_list -> NumPy)':<45}{t_columnas:>9.2f}s")
+        _, t_objetos = self._tiempo(lambda: sum(1 for _ in citas.select_related('pago').iterator(chunk_size=2000)))
+        self.stdout.write(f"{'objetos Cita + select_related(pago)':<45}{t_objetos:>9.2f}s")
+        self.stdout.write(f"{'columnas en memoria':<45}{sum(v.nbytes for v in c.values()) / 2**20:>8.1f}MB")
+
+        filas = list(zip(*(c[nombre].tolist() for nombre, _ in analitica._COLUMNAS)))
+        comparaciones = [
+            ('cancelaciones por servicio', self._cancelaciones),
+            ('intervalos de retorno', self._retorno),
+            ('ingresos y retención por cohorte', self._cohortes),
+            ('horas pico', self._horas),
+        ]
+        self.stdout.write(f"\n=== REPORTES ({len(filas)} citas) ===")
+        self.stdout.write(f"{'reporte':<36}{'NumPy':>10}{'por fila':>12}{'mejora':>9}")
+        total_numpy = total_python = 0.0
+        for nombre, comparar in comparaciones:
+            t_numpy, t_python = comparar(c, filas)
+            total_numpy += t_numpy
+            total_python += t_python
+            self.stdout.write(f"{nombre:<36}{t_numpy * 1000:>8.0f}ms{t_python * 1000:>10.0f}ms{t_python / t_numpy:>8.1f}x")
+        self.stdout.write(
+            f"{'TOTAL':<36}{total_numpy * 1000:>8.0f}ms{total_python * 1000:>10.0f}ms{total_python / total_numpy:>8.1f}x"
+        )
+
+    def _comprobar(self, nombre, a, b):
+        if not np.allclose(np.asarray(a, dtype=float), np.asarray(b, dtype=float), equal_nan=True):
+            raise CommandError(f"{nombre}: NumPy y el bucle por fila no coinciden")
+
+    # Cada método calcula el reporte con NumPy y con un bucle por fila, y compara
+
+    def _cancelaciones(self, c, filas):
+        resultado, t_numpy = self._tiempo(lambda: analitica.cancelaciones_por_servicio(c))
+
+        def por_fila():
+            hoy = date.today()
+            ultimo = hoy.year * 12 + hoy.month - 1
+            cuentas = defaultdict(lambda: [0, 0])
+            for _, servicio, fecha, _, estado, _ in filas:
+                mes = ultimo - (fecha.year * 12 + fecha.month - 1)
+                if 0 <= mes < analitica.MESES_REPORTE:
+                    celda = cuentas[(servicio, analitica.MESES_REPORTE - 1 - mes)]
+                    celda[0] += 1
+                    celda[1] += estado == analitica.CANCELADA
+            return cuentas
+
+        cuentas, t_python = self._tiempo(por_fila)
+        esperado = [[cuentas.get((s, m), [0, 0])[1] for m in range(analitica.MESES_REPORTE)] for s in resultado['servicios']]
+        self._comprobar('cancelaciones', resultado['canceladas'], esperado)
+        return t_numpy, t_python
+
+    def _visitas_por_fila(self, filas):
+        hoy = date.today()
+        visitas = defaultdict(set)
+        for paciente, _, fecha, _, estado, _ in filas:
+            if estado != analitica.CANCELADA and fecha <= hoy:
+                visitas[paciente].add(fecha)
+        return {paciente: sorted(dias) for paciente, dias in visitas.items()}
+
+    def _retorno(self, c, filas):
+        resultado, t_numpy = self._tiempo(lambda: analitica.intervalos_de_retorno(c))
+
+        def por_fila():
+            intervalos = []
+            for dias in self._visitas_por_fila(filas).values():
+                intervalos.extend((b - a).days for a, b in zip(dias, dias[1:]))
+            intervalos.sort()
+            return intervalos
+
+        intervalos, t_python = self._tiempo(por_fila)
+        self._comprobar('retorno', [resultado['retornos'], resultado['mediana']], [len(intervalos), np.median(intervalos)])
+        return t_numpy, t_python
+
+    def _cohortes(self, c, filas):
+        resultado, t_numpy = self._tiempo(lambda: analitica.ingresos_por_cohorte(c))
+        meses = analitica.MESES_REPORTE
+
+        def por_fila():
+            hoy = date.today()
+            primera = hoy.year * 12 + hoy.month - 1 - (meses - 1)
+            cohorte = {paciente: dias[0].year * 12 + dias[0].month - 1 for paciente, dias in self._visitas_por_fila(filas).items()}
+            ingresos = defaultdict(float)
+            for paciente, _, fecha, _, _, pagado in filas:
+                if paciente in cohorte and cohorte[paciente] >= primera:
+                    desfase = fecha.year * 12 + fecha.month - 1 - cohorte[paciente]
+                    if 0 <= desfase < meses:
+                        ingresos[(cohorte[paciente] - primera, desfase)] += pagado
+            return ingresos
+
+        ingresos, t_python = self._tiempo(por_fila)
+        esperado = [[ingresos.get((k, d), 0.0) for d in range(meses)] for k in range(meses)]
+        self._comprobar('cohortes', resultado['ingresos'], esperado)
+        return t_numpy, t_python
+
+    def _horas(self, c, filas):
+        resultado, t_numpy = self._tiempo(lambda: analitica.horas_pico(c))
+
+        def por_fila():
+            cuentas = defaultdict(int)
+            for _, _, fecha, hora, estado, _ in filas:
+                if estado != analitica.CANCELADA:
+                    cuentas[(fecha.weekday(), hora)] += 1
+            return cuentas
+
+        cuentas, t_python = self._tiempo(por_fila)
+        esperado = [[cuentas.get((d, h), 0) for h in resultado['horas']] for d in range(7)]
+        self._comprobar('horas pico', resultado['citas'], esperado)
+        return t_numpy, t_python
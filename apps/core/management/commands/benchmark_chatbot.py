@@ -0,0 +1,53 @@
+"""
+Microbenchmark del motor de intenciones del chatbot (un solo núcleo).
+
+    python manage.py benchmark_chatbot
+    python manage.py benchmark_chatbot --mensajes 200000
+"""
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.core import chatbot
+
+MUESTRAS = [
+    "Hola, buenas tardes",
+    "¿Dónde están ubicados?",
+    "ubicasion de la clinica por favor",
+    "Quiero agendar una cita para mañana",
+    "cuanto cuesta una limpieza?",
+    "¿Cuál es su horaio de atención?",
+    "no puedo entrar a mi cuenta",
+    "asdkjh qwe zxcv",
+    "Necesito información sobre ortodoncia y los precios de los brackets, gracias",
+    "¿Atienden los sábados en la tarde?",
+]
+
+
+class Command(BaseCommand):
+    help = "Mide cuántos mensajes por segundo clasifica el chatbot en un núcleo"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mensajes', type=int, default=100_000)
+        parser.add_argument('--semilla', type=int, default=2026)
+
+    def handle(self, *args, **opts):
+        random.seed(opts['semilla'])
+        mensajes = [random.choice(MUESTRAS) for _ in range(opts['mensajes'])]
+        chatbot.responder(mensajes[0])  # calentamos la caché del catálogo
+
+        inicio = time.perf_counter()
+        for mensaje in mensajes:
+            chatbot.detectar_intencion(mensaje)
+        solo_intencion = time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        for mensaje in mensajes:
+            chatbot.responder(mensaje)
+        completo = time.perf_counter() - inicio
+
+        total = len(mensajes)
+        self.stdout.write(f"Mensajes: {total}")
+        self.stdout.write(f"Detección de intención: {total / solo_intencion:,.0f} mensajes/s por núcleo")
+        self.stdout.write(f"Respuesta completa (con catálogo cacheado): {total / completo:,.0f} mensajes/s por núcleo")
@@ -0,0 +1,197 @@
+"""
+Benchmark de las consultas más usadas sobre una base SQLite sintética.
+
+Crea una base temporal con el esquema real (migraciones), la llena con
+--citas filas (1.000.000 por defecto), y ejecuta cada consulta caliente dos
+veces: primero SIN los índices compuestos de Cita/Receta/Pago y luego CON
+ellos, mostrando el plan (EXPLAIN QUERY PLAN) y el tiempo medio.
+
+    python manage.py benchmark_indices
+    python manage.py benchmark_indices --citas 200000 --repeticiones 20
+"""
+import os
+import random
+import tempfile
+import time
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+
+from apps.core.models import Cita, Pago, Receta
+
+ALIAS = 'benchmark'
+
+
+class Command(BaseCommand):
+    help = "Compara planes y tiempos de las consultas de citas/recetas/pagos con y sin índices"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--citas', type=int, default=1_000_000)
+        parser.add_argument('--pacientes', type=int, default=20_000)
+        parser.add_argument('--repeticiones', type=int, default=10)
+        parser.add_argument('--semilla', type=int, default=2026)
+
+    def handle(self, *args, **opts):
+        random.seed(opts['semilla'])
+        carpeta = tempfile.mkdtemp(prefix='benchmark_indices_')
+        ruta = os.path.join(carpeta, 'benchmark.sqlite3')
+        connections.settings[ALIAS] = {**connections.settings['default'], 'NAME': ruta}
+
+        try:
+            self.stdout.write(f"Creando esquema en {ruta} ...")
+            call_command('migrate', database=ALIAS, verbosity=0)
+            self._cargar_datos(opts['citas'], opts['pacientes'])
+
+            consultas = self._consultas(opts['pacientes'])
+
+            self._quitar_indices()
+            self.stdout.write(self.style.WARNING("\n=== SIN ÍNDICES COMPUESTOS ==="))
+            antes = self._medir(consultas, opts['repeticiones'])
+
+            self._crear_indices()
+            self.stdout.write(self.style.SUCCESS("\n=== CON ÍNDICES COMPUESTOS ==="))
+            despues = self._medir(consultas, opts['repeticiones'])
+
+            self.stdout.write("\n=== RESUMEN (ms por consulta) ===")
+            for nombre in consultas:
+                mejora = antes[nombre] / despues[nombre] if despues[nombre] else float('inf')
+                self.stdout.write(f"{nombre:<40} {antes[nombre]:>10.3f} -> {despues[nombre]:>10.3f}  (x{mejora:.1f})")
+        finally:
+            connections[ALIAS].close()
+            del connections.settings[ALIAS]
+            if os.path.exists(ruta):
+                os.remove(ruta)
+            os.rmdir(carpeta)
+
+    # ---------------------------------------------------------
+    # DATOS SINTÉTICOS
+    # ---------------------------------------------------------
+    def _cargar_datos(self, total_citas, total_pacientes):
+        conexion = connections[ALIAS]
+        inicio_carga = time.perf_counter()
+        hoy = date.today()
+        horas = [f"{h:02d}:{m:02d}:00" for h in range(9, 20) for m in (0, 30)]
+        estados = ['pendiente', 'confirmada', 'finalizada', 'cancelada']
+        metodos = ['efectivo', 'transferencia', 'yape_plin', 'tarjeta']
+        ahora = timezone.now().isoformat(sep=' ')
+
+        with conexion.cursor() as cursor:
+            cursor.execute("PRAGMA synchronous = OFF")
+            cursor.execute("PRAGMA journal_mode = MEMORY")
+
+            cursor.executemany(
+                "INSERT INTO auth_user (id, password, is_superuser, username, first_name, last_name, email, is_staff, is_active, date_joined) "
+                "VALUES (%s, '', 0, %s, %s, '', '', 0, 1, %s)",
+                [(i, f"paciente{i}", f"Paciente {i}", ahora) for i in range(1, total_pacientes + 1)],
+            )
+            cursor.executemany(
+                "INSERT INTO core_servicio (id, titulo, descripcion, imagen, precio_estimado, created_at) VALUES (%s, %s, '', '', %s, %s)",
+                [(i, f"Servicio {i}", 50 * i, ahora) for i in range(1, 9)],
+            )
+
+            # Citas repartidas en ~3 años alrededor de hoy, sin choques de (fecha, hora)
+            dias = total_citas // len(horas) + 1
+            turnos = [(d, h) for d in range(dias) for h in horas]
+            random.shuffle(turnos)
+            lote = []
+            pagos = []
+            for i, (d, h) in enumerate(turnos[:total_citas], 1):
+                fecha = hoy + timedelta(days=d - dias // 2)
+                inicio = timezone.make_aware(datetime.fromisoformat(f"{fecha} {h}")).astimezone(dt_timezone.utc)
+                lote.append((i, random.randint(1, total_pacientes), random.randint(1, 8), fecha.isoformat(), h, h,
+                             random.choice(estados), inicio.isoformat(sep=' ')))
+                if i % 3 == 0:
+                    pagos.append((i, 100, random.choice((0, 50, 100)), random.choice(metodos), inicio.isoformat(sep=' '), i))
+                if len(lote) >= 50_000:
+                    self._insertar_citas(cursor, lote)
+                    lote = []
+            self._insertar_citas(cursor, lote)
+            cursor.executemany(
+                "INSERT INTO core_pago (id, monto_total, monto_pagado, metodo, fecha_pago, cita_id) VALUES (%s, %s, %s, %s, %s, %s)",
+                pagos,
+            )
+            cursor.executemany(
+                "INSERT INTO core_receta (paciente_id, diagnostico, medicamentos, fecha_emision) VALUES (%s, 'Dx', 'Rx', %s)",
+                [(random.randint(1, total_pacientes), (timezone.now() - timedelta(minutes=random.randint(0, 10**6))).isoformat(sep=' '))
+                 for _ in range(total_citas // 5)],
+            )
+            cursor.execute("ANALYZE")
+
+        self.stdout.write(f"Datos cargados ({total_citas} citas) en {time.perf_counter() - inicio_carga:.1f}s")
+
+    def _insertar_citas(self, cursor, filas):
+        cursor.executemany(
+            # Las horas son inicios de turno: turno = hora
+            "INSERT INTO core_cita (id, paciente_id, servicio_id, fecha, hora, turno, estado, inicio, materiales_descontados) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, FALSE)",
+            filas,
+        )
+
+    # ---------------------------------------------------------
+    # CONSULTAS CALIENTES
+    # ---------------------------------------------------------
+    def _consultas(self, total_pacientes):
+        citas = Cita.objects.using(ALIAS)
+        hoy = date.today()
+        paciente = random.randint(1, total_pacientes)
+        return {
+            'dashboard: citas del paciente': lambda: list(citas.filter(paciente_id=paciente).order_by('fecha', 'hora')),
+            'Cita.clean: turno (fecha, hora)': lambda: citas.filter(fecha=hoy, hora='10:00').exclude(estado='cancelada').exists(),
+            'dashboard: recetas del paciente': lambda: list(Receta.objects.using(ALIAS).filter(paciente_id=paciente).order_by('-fecha_emision')),
+            'admin: estado + mes (date_hierarchy)': lambda: list(citas.filter(estado='pendiente', fecha__year=hoy.year, fecha__month=hoy.month).order_by('-pk')[:100]),
+            'admin: servicio + fecha': lambda: citas.filter(servicio_id=3, fecha__gte=hoy).count(),
+            'rango: próximos 7 días (inicio)': lambda: list(citas.proximos_dias(7)),
+            'rango: este mes (inicio)': lambda: citas.del_mes().count(),
+            'caja: pagos del mes por método': lambda: Pago.objects.using(ALIAS).filter(metodo='efectivo', fecha_pago__gte=timezone.now() - timedelta(days=30)).count(),
+        }
+
+    def _plan(self, consulta):
+        # Reconstruimos el queryset a partir de la lambda para pedir el plan
+        with connections[ALIAS].execute_wrapper(self._capturar_sql):
+            self._ultimo_sql = None
+            consulta()
+        sql, params = self._ultimo_sql
+        with connections[ALIAS].cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            return [fila[-1] for fila in cursor.fetchall()]
+
+    def _capturar_sql(self, execute, sql, params, many, context):
+        self._ultimo_sql = (sql, params)
+        return execute(sql, params, many, context)
+
+    def _medir(self, consultas, repeticiones):
+        tiempos = {}
+        for nombre, consulta in consultas.items():
+            self.stdout.write(f"\n{nombre}")
+            for paso in self._plan(consulta):
+                self.stdout.write(f"    {paso}")
+            consulta()  # calentamos la caché de páginas
+            inicio = time.perf_counter()
+            for _ in range(repeticiones):
+                consulta()
+            tiempos[nombre] = (time.perf_counter() - inicio) * 1000 / repeticiones
+            self.stdout.write(f"    -> {tiempos[nombre]:.3f} ms")
+        return tiempos
+
+    # ---------------------------------------------------------
+    # ÍNDICES
+    # ---------------------------------------------------------
+    def _indices(self):
+        return [(modelo, indice) for modelo in (Cita, Receta, Pago) for indice in modelo._meta.indexes]
+
+    def _quitar_indices(self):
+        with connections[ALIAS].schema_editor() as editor:
+            for modelo, indice in self._indices():
+                editor.remove_index(modelo, indice)
+        with connections[ALIAS].cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def _crear_indices(self):
+        with connections[ALIAS].schema_editor() as editor:
+            for modelo, indice in self._indices():
+                editor.add_index(modelo, indice)
+        with connections[ALIAS].cursor() as cursor:
+            cursor.execute("ANALYZE")
@@ -0,0 +1,29 @@
+"""
+Despachador de la bandeja de salida de correos.
+
+    python manage.py enviar_correos                 # vacía la cola y termina (cron)
+    python manage.py enviar_correos --continuo      # proceso worker (Procfile)
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.core.correo import despachar_pendientes
+
+
+class Command(BaseCommand):
+    help = "Envía los correos encolados en lotes sobre una conexión SMTP reutilizada"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=None, help="Mensajes por conexión SMTP (CORREO_LOTE)")
+        parser.add_argument('--continuo', action='store_true', help="Seguir revisando la cola indefinidamente")
+        parser.add_argument('--intervalo', type=float, default=5.0, help="Segundos entre revisiones en modo continuo")
+
+    def handle(self, *args, **opts):
+        while True:
+            enviados, fallidos = despachar_pendientes(opts['lote'])
+            if enviados or fallidos or not opts['continuo']:
+                self.stdout.write(f"Correos enviados: {enviados} | con error (reintentarán): {fallidos}")
+            if not opts['continuo']:
+                break
+            time.sleep(opts['intervalo'])
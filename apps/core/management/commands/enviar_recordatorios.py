@@ -0,0 +1,29 @@
+"""
+Recordatorios de citas para cron.
+
+    python manage.py enviar_recordatorios                         # ambos tipos
+    python manage.py enviar_recordatorios --tipo proximas_horas   # cada 15-30 min
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.core.models import Recordatorio
+from apps.core.recordatorios import enviar_recordatorios
+
+
+class Command(BaseCommand):
+    help = "Envía los recordatorios de citas de mañana y de las próximas 2 horas"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tipo', choices=[t for t, _ in Recordatorio.TIPOS], help="Solo un tipo de recordatorio")
+        parser.add_argument('--lote', type=int, default=None, help="Correos por conexión SMTP (RECORDATORIOS_LOTE)")
+
+    def handle(self, *args, **opts):
+        tipos = [opts['tipo']] if opts['tipo'] else [t for t, _ in Recordatorio.TIPOS]
+        for tipo in tipos:
+            inicio = time.perf_counter()
+            enviados, fallidos = enviar_recordatorios(tipo, lote=opts['lote'])
+            self.stdout.write(
+                f"{tipo}: {enviados} enviados, {fallidos} con error en {time.perf_counter() - inicio:.2f}s"
+            )
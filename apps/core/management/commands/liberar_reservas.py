@@ -0,0 +1,29 @@
+"""
+Barrido de reservas de la tienda: devuelve el stock de los pedidos que no se
+pagaron a tiempo (TIENDA_MINUTOS_RESERVA).
+
+    python manage.py liberar_reservas                 # una pasada y termina (cron)
+    python manage.py liberar_reservas --continuo      # proceso worker (Procfile)
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.core.pedidos import liberar_vencidas
+
+
+class Command(BaseCommand):
+    help = "Libera el stock de los pedidos de la tienda cuya reserva venció sin pago"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--continuo', action='store_true', help="Seguir revisando indefinidamente")
+        parser.add_argument('--intervalo', type=float, default=30.0, help="Segundos entre revisiones en modo continuo")
+
+    def handle(self, *args, **opts):
+        while True:
+            liberados = liberar_vencidas()
+            if liberados or not opts['continuo']:
+                self.stdout.write(f"Pedidos vencidos liberados: {liberados}")
+            if not opts['continuo']:
+                break
+            time.sleep(opts['intervalo'])
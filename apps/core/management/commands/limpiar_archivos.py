@@ -0,0 +1,29 @@
+"""
+Recolección del almacén deduplicado de documentos clínicos: borra los
+archivos que ningún Documento usa (ver apps/core/almacenamiento.py).
+
+    python manage.py limpiar_archivos                     # una pasada (cron, p. ej. cada noche)
+    python manage.py limpiar_archivos --recontar          # antes recalcula las referencias
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from apps.core import almacenamiento
+
+
+class Command(BaseCommand):
+    help = "Borra los documentos clínicos deduplicados que ya no usa ningún Documento"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recontar', action='store_true', help="Recalcular las referencias desde los Documento")
+        parser.add_argument(
+            '--gracia-minutos', type=int, default=int(almacenamiento.GRACIA.total_seconds() // 60),
+            help="No borrar archivos subidos hace menos de estos minutos",
+        )
+
+    def handle(self, *args, **opts):
+        if opts['recontar']:
+            self.stdout.write(f"Referencias corregidas: {almacenamiento.recontar()}")
+        borrados, liberados = almacenamiento.recolectar(timedelta(minutes=opts['gracia_minutos']))
+        self.stdout.write(f"Archivos borrados: {borrados} ({liberados / 1024 / 1024:.1f} MB liberados)")
@@ -0,0 +1,29 @@
+"""
+Worker de exportaciones de citas (las que el admin deja en cola).
+
+    python manage.py procesar_exportaciones                 # procesa la cola y termina (cron)
+    python manage.py procesar_exportaciones --continuo      # proceso worker (Procfile)
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.core.exportacion import procesar_pendientes
+
+
+class Command(BaseCommand):
+    help = "Genera los archivos de las exportaciones de citas en cola"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--continuo', action='store_true', help="Seguir revisando la cola indefinidamente")
+        parser.add_argument('--intervalo', type=float, default=5.0, help="Segundos entre revisiones en modo continuo")
+
+    def handle(self, *args, **opts):
+        while True:
+            inicio = time.perf_counter()
+            procesadas = procesar_pendientes()
+            if procesadas or not opts['continuo']:
+                self.stdout.write(f"Exportaciones generadas: {procesadas} en {time.perf_counter() - inicio:.2f}s")
+            if not opts['continuo']:
+                break
+            time.sleep(opts['intervalo'])
@@ -0,0 +1,32 @@
+"""
+Pronóstico de agotamiento de insumos con la agenda futura.
+
+    python manage.py pronosticar_insumos                # próximos 90 días (cron diario)
+    python manage.py pronosticar_insumos --dias 30
+
+Cruza las citas programadas con los materiales de cada servicio y guarda en
+cada insumo cuándo baja del mínimo, cuándo deja de alcanzar y cuánto se va a
+gastar. El admin (Inventario) lo muestra en el panel de alertas.
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.core import inventario
+
+
+class Command(BaseCommand):
+    help = "Proyecta la fecha de agotamiento de cada insumo según las citas programadas"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=inventario.DIAS_PRONOSTICO, help="Días de agenda a considerar")
+
+    def handle(self, *args, **opts):
+        if opts['dias'] < 1:
+            raise CommandError("--dias debe ser al menos 1")
+        inicio = time.perf_counter()
+        agotados = inventario.actualizar_pronostico(opts['dias'])
+        self.stdout.write(
+            f"Pronóstico a {opts['dias']} días: {agotados} insumo(s) no alcanzan para las citas programadas "
+            f"({time.perf_counter() - inicio:.2f}s)"
+        )
@@ -0,0 +1,150 @@
+"""
+Prueba de carga de los endpoints JSON (chatbot y disponibilidad).
+
+Abre N conexiones simultáneas contra uno o varios servidores ya levantados y
+mide peticiones por segundo, latencias y errores. Sirve para comparar el
+modo WSGI (gunicorn sync, un hilo por conexión) con el modo ASGI (uvicorn):
+
+    gunicorn config.wsgi -w 4 -b 127.0.0.1:8000
+    gunicorn config.asgi -c config/gunicorn_asgi.py -w 4 -b 127.0.0.1:8001
+    python manage.py prueba_carga http://127.0.0.1:8000 http://127.0.0.1:8001 --conexiones 500
+
+El cliente es asyncio puro (HTTP/1.1 con keep-alive cuando el servidor lo
+permite), así que no hace falta instalar nada más.
+"""
+import asyncio
+import statistics
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+RUTAS = [
+    '/bot-respuesta/?msg=cuanto+cuesta+una+limpieza',
+    '/bot-respuesta/?msg=horaio+de+atencion',
+    '/disponibilidad/',
+]
+
+
+class Resultado:
+    def __init__(self):
+        self.latencias = []
+        self.errores = 0
+        self.conexiones_abiertas = 0
+        self.max_simultaneas = 0
+
+
+async def _leer_respuesta(lector):
+    """ Lee una respuesta HTTP/1.1 completa. Devuelve (estado, mantener_conexion) """
+    linea_estado = await lector.readline()
+    if not linea_estado:
+        raise ConnectionError("El servidor cerró la conexión")
+    estado = int(linea_estado.split()[1])
+
+    cabeceras = {}
+    while True:
+        linea = await lector.readline()
+        if linea in (b'\r\n', b'\n', b''):
+            break
+        nombre, _, valor = linea.decode('latin-1').partition(':')
+        cabeceras[nombre.strip().lower()] = valor.strip().lower()
+
+    if cabeceras.get('transfer-encoding') == 'chunked':
+        while True:
+            largo = int((await lector.readline()).split(b';')[0], 16)
+            await lector.readexactly(largo + 2)
+            if largo == 0:
+                break
+    elif 'content-length' in cabeceras:
+        await lector.readexactly(int(cabeceras['content-length']))
+    else:
+        await lector.read()
+        return estado, False
+
+    return estado, cabeceras.get('connection') != 'close'
+
+
+async def _usuario(host, puerto, rutas, fin, tiempo_max, resultado, numero):
+    """ Un cliente virtual: reutiliza su conexión mientras el servidor lo permita """
+    lector = escritor = None
+    i = numero
+    while time.monotonic() < fin:
+        ruta = rutas[i % len(rutas)]
+        i += 1
+        inicio = time.perf_counter()
+        try:
+            if escritor is None:
+                lector, escritor = await asyncio.wait_for(asyncio.open_connection(host, puerto), tiempo_max)
+                resultado.conexiones_abiertas += 1
+                resultado.max_simultaneas = max(resultado.max_simultaneas, resultado.conexiones_abiertas)
+            escritor.write(
+                f"GET {ruta} HTTP/1.1\r\nHost: {host}\r\nAccept: application/json\r\n\r\n".encode()
+            )
+            await escritor.drain()
+            estado, mantener = await asyncio.wait_for(_leer_respuesta(lector), tiempo_max)
+        except (OSError, ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, IndexError):
+            resultado.errores += 1
+            mantener = False
+        else:
+            if estado == 200:
+                resultado.latencias.append(time.perf_counter() - inicio)
+            else:
+                resultado.errores += 1
+
+        if not mantener and escritor is not None:
+            escritor.close()
+            resultado.conexiones_abiertas -= 1
+            lector = escritor = None
+
+    if escritor is not None:
+        escritor.close()
+        resultado.conexiones_abiertas -= 1
+
+
+async def _medir(url, rutas, conexiones, duracion, tiempo_max):
+    partes = urlsplit(url)
+    if partes.scheme != 'http' or not partes.hostname:
+        raise CommandError(f"URL no soportada: {url} (usa http://host:puerto)")
+    resultado = Resultado()
+    fin = time.monotonic() + duracion
+    inicio = time.perf_counter()
+    await asyncio.gather(*(
+        _usuario(partes.hostname, partes.port or 80, rutas, fin, tiempo_max, resultado, n)
+        for n in range(conexiones)
+    ))
+    return resultado, time.perf_counter() - inicio
+
+
+def _percentil(valores, p):
+    return valores[min(len(valores) - 1, int(len(valores) * p))] * 1000 if valores else 0.0
+
+
+class Command(BaseCommand):
+    help = "Compara la concurrencia que aguantan uno o varios servidores (p. ej. WSGI vs ASGI)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='+', help="Servidores a probar, p. ej. http://127.0.0.1:8000")
+        parser.add_argument('--conexiones', type=int, default=200, help="Clientes simultáneos")
+        parser.add_argument('--duracion', type=float, default=10.0, help="Segundos de prueba por servidor")
+        parser.add_argument('--timeout', type=float, default=10.0, help="Segundos máximos por petición")
+        parser.add_argument('--ruta', action='append', dest='rutas', help="Ruta a pedir (se puede repetir)")
+
+    def handle(self, *args, **opts):
+        rutas = opts['rutas'] or RUTAS
+        self.stdout.write(
+            f"{opts['conexiones']} conexiones, {opts['duracion']:.0f}s por servidor, rutas: {', '.join(rutas)}\n"
+        )
+        self.stdout.write(
+            f"{'servidor':<28}{'ok':>9}{'errores':>9}{'pet/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'simult.':>9}"
+        )
+        for url in opts['urls']:
+            resultado, segundos = asyncio.run(
+                _medir(url, rutas, opts['conexiones'], opts['duracion'], opts['timeout'])
+            )
+            latencias = sorted(resultado.latencias)
+            self.stdout.write(
+                f"{url:<28}{len(latencias):>9}{resultado.errores:>9}{len(latencias) / segundos:>10.0f}"
+                f"{(statistics.median(latencias) * 1000 if latencias else 0):>9.1f}"
+                f"{_percentil(latencias, 0.95):>9.1f}{_percentil(latencias, 0.99):>9.1f}"
+                f"{resultado.max_simultaneas:>9}"
+            )
@@ -0,0 +1,133 @@
+"""
+Prueba de carga del checkout de la tienda (pedidos.py).
+
+Crea una base de prueba aparte (la misma que usan los tests), carga unos
+pocos productos con poco stock y lanza --compradores hilos que confirman su
+carrito A LA VEZ. Al final comprueba, producto por producto, que:
+
+    unidades vendidas <= stock inicial            (cero sobreventas)
+    stock final + unidades retenidas == inicial   (no se perdió ni se creó stock)
+
+y repite la cuenta después de vencer la mitad de las reservas y barrerlas con
+liberar_vencidas().
+
+    python manage.py prueba_tienda
+    python manage.py prueba_tienda --compradores 200 --productos 3 --stock 50
+"""
+import random
+import statistics
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Sum
+from django.utils import timezone
+
+from apps.core import pedidos
+from apps.core.models import ItemPedido, Pedido, Producto
+
+
+class Command(BaseCommand):
+    help = "Lanza muchos checkouts simultáneos y verifica que la tienda no sobrevenda"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--compradores', type=int, default=100, help="Checkouts simultáneos (uno por hilo)")
+        parser.add_argument('--productos', type=int, default=3)
+        parser.add_argument('--stock', type=int, default=40, help="Stock inicial de cada producto")
+        parser.add_argument('--semilla', type=int, default=2026)
+
+    def handle(self, *args, **opts):
+        random.seed(opts['semilla'])
+        nombre_original = connection.settings_dict['NAME']
+        self.stdout.write("Creando base de prueba ...")
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self._probar(opts['compradores'], opts['productos'], opts['stock'])
+        finally:
+            connection.creation.destroy_test_db(nombre_original, verbosity=0)
+
+    def _probar(self, total_compradores, total_productos, stock):
+        productos = [
+            Producto.objects.create(nombre=f"Producto {i}", descripcion="-", precio=10 + i, imagen='productos/x.jpg', stock=stock)
+            for i in range(1, total_productos + 1)
+        ]
+        compradores = [User.objects.create(username=f"comprador{i}") for i in range(total_compradores)]
+        carritos = [
+            {p.pk: random.randint(1, 3) for p in random.sample(productos, random.randint(1, total_productos))}
+            for _ in compradores
+        ]
+
+        barrera = threading.Barrier(total_compradores)
+        estados, latencias = [], []
+
+        def comprar(comprador, carrito):
+            try:
+                barrera.wait()
+                inicio = time.perf_counter()
+                try:
+                    pedidos.reservar_pedido(comprador, carrito)
+                    estados.append('reservados')
+                except pedidos.SinStock:
+                    estados.append('sin stock')
+                latencias.append(time.perf_counter() - inicio)
+            except Exception:
+                estados.append('errores')
+            finally:
+                connection.close()
+
+        hilos = [threading.Thread(target=comprar, args=args) for args in zip(compradores, carritos)]
+        inicio = time.perf_counter()
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        duracion = time.perf_counter() - inicio
+        resultados = Counter(estados)
+
+        pedido_medio = statistics.mean(sum(c.values()) for c in carritos)
+        self.stdout.write(
+            f"\n{total_compradores} checkouts simultáneos sobre {total_productos} producto(s) con {stock} unidades "
+            f"(pedido medio: {pedido_medio:.1f} unidades) en {duracion:.2f}s"
+        )
+        self.stdout.write(
+            f"Reservados: {resultados['reservados']} | sin stock: {resultados['sin stock']} | errores: {resultados['errores']}"
+        )
+        if latencias:
+            latencias.sort()
+            self.stdout.write(
+                f"Latencia: mediana {statistics.median(latencias) * 1000:.0f}ms, "
+                f"p95 {latencias[int(len(latencias) * 0.95) - 1] * 1000:.0f}ms"
+            )
+
+        self._verificar("Tras los checkouts", productos, stock)
+
+        # La mitad de las reservas vence sin pago y el barrido devuelve su stock
+        vencidos = list(Pedido.objects.filter(estado=Pedido.RESERVADO).values_list('pk', flat=True)[::2])
+        Pedido.objects.filter(pk__in=vencidos).update(reservado_hasta=timezone.now() - timedelta(minutes=1))
+        liberados = pedidos.liberar_vencidas()
+        self.stdout.write(f"\nBarrido: {liberados} reserva(s) vencida(s) liberada(s)")
+        self._verificar("Tras el barrido", productos, stock)
+
+        if resultados['errores']:
+            raise CommandError(f"{resultados['errores']} checkout(s) terminaron con error")
+
+    def _verificar(self, titulo, productos, stock_inicial):
+        retenido = dict(
+            ItemPedido.objects.filter(pedido__estado__in=[Pedido.RESERVADO, Pedido.PAGADO])
+            .values_list('producto_id').annotate(unidades=Sum('cantidad')).order_by()
+        )
+        self.stdout.write(f"\n=== {titulo.upper()} ===")
+        self.stdout.write(f"{'producto':<14}{'inicial':>9}{'retenido':>10}{'final':>8}{'sobreventa':>12}")
+        problemas = 0
+        for producto in Producto.objects.filter(pk__in=[p.pk for p in productos]).order_by('pk'):
+            vendido = retenido.get(producto.pk, 0)
+            sobreventa = max(0, vendido - stock_inicial)
+            problemas += sobreventa > 0 or producto.stock + vendido != stock_inicial
+            self.stdout.write(f"{producto.nombre:<14}{stock_inicial:>9}{vendido:>10}{producto.stock:>8}{sobreventa:>12}")
+        if problemas:
+            raise CommandError(f"{titulo}: el stock no cuadra en {problemas} producto(s)")
+        self.stdout.write(self.style.SUCCESS("Cero sobreventas; el stock cuadra."))
@@ -0,0 +1,26 @@
+"""
+Rehace desde cero el índice de búsqueda del admin (pacientes y recetas).
+
+    python manage.py reconstruir_busqueda
+
+Normalmente no hace falta: las señales lo mantienen al día al guardar. Sirve
+tras cargas masivas hechas fuera del ORM o con queryset.update().
+"""
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from apps.core import busqueda
+from apps.core.models import Receta
+
+
+class Command(BaseCommand):
+    help = "Reconstruye el índice de texto completo de pacientes y recetas"
+
+    def handle(self, *args, **opts):
+        inicio = time.perf_counter()
+        pacientes, recetas = busqueda.reconstruir(User, Receta)
+        self.stdout.write(
+            f"Índice de búsqueda reconstruido: {pacientes} pacientes y {recetas} recetas en {time.perf_counter() - inicio:.2f}s"
+        )
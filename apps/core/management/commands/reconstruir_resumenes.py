@@ -0,0 +1,28 @@
+"""
+Rehace desde cero los resúmenes diarios del tablero del admin.
+
+    python manage.py reconstruir_resumenes
+
+Normalmente no hace falta: las señales y las acciones del admin los mantienen
+al día. Sirve tras cargas masivas hechas fuera del ORM (SQL directo, fixtures
+con loaddata --raw) o para comprobar que no se han desviado.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.core import resumenes
+from apps.core.models import ResumenCitasDia, ResumenPagosDia
+
+
+class Command(BaseCommand):
+    help = "Recalcula los resúmenes diarios de citas y pagos del tablero del admin"
+
+    def handle(self, *args, **opts):
+        inicio = time.perf_counter()
+        resumenes.recalcular_citas()
+        resumenes.recalcular_pagos()
+        self.stdout.write(
+            f"Resúmenes reconstruidos: {ResumenCitasDia.objects.count()} de citas, "
+            f"{ResumenPagosDia.objects.count()} de pagos en {time.perf_counter() - inicio:.2f}s"
+        )
@@ -0,0 +1,36 @@
+"""
+Middlewares propios.
+
+WhiteNoiseMiddleware solo sabe trabajar en modo síncrono: servido por ASGI,
+Django tendría que saltar a un hilo en CADA petición solo para atravesarlo,
+y las vistas asíncronas (chatbot, disponibilidad) perderían su ventaja.
+Esta versión es compatible con ambos modos: la búsqueda del archivo estático
+es un diccionario en memoria y solo el envío del archivo va a un hilo.
+"""
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+
+class WhiteNoiseAsincrono(WhiteNoiseMiddleware):
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        self.es_asincrono = iscoroutinefunction(self.get_response)
+        if self.es_asincrono:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.es_asincrono:
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve, thread_sensitive=False)(static_file, request)
+        return await self.get_response(request)
@@ -0,0 +1,47 @@
+# Generated by Django 6.0.2 on 2026-10-18 00:30
+
+from django.db import migrations, models
+
+
+def construir_indice(apps, schema_editor):
+    """ Llena el índice de disponibilidad con las citas que ya existen """
+    from apps.core.agenda import ESTADOS_LIBERADOS, calcular_mapa
+
+    Cita = apps.get_model('core', 'Cita')
+    Disponibilidad = apps.get_model('core', 'Disponibilidad')
+    db = schema_editor.connection.alias
+
+    horas_por_dia = {}
+    citas = Cita.objects.using(db).exclude(estado__in=ESTADOS_LIBERADOS).values_list('fecha', 'hora')
+    for fecha, hora in citas.iterator():
+        horas_por_dia.setdefault(fecha, []).append(hora)
+
+    filas = []
+    for fecha, horas in horas_por_dia.items():
+        mapa = calcular_mapa(fecha, horas)
+        if mapa:
+            filas.append(Disponibilidad(fecha=fecha, ocupados=mapa))
+    Disponibilidad.objects.using(db).bulk_create(filas, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_producto_fichamedica'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Disponibilidad',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField(unique=True, verbose_name='Fecha')),
+                ('ocupados', models.BigIntegerField(default=0, verbose_name='Mapa de turnos ocupados')),
+            ],
+            options={
+                'verbose_name': 'Disponibilidad',
+                'verbose_name_plural': 'Disponibilidad (Agenda)',
+            },
+        ),
+        migrations.RunPython(construir_indice, migrations.RunPython.noop),
+    ]
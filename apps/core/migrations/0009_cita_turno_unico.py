@@ -0,0 +1,19 @@
+# Generated by Django 6.0.2 on 2026-10-18 00:31
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_disponibilidad'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='cita',
+            constraint=models.UniqueConstraint(condition=models.Q(('estado', 'cancelada'), _negated=True), fields=('fecha', 'hora'), name='cita_turno_unico_activo', violation_error_message='Ya existe una cita programada en esa fecha y hora.'),
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 6.0.2 on 2026-10-18 00:34
+
+from django.conf import settings
+from datetime import datetime
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def calcular_inicio(apps, schema_editor):
+    """ Rellena `inicio` (fecha + hora) en las citas existentes """
+    Cita = apps.get_model('core', 'Cita')
+    db = schema_editor.connection.alias
+    lote = []
+    for cita in Cita.objects.using(db).only('id', 'fecha', 'hora').iterator(chunk_size=2000):
+        cita.inicio = timezone.make_aware(datetime.combine(cita.fecha, cita.hora))
+        lote.append(cita)
+        if len(lote) >= 2000:
+            Cita.objects.using(db).bulk_update(lote, ['inicio'])
+            lote = []
+    Cita.objects.using(db).bulk_update(lote, ['inicio'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_cita_turno_unico'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cita',
+            name='inicio',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Inicio'),
+        ),
+        migrations.RunPython(calcular_inicio, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='cita',
+            index=models.Index(fields=['paciente', 'fecha', 'hora'], name='cita_paciente_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cita',
+            index=models.Index(fields=['fecha', 'hora'], name='cita_fecha_hora_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cita',
+            index=models.Index(fields=['estado', 'fecha'], name='cita_estado_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cita',
+            index=models.Index(fields=['servicio', 'fecha'], name='cita_servicio_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cita',
+            index=models.Index(fields=['inicio'], name='cita_inicio_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pago',
+            index=models.Index(fields=['fecha_pago'], name='pago_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pago',
+            index=models.Index(fields=['metodo', 'fecha_pago'], name='pago_metodo_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='receta',
+            index=models.Index(fields=['paciente', '-fecha_emision'], name='receta_paciente_fecha_idx'),
+        ),
+    ]
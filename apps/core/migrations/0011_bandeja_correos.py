@@ -0,0 +1,37 @@
+# Generated by Django 6.0.2 on 2026-10-18 00:39
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_indices_consultas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CorreoPendiente',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('asunto', models.CharField(max_length=200, verbose_name='Asunto')),
+                ('remitente', models.CharField(max_length=200, verbose_name='Remitente')),
+                ('destinatarios', models.TextField(help_text='Separados por coma', verbose_name='Destinatarios')),
+                ('cuerpo_texto', models.TextField(verbose_name='Texto plano')),
+                ('cuerpo_html', models.TextField(blank=True, verbose_name='HTML')),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('enviado', 'Enviado'), ('fallido', 'Fallido')], default='pendiente', max_length=20, verbose_name='Estado')),
+                ('intentos', models.PositiveIntegerField(default=0, verbose_name='Intentos')),
+                ('proximo_intento', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Próximo intento')),
+                ('lote_envio', models.CharField(blank=True, editable=False, max_length=32, verbose_name='Lote de envío')),
+                ('ultimo_error', models.TextField(blank=True, verbose_name='Último error')),
+                ('creado', models.DateTimeField(auto_now_add=True, verbose_name='Creado')),
+                ('enviado_en', models.DateTimeField(blank=True, null=True, verbose_name='Enviado')),
+            ],
+            options={
+                'verbose_name': 'Correo en Cola',
+                'verbose_name_plural': 'Bandeja de Salida (Correos)',
+                'indexes': [models.Index(fields=['estado', 'proximo_intento'], name='correo_pendiente_idx'), models.Index(fields=['lote_envio'], name='correo_lote_idx')],
+            },
+        ),
+    ]
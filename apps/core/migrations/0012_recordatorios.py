@@ -0,0 +1,28 @@
+# Generated by Django 6.0.2 on 2026-10-18 00:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_bandeja_correos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Recordatorio',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('dia_anterior', 'Un día antes'), ('proximas_horas', 'Dos horas antes')], max_length=20, verbose_name='Tipo')),
+                ('enviado_en', models.DateTimeField(auto_now_add=True, verbose_name='Enviado')),
+                ('cita', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recordatorios', to='core.cita', verbose_name='Cita')),
+            ],
+            options={
+                'verbose_name': 'Recordatorio',
+                'verbose_name_plural': 'Recordatorios Enviados',
+                'constraints': [models.UniqueConstraint(fields=('cita', 'tipo'), name='recordatorio_unico_por_tipo')],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 6.0.2 on 2026-10-18 00:53
+
+import apps.core.models
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_recordatorios'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Exportacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('formato', models.CharField(choices=[('xlsx', 'Excel (XLSX)'), ('csv', 'CSV')], default='xlsx', max_length=10, verbose_name='Formato')),
+                ('consulta', models.BinaryField()),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('procesando', 'Procesando'), ('lista', 'Lista para descargar'), ('fallida', 'Fallida')], default='pendiente', max_length=20, verbose_name='Estado')),
+                ('filas', models.PositiveIntegerField(default=0, verbose_name='Filas')),
+                ('archivo', models.FileField(blank=True, storage=apps.core.models.almacen_exportaciones, upload_to='citas/', verbose_name='Archivo')),
+                ('error', models.TextField(blank=True, verbose_name='Error')),
+                ('creado', models.DateTimeField(auto_now_add=True, verbose_name='Solicitado')),
+                ('terminado', models.DateTimeField(blank=True, null=True, verbose_name='Terminado')),
+                ('solicitado_por', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='Solicitado por')),
+            ],
+            options={
+                'verbose_name': 'Exportación',
+                'verbose_name_plural': 'Exportaciones de Citas',
+                'ordering': ['-creado'],
+                'indexes': [models.Index(fields=['estado', 'creado'], name='exportacion_estado_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 6.0.2 on 2026-10-18 01:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def construir_resumenes(apps, schema_editor):
+    """ Resume las citas y pagos que ya existen (después se mantienen al guardar) """
+    Cita = apps.get_model('core', 'Cita')
+    Pago = apps.get_model('core', 'Pago')
+    ResumenCitasDia = apps.get_model('core', 'ResumenCitasDia')
+    ResumenPagosDia = apps.get_model('core', 'ResumenPagosDia')
+    db = schema_editor.connection.alias
+
+    citas = Cita.objects.using(db).order_by().values('fecha', 'servicio', 'estado').annotate(cantidad=Count('id'))
+    ResumenCitasDia.objects.using(db).bulk_create(
+        [ResumenCitasDia(fecha=f['fecha'], servicio_id=f['servicio'], estado=f['estado'], cantidad=f['cantidad']) for f in citas],
+        batch_size=1000,
+    )
+    pagos = (
+        Pago.objects.using(db).order_by()
+        .annotate(dia=TruncDate('fecha_pago'))
+        .values('dia', 'metodo')
+        .annotate(cantidad=Count('id'), monto=Sum('monto_pagado'))
+    )
+    ResumenPagosDia.objects.using(db).bulk_create(
+        [ResumenPagosDia(fecha=f['dia'], metodo=f['metodo'], cantidad=f['cantidad'], monto=f['monto']) for f in pagos],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_exportaciones'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumenPagosDia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField(verbose_name='Fecha')),
+                ('metodo', models.CharField(choices=[('efectivo', 'Efectivo'), ('transferencia', 'Transferencia Bancaria'), ('yape_plin', 'Yape / Plin'), ('tarjeta', 'Tarjeta de Crédito/Débito')], max_length=20, verbose_name='Método de Pago')),
+                ('cantidad', models.IntegerField(default=0, verbose_name='Pagos')),
+                ('monto', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Monto (S/)')),
+            ],
+            options={
+                'verbose_name': 'Resumen diario de pagos',
+                'verbose_name_plural': 'Resúmenes diarios de pagos',
+                'constraints': [models.UniqueConstraint(fields=('fecha', 'metodo'), name='resumen_pago_unico')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ResumenCitasDia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField(verbose_name='Fecha')),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('confirmada', 'Confirmada'), ('finalizada', 'Finalizada'), ('cancelada', 'Cancelada')], max_length=20, verbose_name='Estado')),
+                ('cantidad', models.IntegerField(default=0, verbose_name='Citas')),
+                ('servicio', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.servicio', verbose_name='Servicio')),
+            ],
+            options={
+                'verbose_name': 'Resumen diario de citas',
+                'verbose_name_plural': 'Resúmenes diarios de citas',
+                'constraints': [models.UniqueConstraint(fields=('fecha', 'servicio', 'estado'), name='resumen_cita_unico')],
+            },
+        ),
+        migrations.RunPython(construir_resumenes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 6.0.2 on 2026-10-18 01:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def stock_inicial(apps, schema_editor):
+    """ Un movimiento de entrada por el stock que ya había: el kardex suma lo mismo que `cantidad` """
+    Insumo = apps.get_model('core', 'Insumo')
+    MovimientoStock = apps.get_model('core', 'MovimientoStock')
+    db = schema_editor.connection.alias
+    MovimientoStock.objects.using(db).bulk_create([
+        MovimientoStock(insumo_id=pk, tipo='entrada', cantidad=cantidad, stock_resultante=cantidad, motivo='Stock inicial')
+        for pk, cantidad in Insumo.objects.using(db).filter(cantidad__gt=0).values_list('pk', 'cantidad')
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_resumenes_diarios'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MovimientoStock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('entrada', 'Entrada (compra / reposición)'), ('consumo', 'Consumo'), ('ajuste', 'Ajuste de inventario')], max_length=20, verbose_name='Tipo')),
+                ('cantidad', models.IntegerField(help_text='Positiva si entra, negativa si sale', verbose_name='Cantidad')),
+                ('stock_resultante', models.PositiveIntegerField(verbose_name='Stock Después')),
+                ('motivo', models.CharField(blank=True, max_length=200, verbose_name='Motivo / Detalle')),
+                ('creado', models.DateTimeField(auto_now_add=True, verbose_name='Fecha')),
+            ],
+            options={
+                'verbose_name': 'Movimiento de Stock',
+                'verbose_name_plural': 'Kardex (Movimientos de Stock)',
+                'ordering': ['-creado', '-id'],
+            },
+        ),
+        migrations.AddField(
+            model_name='insumo',
+            name='estado_stock',
+            field=models.GeneratedField(db_persist=True, expression=models.Case(models.When(cantidad=0, then=models.Value('AGOTADO')), models.When(cantidad__lte=models.F('stock_minimo'), then=models.Value('BAJO')), default=models.Value('OK')), output_field=models.CharField(max_length=10), verbose_name='Estado del Stock'),
+        ),
+        migrations.AddIndex(
+            model_name='insumo',
+            index=models.Index(fields=['estado_stock', 'nombre'], name='insumo_estado_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='insumo',
+            index=models.Index(fields=['fecha_vencimiento'], name='insumo_vencimiento_idx'),
+        ),
+        migrations.AddField(
+            model_name='movimientostock',
+            name='insumo',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movimientos', to='core.insumo', verbose_name='Insumo'),
+        ),
+        migrations.AddField(
+            model_name='movimientostock',
+            name='usuario',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='Registrado por'),
+        ),
+        migrations.AddIndex(
+            model_name='movimientostock',
+            index=models.Index(fields=['insumo', '-creado'], name='movimiento_insumo_idx'),
+        ),
+        migrations.RunPython(stock_inicial, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 6.0.2 on 2026-10-18 02:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def marcar_finalizadas(apps, schema_editor):
+    """ Las citas ya finalizadas no descuentan materiales: el stock actual ya refleja lo que gastaron """
+    Cita = apps.get_model('core', 'Cita')
+    Cita.objects.using(schema_editor.connection.alias).filter(estado='finalizada').update(materiales_descontados=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_kardex_insumos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MaterialServicio',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cantidad', models.PositiveIntegerField(default=1, verbose_name='Cantidad por Cita')),
+            ],
+            options={
+                'verbose_name': 'Material por Servicio',
+                'verbose_name_plural': 'Materiales por Servicio',
+            },
+        ),
+        migrations.AddField(
+            model_name='cita',
+            name='materiales_descontados',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Materiales Descontados'),
+        ),
+        migrations.AddField(
+            model_name='insumo',
+            name='agotamiento_estimado',
+            field=models.DateField(blank=True, editable=False, null=True, verbose_name='Se Agota el'),
+        ),
+        migrations.AddField(
+            model_name='insumo',
+            name='demanda_programada',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Demanda Programada'),
+        ),
+        migrations.AddField(
+            model_name='insumo',
+            name='reposicion_estimada',
+            field=models.DateField(blank=True, editable=False, null=True, verbose_name='Reponer Antes del'),
+        ),
+        migrations.AddIndex(
+            model_name='insumo',
+            index=models.Index(fields=['agotamiento_estimado'], name='insumo_agotamiento_idx'),
+        ),
+        migrations.AddField(
+            model_name='materialservicio',
+            name='insumo',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usos', to='core.insumo', verbose_name='Insumo'),
+        ),
+        migrations.AddField(
+            model_name='materialservicio',
+            name='servicio',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='materiales', to='core.servicio', verbose_name='Servicio'),
+        ),
+        migrations.AddConstraint(
+            model_name='materialservicio',
+            constraint=models.UniqueConstraint(fields=('servicio', 'insumo'), name='material_servicio_unico'),
+        ),
+        migrations.RunPython(marcar_finalizadas, migrations.RunPython.noop),
+    ]
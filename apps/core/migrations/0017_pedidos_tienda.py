@@ -0,0 +1,71 @@
+# Generated by Django 6.0.2 on 2026-10-18 03:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_materiales_servicio'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Pedido',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('estado', models.CharField(choices=[('reservado', 'Reservado (esperando pago)'), ('pagado', 'Pagado'), ('vencido', 'Vencido (stock liberado)'), ('cancelado', 'Cancelado')], default='reservado', max_length=20, verbose_name='Estado')),
+                ('total', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Total (S/)')),
+                ('creado', models.DateTimeField(auto_now_add=True, verbose_name='Fecha del Pedido')),
+                ('reservado_hasta', models.DateTimeField(verbose_name='Reserva Válida Hasta')),
+                ('pagado_en', models.DateTimeField(blank=True, null=True, verbose_name='Pagado el')),
+                ('cliente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pedidos', to=settings.AUTH_USER_MODEL, verbose_name='Cliente')),
+            ],
+            options={
+                'verbose_name': 'Pedido de la Tienda',
+                'verbose_name_plural': 'Pedidos de la Tienda',
+                'ordering': ['-creado'],
+            },
+        ),
+        migrations.CreateModel(
+            name='PagoPedido',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('monto_total', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Costo Total (S/)')),
+                ('monto_pagado', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Monto Abonado (S/)')),
+                ('metodo', models.CharField(choices=[('efectivo', 'Efectivo'), ('transferencia', 'Transferencia Bancaria'), ('yape_plin', 'Yape / Plin'), ('tarjeta', 'Tarjeta de Crédito/Débito')], max_length=20, verbose_name='Método de Pago')),
+                ('fecha_pago', models.DateTimeField(auto_now_add=True, verbose_name='Fecha de Transacción')),
+                ('notas', models.TextField(blank=True, null=True, verbose_name='Notas (Nro Operación/Detalles)')),
+                ('pedido', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='pago', to='core.pedido', verbose_name='Pedido')),
+            ],
+            options={
+                'verbose_name': 'Pago de Pedido',
+                'verbose_name_plural': 'Pagos de Pedidos',
+            },
+        ),
+        migrations.CreateModel(
+            name='ItemPedido',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cantidad', models.PositiveIntegerField(verbose_name='Cantidad')),
+                ('precio_unitario', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Precio Unitario (S/)')),
+                ('producto', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='items_pedido', to='core.producto', verbose_name='Producto')),
+                ('pedido', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='core.pedido', verbose_name='Pedido')),
+            ],
+            options={
+                'verbose_name': 'Producto del Pedido',
+                'verbose_name_plural': 'Productos del Pedido',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(fields=['estado', 'reservado_hasta'], name='pedido_estado_reserva_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(fields=['cliente', '-creado'], name='pedido_cliente_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 6.0.2 on 2026-10-18 03:40
+
+import apps.core.almacenamiento
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_pedidos_tienda'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='documento',
+            name='archivo',
+            field=models.FileField(storage=apps.core.almacenamiento.almacen_documentos, upload_to='historias_clinicas/', verbose_name='Archivo (Radiografía o PDF)'),
+        ),
+        migrations.CreateModel(
+            name='ArchivoDeduplicado',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=255, unique=True, verbose_name='Archivo')),
+                ('tamano', models.BigIntegerField(verbose_name='Tamaño (bytes)')),
+                ('referencias', models.PositiveIntegerField(default=0, verbose_name='Documentos que lo usan')),
+                ('creado', models.DateTimeField(auto_now_add=True, verbose_name='Primera subida')),
+                ('usado', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Última subida')),
+            ],
+            options={
+                'verbose_name': 'Archivo Clínico Deduplicado',
+                'verbose_name_plural': 'Archivos Clínicos Deduplicados',
+                'indexes': [models.Index(fields=['referencias', 'usado'], name='archivo_huerfano_idx')],
+            },
+        ),
+    ]
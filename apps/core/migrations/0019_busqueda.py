@@ -0,0 +1,28 @@
+# Generated by Django 6.0.2 on 2026-10-18 04:15
+
+from django.db import migrations
+
+
+def crear_indice(apps, schema_editor):
+    """ Tablas de búsqueda (FTS5 en SQLite, tsvector + GIN en PostgreSQL) llenas con lo que ya existe """
+    from apps.core import busqueda
+
+    busqueda.crear_tablas(schema_editor.connection)
+    busqueda.reconstruir(apps.get_model('auth', 'User'), apps.get_model('core', 'Receta'), schema_editor.connection.alias)
+
+
+def borrar_indice(apps, schema_editor):
+    from apps.core import busqueda
+
+    busqueda.eliminar_tablas(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_archivos_deduplicados'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indice, borrar_indice),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 6.0.2 on 2026-10-18 05:10
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_busqueda'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='cita',
+            name='cita_fecha_hora_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='pago',
+            name='pago_fecha_idx',
+        ),
+        migrations.AddIndex(
+            model_name='cita',
+            index=models.Index(fields=['fecha', 'hora', 'id'], name='cita_fecha_hora_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pago',
+            index=models.Index(fields=['fecha_pago', 'id'], name='pago_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='receta',
+            index=models.Index(fields=['fecha_emision', 'id'], name='receta_fecha_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 6.0.2 on 2026-10-18 06:20
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def descartar_consultas_pickle(apps, schema_editor):
+    """ Las exportaciones en cola guardaban la consulta con pickle: no se pueden rehacer """
+    Exportacion = apps.get_model('core', 'Exportacion')
+    Exportacion.objects.using(schema_editor.connection.alias).filter(estado__in=['pendiente', 'procesando']).update(
+        estado='fallida',
+        error="Solicitada antes de cambiar el formato de las exportaciones: vuelva a exportar desde Citas.",
+        terminado=timezone.now(),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_paginacion_keyset'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportacion',
+            name='criterio',
+            field=models.JSONField(default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='exportacion',
+            name='intentos',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='Intentos'),
+        ),
+        migrations.AddField(
+            model_name='exportacion',
+            name='latido',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Último latido'),
+        ),
+        migrations.RunPython(descartar_consultas_pickle, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='exportacion',
+            name='consulta',
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 6.0.2 on 2026-10-18 06:40
+
+from django.db import migrations, models
+
+
+def calcular_turno(apps, schema_editor):
+    """ Rellena `turno` (inicio del turno de la cita) y comprueba que no haya dos citas activas en uno """
+    from apps.core.agenda import ESTADOS_LIBERADOS, inicio_turno
+
+    Cita = apps.get_model('core', 'Cita')
+    db = schema_editor.connection.alias
+    lote, activas, choques = [], {}, []
+    for cita in Cita.objects.using(db).only('id', 'fecha', 'hora', 'estado').order_by('id').iterator(chunk_size=2000):
+        cita.turno = inicio_turno(cita.fecha, cita.hora)
+        lote.append(cita)
+        if cita.estado not in ESTADOS_LIBERADOS:
+            clave = (cita.fecha, cita.turno)
+            if clave in activas:
+                choques.append(f"#{activas[clave]} y #{cita.id} ({cita.fecha} {cita.turno})")
+            activas[clave] = cita.id
+        if len(lote) >= 2000:
+            Cita.objects.using(db).bulk_update(lote, ['turno'])
+            lote = []
+    Cita.objects.using(db).bulk_update(lote, ['turno'])
+    if choques:
+        raise RuntimeError(
+            "Hay citas activas que comparten turno; reprograme o cancele una de cada par antes de migrar: "
+            + ", ".join(choques)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_exportacion_criterio'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cita',
+            name='turno',
+            field=models.TimeField(blank=True, editable=False, null=True, verbose_name='Turno'),
+        ),
+        migrations.RunPython(calcular_turno, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='cita',
+            name='turno',
+            field=models.TimeField(blank=True, editable=False, verbose_name='Turno'),
+        ),
+        migrations.RemoveConstraint(
+            model_name='cita',
+            name='cita_turno_unico_activo',
+        ),
+        migrations.AddConstraint(
+            model_name='cita',
+            constraint=models.UniqueConstraint(condition=models.Q(('estado', 'cancelada'), _negated=True), fields=('fecha', 'turno'), name='cita_turno_unico_activo', violation_error_message='Ya existe una cita programada en ese turno.'),
+        ),
+    ]
@@ -1,6 +1,14 @@
-from django.db import models
+from django.db import models, transaction
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.files.storage import FileSystemStorage
 from django.core.exceptions import ValidationError
+from django.utils import timezone
+from datetime import datetime, timedelta
+import os
+
+from . import agenda
+from .almacenamiento import almacen_documentos
 
 # ---------------------------------------------------------
 # 1. MODELO SERVICIO
@@ -22,6 +30,64 @@ class Servicio(models.Model):
 # ---------------------------------------------------------
 # 2. MODELO CITA
 # ---------------------------------------------------------
+def calcular_inicio(fecha, hora):
+    return timezone.make_aware(datetime.combine(fecha, hora))
+
+
+# Campos que se derivan de fecha + hora (ver Cita.completar_derivados)
+CAMPOS_DERIVADOS = ['inicio', 'turno']
+
+
+class CitaQuerySet(models.QuerySet):
+    """
+    Consultas por rango sobre `inicio` (un solo recorrido del índice).
+
+    `inicio` y `turno` se calculan en save(); bulk_create, bulk_update y
+    update() no pasan por save, así que aquí también los completan cuando
+    cambian fecha u hora.
+    """
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for cita in objs:
+            cita.completar_derivados()
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        if {'fecha', 'hora'} & set(fields):
+            objs = list(objs)
+            for cita in objs:
+                cita.completar_derivados()
+            fields = [*fields, *(campo for campo in CAMPOS_DERIVADOS if campo not in fields)]
+        return super().bulk_update(objs, fields, *args, **kwargs)
+
+    def update(self, **kwargs):
+        if not {'fecha', 'hora'} & kwargs.keys():
+            return super().update(**kwargs)
+        # fecha/hora pueden venir como expresiones: se releen ya actualizadas
+        with transaction.atomic(using=self.db):
+            ids = list(self.values_list('pk', flat=True))
+            actualizadas = super().update(**kwargs)
+            citas = list(self.model._base_manager.using(self.db).filter(pk__in=ids).only('fecha', 'hora'))
+            for cita in citas:
+                cita.completar_derivados()
+            self.model._base_manager.using(self.db).bulk_update(citas, CAMPOS_DERIVADOS)
+        return actualizadas
+
+    def entre(self, desde, hasta):
+        return self.filter(inicio__gte=desde, inicio__lt=hasta)
+
+    def proximos_dias(self, dias=7):
+        ahora = timezone.now()
+        return self.entre(ahora, ahora + timedelta(days=dias))
+
+    def del_mes(self, anio=None, mes=None):
+        hoy = timezone.localdate()
+        anio, mes = anio or hoy.year, mes or hoy.month
+        desde = timezone.make_aware(datetime(anio, mes, 1))
+        hasta = timezone.make_aware(datetime(anio + mes // 12, mes % 12 + 1, 1))
+        return self.entre(desde, hasta)
+
 class Cita(models.Model):
     ESTADOS = [
         ('pendiente', 'Pendiente'),
@@ -35,28 +101,96 @@ class Cita(models.Model):
     fecha = models.DateField(verbose_name="Fecha de Cita")
     hora = models.TimeField(verbose_name="Hora de Cita")
     estado = models.CharField(max_length=20, choices=ESTADOS, default='pendiente', verbose_name="Estado")
+    # fecha + hora en un solo valor (se calcula en save) para consultas por rango
+    inicio = models.DateTimeField(null=True, blank=True, editable=False, verbose_name="Inicio")
+    # Inicio del turno que ocupa la cita (09:15 -> 09:00 con turnos de 30 min; fuera
+    # de horario, la propia hora). Sobre él va la restricción única: un turno, una cita
+    turno = models.TimeField(blank=True, editable=False, verbose_name="Turno")
+    # Ya se descontaron del stock los materiales del servicio (inventario.descontar_materiales)
+    materiales_descontados = models.BooleanField(default=False, editable=False, verbose_name="Materiales Descontados")
+
+    objects = CitaQuerySet.as_manager()
 
     def __str__(self):
         return f"{self.paciente.first_name} - {self.fecha} ({self.hora})"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        # Guardamos la fecha y el paciente cargados para poder liberar el turno
+        # anterior e invalidar el portal correcto si la cita se reprograma
+        instancia._fecha_original = instancia.__dict__.get('fecha')
+        instancia._paciente_original = instancia.__dict__.get('paciente_id')
+        # Clave del resumen diario en la que estaba contada (ver resumenes.py)
+        instancia._resumen_original = instancia.clave_resumen()
+        return instancia
+
+    def clave_resumen(self):
+        valores = self.__dict__
+        if any(c not in valores for c in ('fecha', 'servicio_id', 'estado')):
+            return None  # cargada con only()/defer(): no la contamos
+        return (valores['fecha'], valores['servicio_id'], valores['estado'])
+
     def clean(self):
-        existe_cita = Cita.objects.filter(
-            fecha=self.fecha, 
-            hora=self.hora
-        ).exclude(pk=self.pk).exists()
+        # 0. Turno ya tomado atómicamente por agenda.reservar_cita
+        if getattr(self, '_turno_reservado', False):
+            return
+
+        # 1. Consultamos el índice de disponibilidad (una fila por día)
+        ocupado = agenda.turno_ocupado(self.fecha, self.hora)
+        if ocupado is False or self.estado in agenda.ESTADOS_LIBERADOS:
+            return
+
+        if ocupado and self.pk is None:
+            existe_cita = True
+        else:
+            # 2. Edición de una cita (o fuera de horario): confirmamos contra la
+            #    tabla, excluyendo la propia cita
+            filtro_hora = {'hora': self.hora}
+            if ocupado:
+                inicio, fin = agenda.rango_turno(self.fecha, self.hora)
+                filtro_hora = {'hora__gte': inicio, 'hora__lt': fin}
+            existe_cita = Cita.objects.filter(
+                fecha=self.fecha, 
+                **filtro_hora
+            ).exclude(pk=self.pk).exclude(estado__in=agenda.ESTADOS_LIBERADOS).exists()
 
         if existe_cita:
             raise ValidationError({
                 'hora': f'Lo sentimos, ya existe una cita programada para el {self.fecha} a las {self.hora}.'
             })
 
+    def completar_derivados(self):
+        self.inicio = calcular_inicio(self.fecha, self.hora)
+        self.turno = agenda.inicio_turno(self.fecha, self.hora)
+
     def save(self, *args, **kwargs):
-        self.full_clean()
+        # La restricción única la valida clean() con el índice y la hace
+        # cumplir la base de datos; evitamos la consulta extra de validate_constraints
+        self.full_clean(validate_constraints=False)
+        self.completar_derivados()
         super(Cita, self).save(*args, **kwargs)
 
     class Meta:
         verbose_name = "Cita"
         verbose_name_plural = "Citas"
+        constraints = [
+            # Garantía a nivel de base de datos: una sola cita activa por turno
+            # (no solo por hora exacta: 09:00 y 09:15 comparten el turno de las 09:00)
+            models.UniqueConstraint(
+                fields=['fecha', 'turno'],
+                condition=~models.Q(estado='cancelada'),
+                name='cita_turno_unico_activo',
+                violation_error_message='Ya existe una cita programada en ese turno.',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['paciente', 'fecha', 'hora'], name='cita_paciente_fecha_idx'), # portal del paciente
+            models.Index(fields=['fecha', 'hora', 'id'], name='cita_fecha_hora_idx'),        # Cita.clean / agenda / admin (cursor)
+            models.Index(fields=['estado', 'fecha'], name='cita_estado_fecha_idx'),          # admin: list_filter + date_hierarchy
+            models.Index(fields=['servicio', 'fecha'], name='cita_servicio_fecha_idx'),      # admin: filtro por servicio
+            models.Index(fields=['inicio'], name='cita_inicio_idx'),                         # rangos ("próximos 7 días", "este mes")
+        ]
 
 # ---------------------------------------------------------
 # 3. MODELO PAGO
@@ -82,16 +216,38 @@ class Pago(models.Model):
 
     @property
     def estado_pago(self):
-        if self.saldo_pendiente <= 0: return "COMPLETO"
-        elif self.monto_pagado > 0: return "PARCIAL"
+        return self.calcular_estado(self.monto_total, self.monto_pagado)
+
+    @staticmethod
+    def calcular_estado(monto_total, monto_pagado):
+        """ Mismo criterio que estado_pago, a partir de los montos (para exportaciones y reportes) """
+        if monto_total - monto_pagado <= 0: return "COMPLETO"
+        elif monto_pagado > 0: return "PARCIAL"
         return "PENDIENTE"
 
     def __str__(self):
         return f"Pago de {self.cita.paciente.first_name} - S/ {self.monto_pagado}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        instancia._resumen_original = instancia.clave_resumen()
+        return instancia
+
+    def clave_resumen(self):
+        """ (día local, método, monto) con que el pago cuenta en el resumen diario """
+        valores = self.__dict__
+        if valores.get('fecha_pago') is None or any(c not in valores for c in ('metodo', 'monto_pagado')):
+            return None
+        return (timezone.localdate(valores['fecha_pago']), valores['metodo'], valores['monto_pagado'])
+
     class Meta:
         verbose_name = "Pago / Ingreso"
         verbose_name_plural = "Control de Caja (Pagos)"
+        indexes = [
+            models.Index(fields=['fecha_pago', 'id'], name='pago_fecha_idx'),  # admin: paginación por cursor
+            models.Index(fields=['metodo', 'fecha_pago'], name='pago_metodo_fecha_idx'),
+        ]
 
 # ---------------------------------------------------------
 # 4. MODELO DOCUMENTO
@@ -99,13 +255,21 @@ class Pago(models.Model):
 class Documento(models.Model):
     paciente = models.ForeignKey(User, on_delete=models.CASCADE, related_name='documentos', verbose_name="Paciente")
     titulo = models.CharField(max_length=100, verbose_name="Título del documento/estudio")
-    archivo = models.FileField(upload_to='historias_clinicas/', verbose_name="Archivo (Radiografía o PDF)")
+    # Almacén deduplicado: cada contenido se guarda una vez, bajo su SHA-256 (almacenamiento.py)
+    archivo = models.FileField(storage=almacen_documentos, upload_to='historias_clinicas/', verbose_name="Archivo (Radiografía o PDF)")
     notas = models.TextField(blank=True, verbose_name="Notas u Observaciones")
     fecha_subida = models.DateTimeField(auto_now_add=True, verbose_name="Fecha de Registro")
 
     def __str__(self):
         return f"{self.titulo} - {self.paciente.first_name}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        # Archivo cargado: si se reemplaza, el anterior pierde una referencia
+        instancia._archivo_original = str(instancia.__dict__.get('archivo') or '')
+        return instancia
+
     class Meta:
         verbose_name = "Documento/Radiografía"
         verbose_name_plural = "Historial Clínico (Documentos)"
@@ -136,12 +300,25 @@ class Insumo(models.Model):
     stock_minimo = models.PositiveIntegerField(default=5, verbose_name="Alerta de Stock Mínimo")
     unidad = models.CharField(max_length=20, choices=UNIDADES, default='unidad')
     fecha_vencimiento = models.DateField(null=True, blank=True, verbose_name="Caducidad")
-    
-    @property
-    def estado_stock(self):
-        if self.cantidad == 0: return "AGOTADO"
-        elif self.cantidad <= self.stock_minimo: return "BAJO"
-        return "OK"
+
+    # La calcula la base de datos en cada escritura (también en los UPDATE con F()
+    # de inventario.py) y está indexada: las alertas no evalúan insumo por insumo
+    estado_stock = models.GeneratedField(
+        expression=models.Case(
+            models.When(cantidad=0, then=models.Value('AGOTADO')),
+            models.When(cantidad__lte=models.F('stock_minimo'), then=models.Value('BAJO')),
+            default=models.Value('OK'),
+        ),
+        output_field=models.CharField(max_length=10),
+        db_persist=True,
+        verbose_name="Estado del Stock",
+    )
+
+    # Pronóstico con la agenda futura (inventario.actualizar_pronostico, lo corre
+    # `manage.py pronosticar_insumos`): cuándo no alcanzará para las citas programadas
+    agotamiento_estimado = models.DateField(null=True, blank=True, editable=False, verbose_name="Se Agota el")
+    reposicion_estimada = models.DateField(null=True, blank=True, editable=False, verbose_name="Reponer Antes del")
+    demanda_programada = models.PositiveIntegerField(default=0, editable=False, verbose_name="Demanda Programada")
 
     def __str__(self):
         return f"{self.nombre} ({self.cantidad} {self.unidad})"
@@ -149,6 +326,11 @@ class Insumo(models.Model):
     class Meta:
         verbose_name = "Insumo / Material"
         verbose_name_plural = "Inventario (Almacén)"
+        indexes = [
+            models.Index(fields=['estado_stock', 'nombre'], name='insumo_estado_idx'),
+            models.Index(fields=['fecha_vencimiento'], name='insumo_vencimiento_idx'),
+            models.Index(fields=['agotamiento_estimado'], name='insumo_agotamiento_idx'),
+        ]
 
 # ---------------------------------------------------------
 # 7. MODELO RECETA MÉDICA 💊
@@ -168,6 +350,10 @@ class Receta(models.Model):
     class Meta:
         verbose_name = "Receta Médica"
         verbose_name_plural = "Gestión de Recetas"
+        indexes = [
+            models.Index(fields=['paciente', '-fecha_emision'], name='receta_paciente_fecha_idx'),
+            models.Index(fields=['fecha_emision', 'id'], name='receta_fecha_idx'),  # admin: paginación por cursor
+        ]
 
 # ---------------------------------------------------------
 # 8. MODELO FICHA MÉDICA (ANAMNESIS) 🩺 (NUEVO)
@@ -210,4 +396,348 @@ class Producto(models.Model):
 
     class Meta:
         verbose_name = "Producto en Venta"
-        verbose_name_plural = "Tienda (Productos)"
\ No newline at end of file
+        verbose_name_plural = "Tienda (Productos)"
+
+# ---------------------------------------------------------
+# 10. ÍNDICE DE DISPONIBILIDAD (AGENDA) 📅
+# ---------------------------------------------------------
+class Disponibilidad(models.Model):
+    fecha = models.DateField(unique=True, verbose_name="Fecha")
+    ocupados = models.BigIntegerField(default=0, verbose_name="Mapa de turnos ocupados")
+
+    def __str__(self):
+        return f"Agenda {self.fecha}"
+
+    class Meta:
+        verbose_name = "Disponibilidad"
+        verbose_name_plural = "Disponibilidad (Agenda)"
+
+# ---------------------------------------------------------
+# 11. BANDEJA DE SALIDA DE CORREOS ✉️
+# ---------------------------------------------------------
+class CorreoPendiente(models.Model):
+    PENDIENTE = 'pendiente'
+    ENVIADO = 'enviado'
+    FALLIDO = 'fallido'
+    ESTADOS = [
+        (PENDIENTE, 'Pendiente'),
+        (ENVIADO, 'Enviado'),
+        (FALLIDO, 'Fallido'),
+    ]
+
+    asunto = models.CharField(max_length=200, verbose_name="Asunto")
+    remitente = models.CharField(max_length=200, verbose_name="Remitente")
+    destinatarios = models.TextField(verbose_name="Destinatarios", help_text="Separados por coma")
+    cuerpo_texto = models.TextField(verbose_name="Texto plano")
+    cuerpo_html = models.TextField(blank=True, verbose_name="HTML")
+
+    estado = models.CharField(max_length=20, choices=ESTADOS, default=PENDIENTE, verbose_name="Estado")
+    intentos = models.PositiveIntegerField(default=0, verbose_name="Intentos")
+    proximo_intento = models.DateTimeField(default=timezone.now, verbose_name="Próximo intento")
+    lote_envio = models.CharField(max_length=32, blank=True, editable=False, verbose_name="Lote de envío")
+    ultimo_error = models.TextField(blank=True, verbose_name="Último error")
+    creado = models.DateTimeField(auto_now_add=True, verbose_name="Creado")
+    enviado_en = models.DateTimeField(null=True, blank=True, verbose_name="Enviado")
+
+    def lista_destinatarios(self):
+        return [d.strip() for d in self.destinatarios.split(',') if d.strip()]
+
+    def __str__(self):
+        return f"{self.asunto} -> {self.destinatarios} ({self.estado})"
+
+    class Meta:
+        verbose_name = "Correo en Cola"
+        verbose_name_plural = "Bandeja de Salida (Correos)"
+        indexes = [
+            models.Index(fields=['estado', 'proximo_intento'], name='correo_pendiente_idx'),
+            models.Index(fields=['lote_envio'], name='correo_lote_idx'),
+        ]
+
+# ---------------------------------------------------------
+# 12. RECORDATORIOS DE CITAS ⏰
+# ---------------------------------------------------------
+class Recordatorio(models.Model):
+    DIA_ANTERIOR = 'dia_anterior'
+    PROXIMAS_HORAS = 'proximas_horas'
+    TIPOS = [
+        (DIA_ANTERIOR, 'Un día antes'),
+        (PROXIMAS_HORAS, 'Dos horas antes'),
+    ]
+
+    cita = models.ForeignKey(Cita, on_delete=models.CASCADE, related_name='recordatorios', verbose_name="Cita")
+    tipo = models.CharField(max_length=20, choices=TIPOS, verbose_name="Tipo")
+    enviado_en = models.DateTimeField(auto_now_add=True, verbose_name="Enviado")
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} - cita {self.cita_id}"
+
+    class Meta:
+        verbose_name = "Recordatorio"
+        verbose_name_plural = "Recordatorios Enviados"
+        constraints = [
+            models.UniqueConstraint(fields=['cita', 'tipo'], name='recordatorio_unico_por_tipo'),
+        ]
+
+# ---------------------------------------------------------
+# 13. EXPORTACIONES EN SEGUNDO PLANO 📤
+# ---------------------------------------------------------
+class AlmacenExportaciones(FileSystemStorage):
+    """ Carpeta privada (fuera de MEDIA): solo se descarga desde el admin """
+
+    @property
+    def base_location(self):
+        return getattr(settings, 'EXPORTACIONES_DIR', settings.BASE_DIR / 'exportaciones')
+
+    @property
+    def location(self):
+        return os.path.abspath(self.base_location)
+
+
+def almacen_exportaciones():
+    return AlmacenExportaciones()
+
+
+class Exportacion(models.Model):
+    PENDIENTE = 'pendiente'
+    PROCESANDO = 'procesando'
+    LISTA = 'lista'
+    FALLIDA = 'fallida'
+    ESTADOS = [
+        (PENDIENTE, 'Pendiente'),
+        (PROCESANDO, 'Procesando'),
+        (LISTA, 'Lista para descargar'),
+        (FALLIDA, 'Fallida'),
+    ]
+    FORMATOS = [
+        ('xlsx', 'Excel (XLSX)'),
+        ('csv', 'CSV'),
+    ]
+
+    formato = models.CharField(max_length=10, choices=FORMATOS, default='xlsx', verbose_name="Formato")
+    # Qué exportar, en datos simples: {'filtros': parámetros GET del listado de Citas,
+    # 'seleccion': pks marcados o None si se eligió todo el listado} (ver exportacion.py)
+    criterio = models.JSONField(default=dict, editable=False)
+    solicitado_por = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Solicitado por")
+    estado = models.CharField(max_length=20, choices=ESTADOS, default=PENDIENTE, verbose_name="Estado")
+    filas = models.PositiveIntegerField(default=0, verbose_name="Filas")
+    archivo = models.FileField(storage=almacen_exportaciones, upload_to='citas/', blank=True, verbose_name="Archivo")
+    error = models.TextField(blank=True, verbose_name="Error")
+    creado = models.DateTimeField(auto_now_add=True, verbose_name="Solicitado")
+    terminado = models.DateTimeField(null=True, blank=True, verbose_name="Terminado")
+    # El worker lo renueva mientras genera: si deja de latir, otro worker la retoma
+    latido = models.DateTimeField(null=True, blank=True, editable=False, verbose_name="Último latido")
+    intentos = models.PositiveSmallIntegerField(default=0, verbose_name="Intentos")
+
+    def __str__(self):
+        return f"Exportación {self.id} ({self.get_formato_display()}) - {self.get_estado_display()}"
+
+    class Meta:
+        verbose_name = "Exportación"
+        verbose_name_plural = "Exportaciones de Citas"
+        ordering = ['-creado']
+        indexes = [
+            models.Index(fields=['estado', 'creado'], name='exportacion_estado_idx'),
+        ]
+
+# ---------------------------------------------------------
+# 14. RESÚMENES DIARIOS (TABLERO DEL ADMIN) 📈
+# ---------------------------------------------------------
+class ResumenCitasDia(models.Model):
+    """ Cantidad de citas por día, servicio y estado (lo mantiene resumenes.py) """
+    fecha = models.DateField(verbose_name="Fecha")
+    servicio = models.ForeignKey(Servicio, on_delete=models.CASCADE, verbose_name="Servicio")
+    estado = models.CharField(max_length=20, choices=Cita.ESTADOS, verbose_name="Estado")
+    cantidad = models.IntegerField(default=0, verbose_name="Citas")
+
+    def __str__(self):
+        return f"{self.fecha} - {self.servicio_id} - {self.estado}: {self.cantidad}"
+
+    class Meta:
+        verbose_name = "Resumen diario de citas"
+        verbose_name_plural = "Resúmenes diarios de citas"
+        constraints = [
+            models.UniqueConstraint(fields=['fecha', 'servicio', 'estado'], name='resumen_cita_unico'),
+        ]
+
+
+class ResumenPagosDia(models.Model):
+    """ Cantidad y monto cobrado por día (hora local) y método de pago """
+    fecha = models.DateField(verbose_name="Fecha")
+    metodo = models.CharField(max_length=20, choices=Pago.METODOS, verbose_name="Método de Pago")
+    cantidad = models.IntegerField(default=0, verbose_name="Pagos")
+    monto = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Monto (S/)")
+
+    def __str__(self):
+        return f"{self.fecha} - {self.metodo}: S/ {self.monto}"
+
+    class Meta:
+        verbose_name = "Resumen diario de pagos"
+        verbose_name_plural = "Resúmenes diarios de pagos"
+        constraints = [
+            models.UniqueConstraint(fields=['fecha', 'metodo'], name='resumen_pago_unico'),
+        ]
+
+
+# ---------------------------------------------------------
+# 15. MOVIMIENTOS DE INVENTARIO (KARDEX) 📋
+# ---------------------------------------------------------
+class MovimientoStock(models.Model):
+    """ Cada cambio del stock de un insumo (lo registra inventario.py, no se edita) """
+    ENTRADA, CONSUMO, AJUSTE = 'entrada', 'consumo', 'ajuste'
+    TIPOS = [
+        (ENTRADA, 'Entrada (compra / reposición)'),
+        (CONSUMO, 'Consumo'),
+        (AJUSTE, 'Ajuste de inventario'),
+    ]
+
+    insumo = models.ForeignKey(Insumo, on_delete=models.CASCADE, related_name='movimientos', verbose_name="Insumo")
+    tipo = models.CharField(max_length=20, choices=TIPOS, verbose_name="Tipo")
+    cantidad = models.IntegerField(verbose_name="Cantidad", help_text="Positiva si entra, negativa si sale")
+    stock_resultante = models.PositiveIntegerField(verbose_name="Stock Después")
+    motivo = models.CharField(max_length=200, blank=True, verbose_name="Motivo / Detalle")
+    usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Registrado por")
+    creado = models.DateTimeField(auto_now_add=True, verbose_name="Fecha")
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} {self.cantidad:+d} {self.insumo.nombre}"
+
+    class Meta:
+        verbose_name = "Movimiento de Stock"
+        verbose_name_plural = "Kardex (Movimientos de Stock)"
+        ordering = ['-creado', '-id']
+        indexes = [
+            models.Index(fields=['insumo', '-creado'], name='movimiento_insumo_idx'),
+        ]
+
+
+# ---------------------------------------------------------
+# 16. MATERIALES POR SERVICIO (CONSUMO POR TRATAMIENTO) 🧪
+# ---------------------------------------------------------
+class MaterialServicio(models.Model):
+    """ Lo que gasta UNA cita del servicio; se descuenta al finalizarla """
+    servicio = models.ForeignKey(Servicio, on_delete=models.CASCADE, related_name='materiales', verbose_name="Servicio")
+    insumo = models.ForeignKey(Insumo, on_delete=models.CASCADE, related_name='usos', verbose_name="Insumo")
+    cantidad = models.PositiveIntegerField(default=1, verbose_name="Cantidad por Cita")
+
+    def __str__(self):
+        return f"{self.servicio.titulo}: {self.cantidad} {self.insumo.nombre}"
+
+    class Meta:
+        verbose_name = "Material por Servicio"
+        verbose_name_plural = "Materiales por Servicio"
+        constraints = [
+            models.UniqueConstraint(fields=['servicio', 'insumo'], name='material_servicio_unico'),
+        ]
+
+
+# ---------------------------------------------------------
+# 17. TIENDA: PEDIDOS, RESERVAS DE STOCK Y PAGOS 🧾
+# ---------------------------------------------------------
+class Pedido(models.Model):
+    """
+    Compra de la tienda. Al confirmarla se descuenta el stock de los productos
+    (pedidos.reservar_pedido); si no se paga antes de `reservado_hasta` el
+    barrido (manage.py liberar_reservas) devuelve el stock.
+    """
+    RESERVADO, PAGADO, VENCIDO, CANCELADO = 'reservado', 'pagado', 'vencido', 'cancelado'
+    ESTADOS = [
+        (RESERVADO, 'Reservado (esperando pago)'),
+        (PAGADO, 'Pagado'),
+        (VENCIDO, 'Vencido (stock liberado)'),
+        (CANCELADO, 'Cancelado'),
+    ]
+
+    cliente = models.ForeignKey(User, on_delete=models.CASCADE, related_name='pedidos', verbose_name="Cliente")
+    estado = models.CharField(max_length=20, choices=ESTADOS, default=RESERVADO, verbose_name="Estado")
+    total = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Total (S/)")
+    creado = models.DateTimeField(auto_now_add=True, verbose_name="Fecha del Pedido")
+    reservado_hasta = models.DateTimeField(verbose_name="Reserva Válida Hasta")
+    pagado_en = models.DateTimeField(null=True, blank=True, verbose_name="Pagado el")
+
+    def __str__(self):
+        return f"Pedido #{self.pk} - {self.cliente.first_name or self.cliente.username}"
+
+    class Meta:
+        verbose_name = "Pedido de la Tienda"
+        verbose_name_plural = "Pedidos de la Tienda"
+        ordering = ['-creado']
+        indexes = [
+            models.Index(fields=['estado', 'reservado_hasta'], name='pedido_estado_reserva_idx'), # barrido de reservas
+            models.Index(fields=['cliente', '-creado'], name='pedido_cliente_idx'),
+        ]
+
+
+class ItemPedido(models.Model):
+    pedido = models.ForeignKey(Pedido, on_delete=models.CASCADE, related_name='items', verbose_name="Pedido")
+    producto = models.ForeignKey(Producto, on_delete=models.PROTECT, related_name='items_pedido', verbose_name="Producto")
+    cantidad = models.PositiveIntegerField(verbose_name="Cantidad")
+    precio_unitario = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Precio Unitario (S/)")
+
+    @property
+    def subtotal(self):
+        return self.cantidad * self.precio_unitario
+
+    def __str__(self):
+        return f"{self.cantidad} x {self.producto.nombre}"
+
+    class Meta:
+        verbose_name = "Producto del Pedido"
+        verbose_name_plural = "Productos del Pedido"
+
+
+class PagoPedido(models.Model):
+    """ Pago de un pedido de la tienda (mismos campos que Pago, el de las citas) """
+    pedido = models.OneToOneField(Pedido, on_delete=models.CASCADE, related_name='pago', verbose_name="Pedido")
+    monto_total = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Costo Total (S/)")
+    monto_pagado = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Monto Abonado (S/)")
+    metodo = models.CharField(max_length=20, choices=Pago.METODOS, verbose_name="Método de Pago")
+    fecha_pago = models.DateTimeField(auto_now_add=True, verbose_name="Fecha de Transacción")
+    notas = models.TextField(blank=True, null=True, verbose_name="Notas (Nro Operación/Detalles)")
+
+    @property
+    def saldo_pendiente(self):
+        return self.monto_total - self.monto_pagado
+
+    @property
+    def estado_pago(self):
+        return Pago.calcular_estado(self.monto_total, self.monto_pagado)
+
+    def clean(self):
+        # Un pedido vencido o cancelado ya devolvió su stock: no se le puede cobrar
+        # (se lee de la base: el barrido pudo vencerlo mientras se llenaba el formulario)
+        estado = Pedido.objects.filter(pk=self.pedido_id).values_list('estado', flat=True).first()
+        if estado in (Pedido.VENCIDO, Pedido.CANCELADO):
+            raise ValidationError(f"El pedido #{self.pedido_id} está {dict(Pedido.ESTADOS)[estado].lower()}: no se le puede registrar un pago.")
+
+    def __str__(self):
+        return f"Pago del pedido #{self.pedido_id} - S/ {self.monto_pagado}"
+
+    class Meta:
+        verbose_name = "Pago de Pedido"
+        verbose_name_plural = "Pagos de Pedidos"
+
+# ---------------------------------------------------------
+# 18. ARCHIVOS CLÍNICOS DEDUPLICADOS 🗄️
+# ---------------------------------------------------------
+class ArchivoDeduplicado(models.Model):
+    """
+    Contenido único del almacén de documentos (almacenamiento.py). `referencias`
+    cuenta los Documento que lo usan; sin referencias lo borra
+    `manage.py limpiar_archivos`.
+    """
+    nombre = models.CharField(max_length=255, unique=True, verbose_name="Archivo")
+    tamano = models.BigIntegerField(verbose_name="Tamaño (bytes)")
+    referencias = models.PositiveIntegerField(default=0, verbose_name="Documentos que lo usan")
+    creado = models.DateTimeField(auto_now_add=True, verbose_name="Primera subida")
+    usado = models.DateTimeField(default=timezone.now, verbose_name="Última subida")
+
+    def __str__(self):
+        return self.nombre
+
+    class Meta:
+        verbose_name = "Archivo Clínico Deduplicado"
+        verbose_name_plural = "Archivos Clínicos Deduplicados"
+        indexes = [
+            # Candidatos de la recolección: referencias = 0 y subidos hace más de la gracia
+            models.Index(fields=['referencias', 'usado'], name='archivo_huerfano_idx'),
+        ]
@@ -0,0 +1,229 @@
+"""
+Paginación de los listados grandes del admin (Citas, Pagos, Recetas).
+
+El ChangeList de Django hace un COUNT(*) de todo el listado en cada página y
+pide la página N con LIMIT/OFFSET: la base de datos recorre y descarta las
+N x 100 filas anteriores, así que cada página es más lenta que la anterior y
+el conteo crece con la tabla. Aquí:
+
+  * Paginación por cursor (keyset): con el orden por defecto del listado
+    (p. ej. -fecha, -hora, -id, cubierto por un índice) la página siguiente
+    es "las 100 filas que van después de la última que se vio":
+    WHERE (fecha, hora, id) < (...) ORDER BY ... LIMIT 101. La página 1 y la
+    1000 cuestan lo mismo: una búsqueda en el índice y 101 filas. Los enlaces
+    son Primera / Anterior / Siguiente / Última en vez de números de página.
+  * Conteo acotado: se cuentan como mucho LISTADOS_CONTEO_EXACTO_MAX filas;
+    si hay más, el total sale de las estadísticas del motor (EXPLAIN en
+    PostgreSQL, sqlite_stat1 de ANALYZE en SQLite) y se muestra como "≈ N".
+
+Si el usuario ordena por una columna (?o=...) el listado vuelve a la
+paginación numerada de siempre, pero con el mismo conteo acotado.
+"""
+import json
+
+from django.conf import settings
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ORDER_VAR, ChangeList
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.db import DatabaseError, connections
+from django.db.models import Max, Q
+from django.utils import formats
+from django.utils.functional import cached_property
+
+# Parámetros de la URL con el cursor: la página va después / antes de esa fila
+DESPUES_VAR = '_despues'
+ANTES_VAR = '_antes'
+SEPARADOR = ','
+
+UMBRAL_CONTEO = 10000
+
+EXACTO, ESTIMADO, MINIMO = 'exacto', 'estimado', 'minimo'
+
+
+# ---------------------------------------------------------
+# CONTEO ACOTADO / ESTIMADO
+# ---------------------------------------------------------
+def estimar(queryset):
+    """ Filas aproximadas según las estadísticas del motor, sin recorrer la tabla. None si no se puede """
+    conexion = connections[queryset.db]
+    if conexion.vendor == 'postgresql':
+        sql, params = queryset.order_by().query.sql_with_params()
+        with conexion.cursor() as cursor:
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+    if conexion.vendor != 'sqlite' or queryset.query.where:
+        return None  # SQLite no estima filtros: solo la tabla completa
+
+    with conexion.cursor() as cursor:
+        try:
+            cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s", [queryset.model._meta.db_table])
+            filas = cursor.fetchall()
+        except DatabaseError:
+            filas = []  # sin ANALYZE la tabla sqlite_stat1 no existe
+    if filas:
+        # Una fila por índice; los parciales (WHERE ...) cuentan menos: vale el mayor
+        return max(int(stat.split()[0]) for stat, in filas)
+    # Sin estadísticas: los ids son autoincrementales y casi no se borran filas
+    return queryset.model._default_manager.using(queryset.db).aggregate(maximo=Max('pk'))['maximo']
+
+
+def contar(queryset, umbral):
+    """ (total, tipo): EXACTO hasta `umbral` filas; por encima ESTIMADO o, sin estadísticas, MINIMO (umbral + 1) """
+    total = queryset.order_by().values('pk')[:umbral + 1].count()
+    if total <= umbral:
+        return total, EXACTO
+    estimado = estimar(queryset)
+    if estimado is None:
+        return total, MINIMO
+    return max(estimado, total), ESTIMADO
+
+
+def etiqueta_conteo(total, tipo):
+    numero = formats.number_format(total, force_grouping=True)
+    if tipo == ESTIMADO:
+        return f"≈ {numero}"
+    if tipo == MINIMO:
+        return f"más de {formats.number_format(total - 1, force_grouping=True)}"
+    return numero
+
+
+class PaginadorEstimado(Paginator):
+    """ Paginator cuyo `count` no recorre la tabla entera (ver contar) """
+
+    @cached_property
+    def conteo(self):
+        return contar(self.object_list, getattr(settings, 'LISTADOS_CONTEO_EXACTO_MAX', UMBRAL_CONTEO))
+
+    @cached_property
+    def count(self):
+        return self.conteo[0]
+
+    def page(self, number):
+        if self.conteo[1] == EXACTO:
+            return super().page(number)
+        # Total aproximado: no se valida ni se recorta contra un "final" que puede no ser el real
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger(self.error_messages['invalid_page'])
+        if number < 1:
+            raise EmptyPage(self.error_messages['min_page'])
+        inicio = (number - 1) * self.per_page
+        return self._get_page(self.object_list[inicio:inicio + self.per_page], number, self)
+
+
+# ---------------------------------------------------------
+# CHANGELIST CON CURSOR
+# ---------------------------------------------------------
+class ChangeListKeyset(ChangeList):
+    """
+    ChangeList que pagina por cursor cuando el orden del listado son campos
+    simples no nulos que terminan en uno único (la pk). Los parámetros del
+    cursor no son filtros y se quitan de los demás enlaces del listado
+    (filtros, orden, fechas), que vuelven así a la primera página.
+    """
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        for var in (DESPUES_VAR, ANTES_VAR):
+            lookup_params.pop(var, None)
+        return lookup_params
+
+    def get_query_string(self, new_params=None, remove=None):
+        return super().get_query_string(new_params, [*(remove or []), DESPUES_VAR, ANTES_VAR])
+
+    def campos_keyset(self):
+        """ [(campo, descendente)] del orden del listado, o None si no admite cursor """
+        if ORDER_VAR in self.params or self.list_editable:
+            return None  # orden manual por columna, o formset que necesita un queryset
+        campos = []
+        for criterio in self.queryset.query.order_by:
+            if not isinstance(criterio, str):
+                return None
+            nombre = criterio.removeprefix('-')
+            try:
+                campo = self.lookup_opts.pk if nombre == 'pk' else self.lookup_opts.get_field(nombre)
+            except FieldDoesNotExist:
+                return None
+            if not campo.concrete or campo.is_relation or campo.null:
+                return None
+            campos.append((campo, criterio.startswith('-')))
+        if not campos or not (campos[-1][0].primary_key or campos[-1][0].unique):
+            return None
+        return campos
+
+    def _leer_cursor(self, campos, texto):
+        valores = texto.split(SEPARADOR)
+        if len(valores) != len(campos):
+            raise IncorrectLookupParameters(f"Cursor inválido: {texto}")
+        try:
+            return [campo.to_python(valor) for (campo, _), valor in zip(campos, valores)]
+        except ValidationError as e:
+            raise IncorrectLookupParameters(e)
+
+    @staticmethod
+    def cursor(campos, obj):
+        return SEPARADOR.join(campo.value_to_string(obj) for campo, _ in campos)
+
+    @staticmethod
+    def condicion(campos, valores, hacia_atras=False):
+        """
+        Filas que van después (o antes) de `valores` en el orden de `campos`:
+        a < x OR (a = x AND (b < y OR (b = y AND c < z))), más un a <= x
+        por delante para que el motor recorra el índice desde ese punto.
+        """
+        def operador(descendente, igual=False):
+            return ('lt' if descendente != hacia_atras else 'gt') + ('e' if igual else '')
+
+        (campo, descendente), valor = campos[-1], valores[-1]
+        condicion = Q(**{f'{campo.attname}__{operador(descendente)}': valor})
+        for (campo, descendente), valor in zip(campos[-2::-1], valores[-2::-1]):
+            condicion = Q(**{f'{campo.attname}__{operador(descendente)}': valor}) | (Q(**{campo.attname: valor}) & condicion)
+        (campo, descendente), valor = campos[0], valores[0]
+        return Q(**{f'{campo.attname}__{operador(descendente, igual=True)}': valor}) & condicion
+
+    def get_results(self, request):
+        campos = self.campos_keyset()
+        if campos is None or self.show_all:
+            super().get_results(request)
+            self.keyset = False
+            self.etiqueta_conteo = etiqueta_conteo(*self.paginator.conteo)
+            return
+
+        paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        result_count, tipo = paginator.conteo
+
+        hacia_atras = ANTES_VAR in self.params
+        texto = self.params.get(ANTES_VAR if hacia_atras else DESPUES_VAR) or ''
+        queryset = self.queryset
+        if texto:
+            queryset = queryset.filter(self.condicion(campos, self._leer_cursor(campos, texto), hacia_atras))
+        if hacia_atras:
+            queryset = queryset.reverse()
+        filas = list(queryset[:self.list_per_page + 1])
+        hay_mas = len(filas) > self.list_per_page
+        filas = filas[:self.list_per_page]
+        if hacia_atras:
+            filas.reverse()
+
+        # Hacia atrás, la página siguiente existe si se llegó desde ella (hay cursor)
+        hay_anterior, hay_siguiente = (hay_mas, bool(texto)) if hacia_atras else (bool(texto), hay_mas)
+        self.keyset = True
+        self.etiqueta_conteo = etiqueta_conteo(result_count, tipo)
+        self.enlace_primera = self.get_query_string() if hay_anterior else None
+        self.enlace_anterior = self.get_query_string({ANTES_VAR: self.cursor(campos, filas[0])}) if hay_anterior and filas else None
+        self.enlace_siguiente = self.get_query_string({DESPUES_VAR: self.cursor(campos, filas[-1])}) if hay_siguiente and filas else None
+        self.enlace_ultima = self.get_query_string({ANTES_VAR: ''}) if hay_siguiente else None
+
+        self.result_count = result_count
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.full_result_count = None
+        self.result_list = filas
+        self.can_show_all = tipo == EXACTO and result_count <= self.list_max_show_all
+        self.multi_page = hay_anterior or hay_siguiente
+        self.paginator = paginator
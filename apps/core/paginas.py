@@ -0,0 +1,130 @@
+"""
+Caché de páginas públicas (la home que recibe el tráfico de anuncios).
+
+  * La versión de la página sale de la "versión del catálogo" (cambia con cada
+    Servicio guardado o borrado) y de la fecha de las plantillas; de ahí se
+    derivan ETag y Last-Modified, así que un navegador o CDN que ya la tiene
+    recibe un 304 sin cuerpo.
+  * El HTML se guarda ya comprimido (gzip y, si está instalado, brotli) y se
+    sirve la variante que acepte el cliente.
+  * Protección contra estampida: tras una invalidación solo el worker que
+    obtiene el candado vuelve a renderizar; los demás siguen sirviendo la
+    copia anterior mientras tanto.
+"""
+import gzip
+import os
+import time
+
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.template.loader import get_template
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+try:
+    import brotli
+except ImportError:  # brotli es opcional: sin él se sirve gzip
+    brotli = None
+
+CLAVE_VERSION_CATALOGO = 'catalogo:version'
+TIEMPO_CANDADO = 30          # segundos máximos que un worker puede tardar en renderizar
+ESPERA_SIN_COPIA = 2.0       # segundos que esperan los demás si no hay ninguna copia previa
+MAX_AGE_NAVEGADOR = 60
+
+_fecha_plantillas = {}
+
+
+def version_catalogo():
+    version = cache.get(CLAVE_VERSION_CATALOGO)
+    if version is None:
+        cache.add(CLAVE_VERSION_CATALOGO, int(time.time()), None)
+        version = cache.get(CLAVE_VERSION_CATALOGO, int(time.time()))
+    return version
+
+
+def nueva_version_catalogo():
+    # Nunca retrocede aunque dos cambios caigan en el mismo segundo
+    cache.set(CLAVE_VERSION_CATALOGO, max(int(time.time()), version_catalogo() + 1), None)
+
+
+def _fecha_de_plantillas(nombres):
+    """ Última modificación de las plantillas (se calcula una vez por proceso) """
+    clave = tuple(nombres)
+    if clave not in _fecha_plantillas:
+        fechas = []
+        for nombre in nombres:
+            origen = get_template(nombre).origin.name
+            fechas.append(int(os.path.getmtime(origen)) if origen and os.path.exists(origen) else 0)
+        _fecha_plantillas[clave] = max(fechas)
+    return _fecha_plantillas[clave]
+
+
+def _comprimir(contenido):
+    variantes = {'identity': contenido, 'gzip': gzip.compress(contenido, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variantes['br'] = brotli.compress(contenido)
+    return variantes
+
+
+def _elegir_codificacion(request, variantes):
+    aceptadas = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    for codificacion in ('br', 'gzip'):
+        if codificacion in variantes and codificacion in aceptadas:
+            return codificacion
+    return 'identity'
+
+
+def _obtener_entrada(nombre, version, renderizar):
+    clave = f'pagina:{nombre}'
+    candado = f'pagina:{nombre}:candado'
+    entrada = cache.get(clave)
+    if entrada is not None and entrada['version'] == version:
+        return entrada
+
+    if cache.add(candado, 1, TIEMPO_CANDADO):
+        try:
+            entrada = {'version': version, 'variantes': _comprimir(renderizar())}
+            cache.set(clave, entrada, None)
+            return entrada
+        finally:
+            cache.delete(candado)
+
+    # Otro worker está renderizando: servimos la copia anterior si existe...
+    if entrada is not None:
+        return entrada
+    # ...y si la caché está vacía esperamos un momento a que termine
+    limite = time.monotonic() + ESPERA_SIN_COPIA
+    while time.monotonic() < limite:
+        time.sleep(0.05)
+        entrada = cache.get(clave)
+        if entrada is not None:
+            return entrada
+    return {'version': version, 'variantes': _comprimir(renderizar())}
+
+
+def pagina_cacheada(request, nombre, plantillas, renderizar):
+    """
+    Respuesta HTTP para una página pública cacheada.
+    `renderizar` devuelve los bytes del HTML y solo se llama cuando hace falta.
+    """
+    version = max(version_catalogo(), _fecha_de_plantillas(plantillas))
+    etag = f'"{nombre}-{version}"'
+
+    no_modificada = get_conditional_response(request, etag=etag, last_modified=version)
+    if no_modificada is None:
+        entrada = _obtener_entrada(nombre, version, renderizar)
+        etag = f'"{nombre}-{entrada["version"]}"'
+        codificacion = _elegir_codificacion(request, entrada['variantes'])
+        respuesta = HttpResponse(entrada['variantes'][codificacion], content_type='text/html; charset=utf-8')
+        if codificacion != 'identity':
+            respuesta['Content-Encoding'] = codificacion
+        respuesta['Content-Length'] = str(len(respuesta.content))
+        version = entrada['version']
+    else:
+        respuesta = no_modificada
+
+    respuesta['ETag'] = etag
+    respuesta['Last-Modified'] = http_date(version)
+    patch_vary_headers(respuesta, ('Accept-Encoding',))
+    patch_cache_control(respuesta, public=True, max_age=MAX_AGE_NAVEGADOR)
+    return respuesta
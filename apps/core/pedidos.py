@@ -0,0 +1,194 @@
+"""
+Tienda: carrito, reserva de stock y pedidos.
+
+`Producto.stock` es lo que queda disponible para vender. Al confirmar el
+carrito, reservar_pedido() descuenta cada producto con un UPDATE condicional
+(`SET stock = stock - n WHERE stock >= n`) dentro de una sola transacción: si
+algún producto no alcanza, el pedido entero se deshace y nadie compra lo que
+no hay, aunque lleguen muchos pedidos a la vez. Los productos se toman siempre
+en el mismo orden (por id) para que dos pedidos no se bloqueen entre sí.
+
+El pedido retiene ese stock TIENDA_MINUTOS_RESERVA minutos. Si no tiene pago
+registrado para entonces, liberar_vencidas() (`manage.py liberar_reservas`)
+lo marca como vencido y devuelve las unidades. Cuando el pago (PagoPedido)
+cubre el total, el pedido pasa a pagado y el stock queda vendido. Un abono
+parcial alarga la reserva TIENDA_DIAS_RESERVA_CON_ABONO días más; si el pago
+no se completa, el barrido también lo vence, y el personal puede cancelarlo
+antes desde el admin. En ambos casos el stock vuelve a la tienda y el abono
+queda registrado en el pedido para devolverlo.
+
+El carrito vive en la sesión: {id de producto: cantidad}.
+"""
+import random
+import time as reloj
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import OperationalError, transaction
+from django.db.models import Exists, F, OuterRef, Q, Sum
+from django.utils import timezone
+
+from .models import ItemPedido, PagoPedido, Pedido, Producto
+
+CLAVE_CARRITO = 'carrito'
+REINTENTOS_RESERVA = 5
+ESPERA_BASE_SEGUNDOS = 0.02
+# Pedidos vencidos que se liberan por transacción
+LOTE_LIBERACION = 500
+
+SIN_PAGO = ~Exists(PagoPedido.objects.filter(pedido=OuterRef('pk')))
+
+
+class SinStock(Exception):
+    """ Algún producto del pedido ya no tiene stock suficiente """
+
+
+def minutos_reserva():
+    return getattr(settings, 'TIENDA_MINUTOS_RESERVA', 30)
+
+
+def dias_reserva_con_abono():
+    return getattr(settings, 'TIENDA_DIAS_RESERVA_CON_ABONO', 7)
+
+
+def max_por_producto():
+    return getattr(settings, 'TIENDA_MAX_POR_PRODUCTO', 10)
+
+
+# ---------------------------------------------------------
+# CARRITO (EN LA SESIÓN)
+# ---------------------------------------------------------
+def carrito(session):
+    return {int(producto_id): cantidad for producto_id, cantidad in session.get(CLAVE_CARRITO, {}).items()}
+
+
+def agregar_al_carrito(session, producto_id, cantidad=1):
+    items = session.get(CLAVE_CARRITO, {})
+    clave = str(producto_id)
+    items[clave] = max(1, min(items.get(clave, 0) + cantidad, max_por_producto()))
+    session[CLAVE_CARRITO] = items
+
+
+def quitar_del_carrito(session, producto_id):
+    items = session.get(CLAVE_CARRITO, {})
+    items.pop(str(producto_id), None)
+    session[CLAVE_CARRITO] = items
+
+
+def vaciar_carrito(session):
+    session.pop(CLAVE_CARRITO, None)
+
+
+def detalle_carrito(session):
+    """ Líneas del carrito con su producto y subtotal (una consulta) """
+    items = carrito(session)
+    productos = Producto.objects.in_bulk(list(items))
+    lineas = [
+        {'producto': productos[producto_id], 'cantidad': cantidad, 'subtotal': productos[producto_id].precio * cantidad}
+        for producto_id, cantidad in items.items() if producto_id in productos
+    ]
+    return {'lineas': lineas, 'total': sum((linea['subtotal'] for linea in lineas), 0)}
+
+
+# ---------------------------------------------------------
+# RESERVA DE STOCK
+# ---------------------------------------------------------
+def _reservar(cliente, items):
+    productos = {pk: (nombre, precio) for pk, nombre, precio in Producto.objects.filter(pk__in=list(items)).values_list('pk', 'nombre', 'precio')}
+    for producto_id in sorted(items):
+        cantidad = items[producto_id]
+        descontado = producto_id in productos and Producto.objects.filter(
+            pk=producto_id, stock__gte=cantidad,
+        ).update(stock=F('stock') - cantidad)
+        if not descontado:
+            nombre = productos.get(producto_id, ("Un producto",))[0]
+            raise SinStock(f"Ya no hay {cantidad} unidad(es) de {nombre} disponibles.")
+
+    pedido = Pedido.objects.create(
+        cliente=cliente,
+        total=sum(productos[pk][1] * cantidad for pk, cantidad in items.items()),
+        reservado_hasta=timezone.now() + timedelta(minutes=minutos_reserva()),
+    )
+    ItemPedido.objects.bulk_create([
+        ItemPedido(pedido=pedido, producto_id=pk, cantidad=cantidad, precio_unitario=productos[pk][1])
+        for pk, cantidad in sorted(items.items())
+    ])
+    return pedido
+
+
+def reservar_pedido(cliente, items):
+    """
+    Crea el pedido de `items` ({producto_id: cantidad}) reteniendo su stock.
+    Todo o nada: lanza SinStock si algún producto no alcanza. Los bloqueos
+    transitorios de la base de datos se reintentan con espera exponencial.
+    """
+    items = {int(pk): int(cantidad) for pk, cantidad in items.items() if int(cantidad) > 0}
+    if not items:
+        raise SinStock("El carrito está vacío.")
+    for intento in range(REINTENTOS_RESERVA):
+        try:
+            with transaction.atomic():
+                return _reservar(cliente, items)
+        except OperationalError:
+            if intento == REINTENTOS_RESERVA - 1:
+                raise
+            reloj.sleep(ESPERA_BASE_SEGUNDOS * (2 ** intento) * (1 + random.random()))
+
+
+def _devolver_stock(pedidos_ids):
+    """ Un UPDATE por producto con las unidades de todos los pedidos """
+    unidades = (
+        ItemPedido.objects.filter(pedido_id__in=pedidos_ids)
+        .values_list('producto_id').annotate(unidades=Sum('cantidad')).order_by('producto_id')
+    )
+    for producto_id, cantidad in unidades:
+        Producto.objects.filter(pk=producto_id).update(stock=F('stock') + cantidad)
+
+
+def liberar_vencidas(ahora=None, lote=LOTE_LIBERACION):
+    """
+    Devuelve el stock de los pedidos sin pago cuya reserva expiró, y de los que
+    tienen un abono parcial y siguen sin completarse pasado el plazo extendido.
+    Devuelve cuántos se liberaron
+    """
+    ahora = ahora or timezone.now()
+    vencidos = (SIN_PAGO & Q(reservado_hasta__lt=ahora)) | Q(
+        reservado_hasta__lt=ahora - timedelta(days=dias_reserva_con_abono()),
+    )
+    liberados = 0
+    while True:
+        with transaction.atomic():
+            ids = list(
+                Pedido.objects.select_for_update()
+                .filter(vencidos, estado=Pedido.RESERVADO)
+                .values_list('pk', flat=True)[:lote]
+            )
+            if not ids:
+                return liberados
+            Pedido.objects.filter(pk__in=ids).update(estado=Pedido.VENCIDO)
+            _devolver_stock(ids)
+        liberados += len(ids)
+
+
+def cancelar_pedido(pedido, con_abono=False):
+    """
+    El cliente desiste antes de pagar: el stock vuelve a la tienda. Con
+    con_abono=True (el personal, desde el admin) también se cancela un pedido
+    con un abono parcial, que queda registrado para devolverlo. False si ya no se puede
+    """
+    reservado = Pedido.objects.filter(pk=pedido.pk, estado=Pedido.RESERVADO)
+    if not con_abono:
+        reservado = reservado.filter(SIN_PAGO)
+    with transaction.atomic():
+        if not reservado.update(estado=Pedido.CANCELADO):
+            return False
+        _devolver_stock([pedido.pk])
+    pedido.estado = Pedido.CANCELADO
+    return True
+
+
+def pago_registrado(pago):
+    """ Si lo abonado cubre el total del pedido, queda pagado (el stock ya estaba descontado) """
+    Pedido.objects.filter(pk=pago.pedido_id, estado=Pedido.RESERVADO, total__lte=pago.monto_pagado).update(
+        estado=Pedido.PAGADO, pagado_en=timezone.now(),
+    )
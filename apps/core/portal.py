@@ -0,0 +1,90 @@
+"""
+Caché del portal del paciente.
+
+Cada paciente tiene una entrada con sus citas (con el servicio ya unido), sus
+recetas y sus documentos clínicos; el catálogo de servicios se guarda aparte,
+una sola vez para todos.
+Ambas claves se leen con un único `get_many`, así que un dashboard repetido
+cuesta una sola consulta a la caché.
+
+El catálogo lleva una "generación": cada entrada de paciente recuerda con qué
+generación se construyó, y si un Servicio cambia (y con él títulos y precios
+que aparecen en las citas) todas las entradas quedan obsoletas de golpe sin
+tener que borrarlas una por una.
+
+La invalidación la hacen las señales de Cita, Receta, Documento y Servicio (signals.py)
+y las acciones masivas del admin que usan queryset.update().
+"""
+import time
+
+from django.core.cache import cache
+
+from .models import Cita, Documento, Receta, Servicio
+
+CLAVE_CATALOGO = 'portal:catalogo'
+TIEMPO_CACHE = 60 * 60 * 24
+
+
+def servicios_catalogo():
+    """ Catálogo de servicios compartido (también lo usa el chatbot) """
+    return (cache.get(CLAVE_CATALOGO) or _construir_catalogo())['servicios']
+
+
+async def aservicios_catalogo():
+    """ Versión asíncrona para las vistas ASGI (caché y ORM asíncronos) """
+    catalogo = await cache.aget(CLAVE_CATALOGO)
+    if catalogo is None:
+        catalogo = _nuevo_catalogo([s async for s in Servicio.objects.all()])
+        await cache.aset(CLAVE_CATALOGO, catalogo, TIEMPO_CACHE)
+    return catalogo['servicios']
+
+
+def clave_paciente(paciente_id):
+    return f'portal:paciente:v2:{paciente_id}'  # v2: incluye los documentos
+
+
+def _nuevo_catalogo(servicios):
+    return {'generacion': time.time_ns(), 'servicios': servicios}
+
+
+def _construir_catalogo():
+    catalogo = _nuevo_catalogo(list(Servicio.objects.all()))
+    cache.set(CLAVE_CATALOGO, catalogo, TIEMPO_CACHE)
+    return catalogo
+
+
+def _construir_paciente(paciente_id, generacion):
+    datos = {
+        'generacion': generacion,
+        'citas': list(
+            Cita.objects.filter(paciente_id=paciente_id).select_related('servicio').order_by('fecha', 'hora')
+        ),
+        'recetas': list(Receta.objects.filter(paciente_id=paciente_id).order_by('-fecha_emision')),
+        'documentos': list(Documento.objects.filter(paciente_id=paciente_id).defer('notas').order_by('-fecha_subida')),
+    }
+    cache.set(clave_paciente(paciente_id), datos, TIEMPO_CACHE)
+    return datos
+
+
+def datos_portal(paciente_id):
+    """ Devuelve {'citas', 'recetas', 'documentos', 'servicios'} desde la caché (o los reconstruye) """
+    clave = clave_paciente(paciente_id)
+    encontrados = cache.get_many([clave, CLAVE_CATALOGO])
+
+    catalogo = encontrados.get(CLAVE_CATALOGO) or _construir_catalogo()
+    datos = encontrados.get(clave)
+    if datos is None or datos['generacion'] != catalogo['generacion']:
+        datos = _construir_paciente(paciente_id, catalogo['generacion'])
+
+    return {
+        'citas': datos['citas'], 'recetas': datos['recetas'], 'documentos': datos['documentos'],
+        'servicios': catalogo['servicios'],
+    }
+
+
+def invalidar_pacientes(paciente_ids):
+    cache.delete_many([clave_paciente(pk) for pk in set(paciente_ids) if pk is not None])
+
+
+def invalidar_catalogo():
+    cache.delete(CLAVE_CATALOGO)
@@ -0,0 +1,336 @@
+"""
+PDF de las recetas médicas (portal del paciente y acción del admin).
+
+Un único dibujo de la receta y una caché en disco direccionada por contenido:
+  * el nombre del archivo es el SHA-256 de los datos que aparecen impresos más
+    VERSION_PLANTILLA, así que editar la receta (o el nombre del paciente)
+    produce otro archivo sin invalidar nada; cambiar el diseño del PDF solo
+    requiere subir VERSION_PLANTILLA;
+  * ese mismo hash es el ETag: un paciente que vuelve a descargar su receta
+    recibe un 304 o, como mucho, la lectura de un archivo;
+  * la carpeta tiene un tamaño máximo (RECETAS_PDF_MAX_MB) y se desalojan los
+    archivos usados hace más tiempo (LRU por fecha de modificación, que se
+    actualiza en cada acierto). El total se lleva en un contador de la caché
+    que suma cada PDF escrito: la carpeta solo se recorre cuando el contador
+    pasa del máximo (o se perdió), no en cada fallo;
+  * el PDF se entrega ya abierto (o desde memoria si se acaba de generar), así
+    que un desalojo concurrente no puede borrarlo entre que se busca y se lee.
+
+La impresión masiva del admin no arma todo en memoria: lee las recetas por
+bloques, las dibuja en un pool de procesos y va enviando un ZIP con un PDF
+por paciente a medida que cada bloque termina.
+"""
+import hashlib
+import io
+import multiprocessing
+import os
+import tempfile
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import FileResponse
+from django.utils.cache import get_conditional_response
+from django.utils.text import slugify
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+# Subir este número cuando cambie el diseño del PDF
+VERSION_PLANTILLA = 2
+
+# Impresión desde el admin: hasta este número se arma un único PDF combinado;
+# por encima se envía el ZIP por paciente
+MAX_RECETAS_PDF_COMBINADO = 50
+
+# Impresión masiva: recetas por tarea del pool y tareas en vuelo por proceso
+RECETAS_POR_BLOQUE = 200
+BLOQUES_EN_VUELO_POR_PROCESO = 2
+
+# Al superar el máximo se borra hasta quedar en este porcentaje (evita desalojar en cada escritura)
+PORCENTAJE_TRAS_DESALOJO = 0.9
+
+# Contador (en la caché de Django) de los bytes que ocupa la carpeta
+CLAVE_TOTAL_BYTES = 'recetas_pdf:total_bytes'
+
+
+def directorio_cache():
+    return getattr(settings, 'RECETAS_PDF_DIR', os.path.join(settings.BASE_DIR, '.cache', 'recetas_pdf'))
+
+
+def _max_bytes():
+    return getattr(settings, 'RECETAS_PDF_MAX_MB', 200) * 1024 * 1024
+
+
+def _procesos():
+    return getattr(settings, 'RECETAS_PDF_PROCESOS', None) or os.cpu_count() or 1
+
+
+# ---------------------------------------------------------
+# DIBUJO DE LA RECETA
+# ---------------------------------------------------------
+def datos_receta(receta):
+    """
+    Lo que se imprime de una receta, como textos planos. Así el dibujo no toca
+    el ORM y puede hacerse en otro proceso (impresión masiva).
+    """
+    return {
+        'nombre': receta.paciente.first_name,
+        'apellido': receta.paciente.last_name,
+        'fecha': receta.fecha_emision.strftime('%d/%m/%Y'),
+        'diagnostico': receta.diagnostico,
+        'medicamentos': receta.medicamentos,
+        'proxima_cita': str(receta.proxima_cita or ''),
+    }
+
+
+def dibujar_receta(p, datos):
+    """ Dibuja una receta (ver datos_receta) en la página actual del canvas (no llama a showPage) """
+    width, height = A4
+
+    # ENCABEZADO
+    p.setFont("Helvetica-Bold", 16)
+    p.drawString(50, height - 50, "CLÍNICA DENTAL DRA. JAZMIN")
+    p.setFont("Helvetica", 10)
+    p.drawString(50, height - 70, "Av. Principal 123 - Lima, Perú | Tel: 999-999-999")
+    p.line(50, height - 80, width - 50, height - 80)
+
+    # DATOS PACIENTE
+    p.setFont("Helvetica-Bold", 12)
+    p.drawString(50, height - 110, f"PACIENTE: {datos['nombre']} {datos['apellido']}")
+    p.setFont("Helvetica", 10)
+    p.drawString(400, height - 110, f"FECHA: {datos['fecha']}")
+
+    # DIAGNÓSTICO
+    p.setFont("Helvetica-Bold", 11)
+    p.drawString(50, height - 150, "DIAGNÓSTICO:")
+    p.setFont("Helvetica", 10)
+    p.drawString(50, height - 165, datos['diagnostico'])
+
+    # MEDICAMENTOS
+    p.setFont("Helvetica-Bold", 11)
+    p.drawString(50, height - 200, "INDICACIONES MÉDICAS (RP):")
+
+    text_object = p.beginText(50, height - 220)
+    text_object.setFont("Helvetica", 10)
+    for line in datos['medicamentos'].split('\n'):
+        text_object.textLine(line)
+    p.drawText(text_object)
+
+    # PIE DE PÁGINA
+    p.line(50, 150, 250, 150)
+    p.setFont("Helvetica", 9)
+    p.drawString(80, 135, "Firma Dra. Jazmín")
+    p.drawString(50, 65, "Nota: Esta receta es válida por 30 días.")
+    if datos['proxima_cita']:
+        p.drawString(50, 50, f"Próxima cita sugerida: {datos['proxima_cita']}")
+    p.drawString(50, 35, "Documento generado digitalmente - Clínica Dental Dra. Jazmin.")
+
+
+def renderizar_datos(lista_datos):
+    """ Bytes de un PDF con una página por receta (recibe datos_receta, no modelos) """
+    buffer = io.BytesIO()
+    # invariant=1: mismo contenido -> mismos bytes (sin fecha de creación ni ID aleatorio)
+    p = canvas.Canvas(buffer, pagesize=A4, invariant=1, pageCompression=1)
+    for datos in lista_datos:
+        dibujar_receta(p, datos)
+        p.showPage()
+    p.save()
+    return buffer.getvalue()
+
+
+def renderizar_recetas(recetas):
+    return renderizar_datos([datos_receta(receta) for receta in recetas])
+
+
+# ---------------------------------------------------------
+# CACHÉ EN DISCO DIRECCIONADA POR CONTENIDO
+# ---------------------------------------------------------
+def huella(receta):
+    """ SHA-256 de todo lo que se imprime en la receta + la versión de la plantilla """
+    datos = datos_receta(receta)
+    partes = [str(VERSION_PLANTILLA)] + [datos[campo] for campo in sorted(datos)]
+    return hashlib.sha256('\x1f'.join(partes).encode('utf-8')).hexdigest()
+
+
+def ruta_en_cache(clave):
+    return os.path.join(directorio_cache(), clave[:2], f'{clave}.pdf')
+
+
+def pdf_receta(receta):
+    """
+    Devuelve (archivo, huella): el PDF de la receta ya abierto en modo binario,
+    generándolo solo si no existe. Quien lo recibe debe cerrarlo.
+    """
+    clave = huella(receta)
+    ruta = ruta_en_cache(clave)
+    try:
+        # Abierto, aunque otro proceso lo desaloje ahora se puede seguir leyendo
+        archivo = open(ruta, 'rb')
+    except FileNotFoundError:
+        pass
+    else:
+        try:
+            os.utime(ruta)  # acierto: lo marcamos como usado recientemente
+        except FileNotFoundError:
+            pass
+        return archivo, clave
+
+    pdf = renderizar_recetas([receta])
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    # Escritura atómica: otro worker nunca ve un PDF a medio escribir
+    descriptor, temporal = tempfile.mkstemp(dir=os.path.dirname(ruta), suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'wb') as archivo:
+            archivo.write(pdf)
+        os.replace(temporal, ruta)
+    except BaseException:
+        os.unlink(temporal)
+        raise
+    _sumar_al_total(len(pdf))
+    # Recién generado: se entrega desde memoria, sin volver a buscarlo en disco
+    return io.BytesIO(pdf), clave
+
+
+def _sumar_al_total(tamano):
+    """ Suma un PDF escrito al contador; solo se recorre la carpeta si pasa del máximo o no hay contador """
+    try:
+        total = cache.incr(CLAVE_TOTAL_BYTES, tamano)
+    except ValueError:
+        total = None  # caché vaciada o primer uso: desalojar lo vuelve a medir
+    if total is None or total > _max_bytes():
+        desalojar()
+
+
+def desalojar(max_bytes=None):
+    """
+    Borra los PDFs usados hace más tiempo hasta volver por debajo del máximo.
+    Recorre toda la carpeta y deja el contador con el total medido.
+    """
+    max_bytes = _max_bytes() if max_bytes is None else max_bytes
+    archivos = []
+    total = 0
+    for carpeta, _, nombres in os.walk(directorio_cache()):
+        for nombre in nombres:
+            if not nombre.endswith('.pdf'):
+                continue
+            ruta = os.path.join(carpeta, nombre)
+            try:
+                estado = os.stat(ruta)
+            except FileNotFoundError:
+                continue
+            archivos.append((estado.st_mtime, estado.st_size, ruta))
+            total += estado.st_size
+    borrados = 0
+    if total > max_bytes:
+        objetivo = max_bytes * PORCENTAJE_TRAS_DESALOJO
+        for _, tamano, ruta in sorted(archivos):
+            if total <= objetivo:
+                break
+            try:
+                os.unlink(ruta)
+            except FileNotFoundError:
+                pass
+            except PermissionError:
+                continue  # Windows: otro worker lo tiene abierto; queda para el próximo desalojo
+            total -= tamano
+            borrados += 1
+    cache.set(CLAVE_TOTAL_BYTES, total, None)
+    return borrados
+
+
+def respuesta_pdf(request, receta, nombre_archivo, adjunto=False):
+    """ FileResponse del PDF cacheado con ETag y Content-Length (o 304 si no cambió) """
+    archivo, clave = pdf_receta(receta)
+    etag = f'"{clave}"'
+    no_modificada = get_conditional_response(request, etag=etag)
+    if no_modificada is not None:
+        archivo.close()
+        no_modificada['ETag'] = etag
+        return no_modificada
+
+    # FileResponse calcula el Content-Length a partir del archivo (y lo cierra al terminar)
+    respuesta = FileResponse(archivo, content_type='application/pdf', as_attachment=adjunto, filename=nombre_archivo)
+    respuesta['ETag'] = etag
+    return respuesta
+
+
+# ---------------------------------------------------------
+# IMPRESIÓN MASIVA (ZIP EN STREAMING, UN PDF POR PACIENTE)
+# ---------------------------------------------------------
+class Tubo:
+    """ Archivo de solo escritura que zipfile va llenando y nosotros vaciando """
+
+    def __init__(self):
+        self.partes = []
+
+    def write(self, datos):
+        self.partes.append(bytes(datos))
+        return len(datos)
+
+    def flush(self):
+        pass
+
+    def vaciar(self):
+        datos = b''.join(self.partes)
+        self.partes.clear()
+        return datos
+
+
+def _renderizar_bloque(pacientes):
+    """ Se ejecuta en el pool: [(nombre_archivo, [datos, ...]), ...] -> [(nombre_archivo, pdf), ...] """
+    return [(nombre, renderizar_datos(lista)) for nombre, lista in pacientes]
+
+
+def _bloques_por_paciente(queryset):
+    """ Agrupa las recetas por paciente y arma bloques de ~RECETAS_POR_BLOQUE recetas """
+    filas = (
+        queryset.select_related('paciente')
+        .order_by('paciente_id', 'fecha_emision', 'id')
+        .iterator(chunk_size=RECETAS_POR_BLOQUE)
+    )
+    bloque, recetas_en_bloque = [], 0
+    paciente_actual, lista = None, None
+    for receta in filas:
+        if receta.paciente_id != paciente_actual:
+            if recetas_en_bloque >= RECETAS_POR_BLOQUE:
+                yield bloque
+                bloque, recetas_en_bloque = [], 0
+            paciente_actual, lista = receta.paciente_id, []
+            nombre = slugify(f"{receta.paciente.last_name} {receta.paciente.first_name}") or 'paciente'
+            bloque.append((f"{nombre}_{receta.paciente_id}.pdf", lista))
+        lista.append(datos_receta(receta))
+        recetas_en_bloque += 1
+    if bloque:
+        yield bloque
+
+
+def _pdfs_en_paralelo(bloques):
+    """ Genera (nombre_archivo, pdf) en orden, con un número acotado de bloques en memoria """
+    procesos = _procesos()
+    if procesos <= 1:
+        for bloque in bloques:
+            yield from _renderizar_bloque(bloque)
+        return
+
+    # 'spawn': los procesos hijos no heredan conexiones a la base de datos ni hilos del servidor
+    with ProcessPoolExecutor(procesos, mp_context=multiprocessing.get_context('spawn')) as pool:
+        en_vuelo = deque()
+        for bloque in bloques:
+            en_vuelo.append(pool.submit(_renderizar_bloque, bloque))
+            if len(en_vuelo) >= procesos * BLOQUES_EN_VUELO_POR_PROCESO:
+                yield from en_vuelo.popleft().result()
+        while en_vuelo:
+            yield from en_vuelo.popleft().result()
+
+
+def zip_recetas(queryset):
+    """ Iterador de bytes de un ZIP con un PDF por paciente (para StreamingHttpResponse) """
+    tubo = Tubo()
+    with zipfile.ZipFile(tubo, 'w', compression=zipfile.ZIP_STORED) as archivo_zip:
+        for nombre, pdf in _pdfs_en_paralelo(_bloques_por_paciente(queryset)):
+            # Los PDF ya van comprimidos por dentro: ZIP_STORED evita gastar CPU de nuevo
+            archivo_zip.writestr(nombre, pdf)
+            yield tubo.vaciar()
+    yield tubo.vaciar()
@@ -0,0 +1,138 @@
+"""
+Recordatorios de citas (un día antes y dentro de las próximas 2 horas).
+
+Pensado para correr por cron en pocos segundos aunque haya decenas de miles
+de citas por día:
+  * las citas se buscan por rango sobre el índice de `Cita.inicio`, excluyendo
+    las que ya tienen su `Recordatorio` (así una segunda corrida no hace nada);
+  * cada plantilla se renderiza UNA vez con marcadores y luego solo se
+    reemplazan los datos de cada paciente;
+  * los correos salen en lotes de RECORDATORIOS_LOTE por conexión SMTP, uno
+    por uno, y cada envío exitoso se registra en el acto: si el SMTP falla a
+    mitad de un lote, la siguiente corrida no repite los que ya salieron.
+"""
+import logging
+import re
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db.models import Exists, OuterRef
+from django.template.loader import render_to_string
+from django.utils import formats, timezone
+from django.utils.html import escape, strip_tags
+
+from .models import Cita, Recordatorio
+
+logger = logging.getLogger(__name__)
+
+CAMPOS = ('nombre', 'tratamiento', 'fecha', 'hora')
+MARCADOR = re.compile(r'\[\[(%s)\]\]' % '|'.join(CAMPOS))
+
+TIPOS = {
+    Recordatorio.DIA_ANTERIOR: {
+        'asunto': 'Recordatorio: tu cita es mañana - Clínica Dra. Jazmin',
+        'encabezado': 'Tu cita es mañana',
+        'introduccion': 'Te recordamos que mañana tienes una cita con nosotros.',
+    },
+    Recordatorio.PROXIMAS_HORAS: {
+        'asunto': 'Tu cita es en unas horas - Clínica Dra. Jazmin',
+        'encabezado': 'Te esperamos pronto',
+        'introduccion': 'Tu cita es en menos de 2 horas. ¡Te esperamos!',
+    },
+}
+
+
+class PlantillaRecordatorio:
+    """ Render único de la plantilla; `completar` solo sustituye los marcadores """
+
+    def __init__(self, tipo, template='emails/recordatorio_cita.html'):
+        contexto = dict(TIPOS[tipo])
+        contexto.update({campo: f'[[{campo}]]' for campo in CAMPOS})
+        self.asunto = contexto['asunto']
+        self.html = render_to_string(template, contexto)
+        self.texto = strip_tags(self.html)
+
+    def completar(self, datos):
+        html = MARCADOR.sub(lambda m: escape(datos[m.group(1)]), self.html)
+        texto = MARCADOR.sub(lambda m: str(datos[m.group(1)]), self.texto)
+        return texto, html
+
+
+def ventana(tipo, ahora=None):
+    """ Rango [desde, hasta) de `Cita.inicio` que cubre cada tipo de recordatorio """
+    ahora = ahora or timezone.now()
+    if tipo == Recordatorio.DIA_ANTERIOR:
+        manana = timezone.localtime(ahora).date() + timedelta(days=1)
+        desde = timezone.make_aware(datetime.combine(manana, time.min))
+        return desde, desde + timedelta(days=1)
+    return ahora, ahora + timedelta(hours=2)
+
+
+def citas_por_recordar(tipo, ahora=None):
+    desde, hasta = ventana(tipo, ahora)
+    ya_enviado = Recordatorio.objects.filter(cita=OuterRef('pk'), tipo=tipo)
+    return (
+        Cita.objects.entre(desde, hasta)
+        .exclude(estado__in=('cancelada', 'finalizada'))
+        .exclude(paciente__email='')
+        .filter(~Exists(ya_enviado))
+        .order_by('inicio')
+        .values_list('id', 'paciente__first_name', 'paciente__email', 'servicio__titulo', 'fecha', 'hora')
+    )
+
+
+def enviar_recordatorios(tipo, lote=None, ahora=None):
+    """ Envía los recordatorios pendientes de un tipo. Devuelve (enviados, fallidos) """
+    lote = lote or getattr(settings, 'RECORDATORIOS_LOTE', 200)
+    plantilla = PlantillaRecordatorio(tipo)
+    remitente = settings.EMAIL_HOST_USER
+    enviados = fallidos = 0
+
+    # Tuplas ligeras: decenas de miles caben sin problema en memoria y así no
+    # mantenemos un cursor abierto mientras registramos los envíos
+    filas = list(citas_por_recordar(tipo, ahora))
+    if not filas:
+        return 0, 0
+
+    for i in range(0, len(filas), lote):
+        tramo = filas[i:i + lote]
+        # Una conexión por lote: si el servidor la corta, el lote siguiente abre otra
+        conexion = get_connection(fail_silently=False)
+        try:
+            conexion.open()
+        except Exception as e:
+            logger.warning("No se pudo conectar para enviar %s recordatorios (%s): %s", len(tramo), tipo, e)
+            fallidos += len(tramo)
+            continue
+        try:
+            ok, error = _enviar_lote(conexion, plantilla, remitente, tipo, tramo)
+        finally:
+            conexion.close()
+        enviados, fallidos = enviados + ok, fallidos + error
+    return enviados, fallidos
+
+
+def _enviar_lote(conexion, plantilla, remitente, tipo, filas):
+    enviados = fallidos = 0
+    for cita_id, nombre, email, tratamiento, fecha, hora in filas:
+        texto, html = plantilla.completar({
+            'nombre': nombre,
+            'tratamiento': tratamiento,
+            'fecha': formats.date_format(fecha, 'DATE_FORMAT'),
+            'hora': hora.strftime('%H:%M'),
+        })
+        mensaje = EmailMultiAlternatives(plantilla.asunto, texto, remitente, [email], connection=conexion)
+        mensaje.attach_alternative(html, 'text/html')
+
+        try:
+            conexion.send_messages([mensaje])
+        except Exception as e:
+            # No se registra: la próxima corrida del cron lo volverá a intentar
+            logger.warning("Falló el recordatorio (%s) de la cita %s: %s", tipo, cita_id, e)
+            fallidos += 1
+            continue
+        # Registrado apenas sale, no al final del lote: una falla posterior no lo reenvía
+        Recordatorio.objects.bulk_create([Recordatorio(cita_id=cita_id, tipo=tipo)], ignore_conflicts=True)
+        enviados += 1
+    return enviados, fallidos
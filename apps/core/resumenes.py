@@ -0,0 +1,201 @@
+"""
+Resúmenes diarios para el tablero del admin.
+
+`ResumenCitasDia` (día x servicio x estado) y `ResumenPagosDia` (día x método)
+se mantienen al escribir, sin recorrer las tablas de citas y pagos:
+  * las señales de Cita y Pago suman/restan la diferencia con UPDATE ... SET
+    cantidad = cantidad + 1 (atómico aunque haya varios workers);
+  * las acciones masivas que usan queryset.update() recalculan solo los días
+    afectados;
+  * `manage.py reconstruir_resumenes` los rehace desde cero si hiciera falta.
+
+El tablero lee los resúmenes y guarda el resultado en la caché hasta que
+algún resumen cambia (el total de pacientes puede tardar hasta
+TIEMPO_TABLERO en actualizarse).
+"""
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Cita, Pago, ResumenCitasDia, ResumenPagosDia
+
+CLAVE_TABLERO = 'admin:tablero'
+TIEMPO_TABLERO = 60 * 10
+MESES_GRAFICO = 6
+MAX_TRATAMIENTOS = 4
+MESES_ABREVIADOS = ['Ene', 'Feb', 'Mar', 'Abr', 'May', 'Jun', 'Jul', 'Ago', 'Sep', 'Oct', 'Nov', 'Dic']
+
+# Las citas canceladas no cuentan en el tablero
+ESTADOS_EXCLUIDOS = ('cancelada',)
+
+
+def invalidar_tablero():
+    cache.delete(CLAVE_TABLERO)
+
+
+# ---------------------------------------------------------
+# MANTENIMIENTO INCREMENTAL
+# ---------------------------------------------------------
+def _acumular(modelo, clave, **deltas):
+    """ Suma `deltas` a la fila `clave` (la crea si no existe, aunque el cambio sea negativo) """
+    sumas = {campo: F(campo) + valor for campo, valor in deltas.items()}
+    if modelo.objects.filter(**clave).update(**sumas):
+        return
+    # Sin fila se crea con el delta tal cual: si es negativo (p. ej. el resumen
+    # aún no tenía esa cita) el próximo delta positivo lo deja en cero
+    try:
+        with transaction.atomic():
+            modelo.objects.create(**clave, **deltas)
+    except IntegrityError:
+        # Otro worker la creó entre el UPDATE y el INSERT
+        modelo.objects.filter(**clave).update(**sumas)
+
+
+def _sumar_cita(clave, signo):
+    fecha, servicio_id, estado = clave
+    _acumular(ResumenCitasDia, {'fecha': fecha, 'servicio_id': servicio_id, 'estado': estado}, cantidad=signo)
+
+
+def _sumar_pago(clave, signo):
+    fecha, metodo, monto = clave
+    _acumular(ResumenPagosDia, {'fecha': fecha, 'metodo': metodo}, cantidad=signo, monto=signo * monto)
+
+
+def cita_guardada(cita):
+    anterior, actual = getattr(cita, '_resumen_original', None), cita.clave_resumen()
+    if anterior != actual:
+        if anterior is not None:
+            _sumar_cita(anterior, -1)
+        if actual is not None:
+            _sumar_cita(actual, 1)
+        invalidar_tablero()
+    cita._resumen_original = actual
+
+
+def cita_borrada(cita):
+    clave = getattr(cita, '_resumen_original', None) or cita.clave_resumen()
+    if clave is not None:
+        _sumar_cita(clave, -1)
+        invalidar_tablero()
+
+
+def pago_guardado(pago):
+    anterior, actual = getattr(pago, '_resumen_original', None), pago.clave_resumen()
+    if anterior == actual:
+        return
+    if anterior is not None and actual is not None and anterior[:2] == actual[:2]:
+        # Mismo día y método (p. ej. un nuevo abono): solo cambia el monto
+        _acumular(ResumenPagosDia, {'fecha': actual[0], 'metodo': actual[1]}, monto=actual[2] - anterior[2])
+    else:
+        if anterior is not None:
+            _sumar_pago(anterior, -1)
+        if actual is not None:
+            _sumar_pago(actual, 1)
+    pago._resumen_original = actual
+    invalidar_tablero()
+
+
+def pago_borrado(pago):
+    clave = getattr(pago, '_resumen_original', None) or pago.clave_resumen()
+    if clave is not None:
+        _sumar_pago(clave, -1)
+        invalidar_tablero()
+
+
+# ---------------------------------------------------------
+# RECÁLCULO DESDE LAS TABLAS
+# ---------------------------------------------------------
+@transaction.atomic
+def recalcular_citas(fechas=None):
+    """ Rehace el resumen de citas de esas fechas (o de todas si fechas es None) """
+    citas = Cita.objects.all()
+    resumenes = ResumenCitasDia.objects.all()
+    if fechas is not None:
+        fechas = set(fechas)
+        citas, resumenes = citas.filter(fecha__in=fechas), resumenes.filter(fecha__in=fechas)
+    resumenes.delete()
+    ResumenCitasDia.objects.bulk_create(
+        [
+            ResumenCitasDia(fecha=f['fecha'], servicio_id=f['servicio'], estado=f['estado'], cantidad=f['cantidad'])
+            for f in citas.order_by().values('fecha', 'servicio', 'estado').annotate(cantidad=Count('id')).iterator()
+        ],
+        batch_size=1000,
+    )
+    invalidar_tablero()
+
+
+@transaction.atomic
+def recalcular_pagos():
+    ResumenPagosDia.objects.all().delete()
+    filas = (
+        Pago.objects.order_by()
+        .annotate(dia=TruncDate('fecha_pago'))
+        .values('dia', 'metodo')
+        .annotate(cantidad=Count('id'), monto=Sum('monto_pagado'))
+    )
+    ResumenPagosDia.objects.bulk_create(
+        [ResumenPagosDia(fecha=f['dia'], metodo=f['metodo'], cantidad=f['cantidad'], monto=f['monto']) for f in filas],
+        batch_size=1000,
+    )
+    invalidar_tablero()
+
+
+# ---------------------------------------------------------
+# LECTURA PARA EL TABLERO
+# ---------------------------------------------------------
+def _inicio_mes(fecha, meses_atras=0):
+    mes = fecha.year * 12 + fecha.month - 1 - meses_atras
+    return fecha.replace(year=mes // 12, month=mes % 12 + 1, day=1)
+
+
+def _calcular_tablero():
+    hoy = timezone.localdate()
+    desde = _inicio_mes(hoy, MESES_GRAFICO - 1)
+    meses = [_inicio_mes(hoy, n) for n in range(MESES_GRAFICO - 1, -1, -1)]
+
+    por_mes = dict.fromkeys(meses, 0)
+    por_servicio = {}
+    filas = (
+        ResumenCitasDia.objects.filter(fecha__gte=desde)
+        .exclude(estado__in=ESTADOS_EXCLUIDOS)
+        .values_list('fecha', 'servicio__titulo', 'cantidad')
+    )
+    for fecha, titulo, cantidad in filas:
+        por_mes[fecha.replace(day=1)] += cantidad
+        por_servicio[titulo] = por_servicio.get(titulo, 0) + cantidad
+
+    ranking = sorted(por_servicio.items(), key=lambda par: par[1], reverse=True)
+    tratamientos = ranking[:MAX_TRATAMIENTOS]
+    otros = sum(cantidad for _, cantidad in ranking[MAX_TRATAMIENTOS:])
+    if otros:
+        tratamientos.append(('Otros', otros))
+
+    ingresos = ResumenPagosDia.objects.filter(fecha=hoy).aggregate(total=Sum('monto'))['total'] or 0
+
+    return {
+        'pacientes_totales': User.objects.filter(is_staff=False).count(),
+        'citas_mes': por_mes[meses[-1]],
+        'ingresos_dia': f"{ingresos:.2f}",
+        'citas_por_mes': {
+            'labels': [MESES_ABREVIADOS[m.month - 1] for m in meses],
+            'data': [por_mes[m] for m in meses],
+        },
+        'tratamientos': {
+            'labels': [titulo for titulo, _ in tratamientos],
+            'data': [cantidad for _, cantidad in tratamientos],
+        },
+        'actualizado': timezone.now().isoformat(),
+    }
+
+
+def tablero():
+    """ Cifras del index del admin (cacheadas hasta que cambie algún resumen) """
+    datos = cache.get(CLAVE_TABLERO)
+    if datos is None:
+        datos = _calcular_tablero()
+        cache.set(CLAVE_TABLERO, datos, TIEMPO_TABLERO)
+    return datos
+
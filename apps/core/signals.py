@@ -0,0 +1,160 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import agenda, almacenamiento, busqueda, imagenes, inventario, paginas, pedidos, portal, resumenes
+from .models import (
+    Cita, Documento, Exportacion, FichaMedica, Insumo, MovimientoStock, Pago, PagoPedido, Paciente, Producto, Receta, Servicio,
+)
+
+# ---------------------------------------------------------
+# ÍNDICE DE DISPONIBILIDAD 📅
+# ---------------------------------------------------------
+@receiver(post_save, sender=Cita)
+def actualizar_agenda_al_guardar(sender, instance, **kwargs):
+    fechas = {instance.fecha, getattr(instance, '_fecha_original', None)}
+    agenda.recalcular_fechas(f for f in fechas if f is not None)
+    instance._fecha_original = instance.fecha
+
+@receiver(post_delete, sender=Cita)
+def actualizar_agenda_al_borrar(sender, instance, **kwargs):
+    agenda.recalcular_dia(instance.fecha)
+
+# ---------------------------------------------------------
+# CACHÉ DEL PORTAL Y DE LA HOME 🧑‍⚕️
+# ---------------------------------------------------------
+@receiver(post_save, sender=Cita)
+@receiver(post_delete, sender=Cita)
+def invalidar_portal_por_cita(sender, instance, **kwargs):
+    portal.invalidar_pacientes([instance.paciente_id, getattr(instance, '_paciente_original', None)])
+    instance._paciente_original = instance.paciente_id
+
+@receiver(post_save, sender=Receta)
+@receiver(post_delete, sender=Receta)
+def invalidar_portal_por_receta(sender, instance, **kwargs):
+    portal.invalidar_pacientes([instance.paciente_id])
+
+@receiver(post_save, sender=Documento)
+@receiver(post_delete, sender=Documento)
+def invalidar_portal_por_documento(sender, instance, **kwargs):
+    portal.invalidar_pacientes([instance.paciente_id])
+
+@receiver(post_save, sender=Servicio)
+@receiver(post_delete, sender=Servicio)
+def invalidar_catalogo_por_servicio(sender, instance, **kwargs):
+    portal.invalidar_catalogo()
+    paginas.nueva_version_catalogo() # home pública: nuevo ETag y re-render
+
+# ---------------------------------------------------------
+# RESÚMENES DEL TABLERO DEL ADMIN 📈
+# ---------------------------------------------------------
+@receiver(post_save, sender=Cita)
+def resumir_cita_guardada(sender, instance, **kwargs):
+    resumenes.cita_guardada(instance)
+
+@receiver(post_delete, sender=Cita)
+def resumir_cita_borrada(sender, instance, **kwargs):
+    resumenes.cita_borrada(instance)
+
+@receiver(post_save, sender=Pago)
+def resumir_pago_guardado(sender, instance, **kwargs):
+    resumenes.pago_guardado(instance)
+
+@receiver(post_delete, sender=Pago)
+def resumir_pago_borrado(sender, instance, **kwargs):
+    resumenes.pago_borrado(instance)
+
+# ---------------------------------------------------------
+# KARDEX DE INSUMOS 📋
+# ---------------------------------------------------------
+@receiver(post_save, sender=Insumo)
+def registrar_stock_inicial(sender, instance, created, **kwargs):
+    # El stock con el que se da de alta el insumo es su primer movimiento:
+    # así la suma del kardex siempre coincide con Insumo.cantidad
+    if created and instance.cantidad > 0:
+        MovimientoStock.objects.create(
+            insumo=instance, tipo=MovimientoStock.ENTRADA, cantidad=instance.cantidad,
+            stock_resultante=instance.cantidad, motivo=inventario.MOTIVO_STOCK_INICIAL,
+        )
+
+@receiver(post_save, sender=Cita)
+def descontar_materiales_al_finalizar(sender, instance, **kwargs):
+    # Las acciones masivas del admin (update) llaman a descontar_materiales por su cuenta
+    if instance.estado == 'finalizada' and not instance.materiales_descontados:
+        inventario.descontar_materiales([instance.pk])
+        instance.materiales_descontados = True
+
+# ---------------------------------------------------------
+# TIENDA 🧾
+# ---------------------------------------------------------
+@receiver(post_save, sender=PagoPedido)
+def confirmar_pedido_pagado(sender, instance, **kwargs):
+    pedidos.pago_registrado(instance)
+
+# ---------------------------------------------------------
+# VERSIONES REDUCIDAS DE LAS FOTOS 🖼️
+# ---------------------------------------------------------
+PRESETS_IMAGEN = {Servicio: ['servicio'], Producto: ['producto', 'miniatura']}
+
+@receiver(post_save, sender=Servicio)
+@receiver(post_save, sender=Producto)
+def generar_versiones_imagen(sender, instance, **kwargs):
+    imagenes.preparar(instance.imagen, PRESETS_IMAGEN[sender])
+
+@receiver(post_delete, sender=Servicio)
+@receiver(post_delete, sender=Producto)
+def borrar_versiones_imagen(sender, instance, **kwargs):
+    if instance.imagen:
+        imagenes.borrar(instance.imagen.name)
+
+# ---------------------------------------------------------
+# EXPORTACIONES 📤
+# ---------------------------------------------------------
+@receiver(post_delete, sender=Exportacion)
+def borrar_archivo_exportacion(sender, instance, **kwargs):
+    if instance.archivo:
+        instance.archivo.delete(save=False)
+
+# ---------------------------------------------------------
+# REFERENCIAS DEL ALMACÉN DEDUPLICADO 🗄️
+# ---------------------------------------------------------
+@receiver(post_save, sender=Documento)
+def contar_referencia_documento(sender, instance, **kwargs):
+    actual = instance.archivo.name or ''
+    almacenamiento.cambiar_referencias(getattr(instance, '_archivo_original', ''), actual)
+    instance._archivo_original = actual
+
+@receiver(post_delete, sender=Documento)
+def descontar_referencia_documento(sender, instance, **kwargs):
+    almacenamiento.cambiar_referencias(getattr(instance, '_archivo_original', instance.archivo.name or ''), '')
+
+# ---------------------------------------------------------
+# ÍNDICE DE BÚSQUEDA DEL ADMIN 🔎
+# ---------------------------------------------------------
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Paciente)
+def indexar_paciente(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return  # cada login guarda el usuario: nada que reindexar
+    busqueda.actualizar_pacientes([instance.pk])
+    if not created:
+        # El nombre del paciente también se busca en sus recetas
+        busqueda.actualizar_recetas(Receta.objects.filter(paciente_id=instance.pk).values('pk'))
+
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Paciente)
+def quitar_paciente_del_indice(sender, instance, **kwargs):
+    busqueda.quitar('paciente', [instance.pk])
+
+@receiver(post_save, sender=FichaMedica)
+@receiver(post_delete, sender=FichaMedica)
+def indexar_ficha_medica(sender, instance, **kwargs):
+    busqueda.actualizar_pacientes([instance.paciente_id])
+
+@receiver(post_save, sender=Receta)
+def indexar_receta(sender, instance, **kwargs):
+    busqueda.actualizar_recetas([instance.pk])
+
+@receiver(post_delete, sender=Receta)
+def quitar_receta_del_indice(sender, instance, **kwargs):
+    busqueda.quitar('receta', [instance.pk])
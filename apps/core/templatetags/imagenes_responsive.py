@@ -0,0 +1,11 @@
+from django import template
+
+from apps.core import imagenes
+
+register = template.Library()
+
+
+@register.simple_tag
+def imagen_responsive(archivo, preset, alt='', clase=''):
+    """ {% imagen_responsive servicio.imagen 'servicio' alt=servicio.titulo clase='w-full h-full' %} """
+    return imagenes.picture(archivo, preset, alt=alt, clase=clase)
@@ -1,3 +1,1593 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
+from datetime import date, datetime, time, timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.contrib.admin import helpers
+from django.contrib.auth.models import Permission, User
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile, TemporaryUploadedFile
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.mail.backends.locmem import EmailBackend as BackendEnMemoria
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Sum
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import agenda, almacenamiento, analitica, busqueda, caja, chatbot, correo, exportacion, imagenes, inventario, paginacion, paginas, pedidos, portal, recetas_pdf, recordatorios, resumenes, views
+from .admin import CitaAdmin
+from .middleware import WhiteNoiseAsincrono
+from .models import (
+    ArchivoDeduplicado, Cita, CorreoPendiente, Documento, FichaMedica, Exportacion, Insumo, ItemPedido, MaterialServicio, MovimientoStock, Pago, PagoPedido, Pedido, Producto,
+    Receta, Recordatorio, ResumenCitasDia, ResumenPagosDia, Servicio,
+)
+
+# Un lunes dentro del horario de atención
+FECHA_PRUEBA = date(2030, 1, 7)
+
+
+def crear_servicio():
+    return Servicio.objects.create(titulo="Profilaxis", descripcion="Limpieza", imagen="servicios/x.jpg", precio_estimado=50)
+
+
+# ---------------------------------------------------------
+# RESERVA DE TURNOS BAJO CONCURRENCIA
+# ---------------------------------------------------------
+class ReservaConcurrenteTests(TransactionTestCase):
+    HILOS = 40
+
+    def setUp(self):
+        self.servicio = crear_servicio()
+        self.pacientes = [
+            User.objects.create(username=f"paciente{i}") for i in range(self.HILOS)
+        ]
+
+    def _reservar_en_paralelo(self, horas):
+        barrera = threading.Barrier(len(self.pacientes))
+        resultados = []
+
+        def reservar(paciente, hora):
+            try:
+                barrera.wait()
+                agenda.reservar_cita(paciente, self.servicio, FECHA_PRUEBA, hora)
+                resultados.append('ok')
+            except agenda.TurnoOcupado:
+                resultados.append('ocupado')
+            finally:
+                connection.close()
+
+        hilos = [
+            threading.Thread(target=reservar, args=(paciente, horas[i % len(horas)]))
+            for i, paciente in enumerate(self.pacientes)
+        ]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        return resultados
+
+    def test_mismo_turno_una_sola_cita(self):
+        resultados = self._reservar_en_paralelo([time(10, 0)])
+
+        self.assertEqual(len(resultados), self.HILOS)
+        self.assertEqual(resultados.count('ok'), 1)
+        self.assertEqual(Cita.objects.filter(fecha=FECHA_PRUEBA).count(), 1)
+
+    def test_varios_turnos_sin_dobles_reservas(self):
+        horas = [time(9, 0), time(9, 10), time(11, 30), time(15, 0)]
+        resultados = self._reservar_en_paralelo(horas)
+
+        # 9:00 y 9:10 caen en el mismo turno de 30 minutos
+        self.assertEqual(len(resultados), self.HILOS)
+        self.assertEqual(resultados.count('ok'), 3)
+        self.assertEqual(Cita.objects.filter(fecha=FECHA_PRUEBA).count(), 3)
+        mapa = agenda.mapa_del_dia(FECHA_PRUEBA)
+        esperado = agenda.calcular_mapa(FECHA_PRUEBA, Cita.objects.values_list('hora', flat=True))
+        self.assertEqual(mapa, esperado)
+
+    def test_recalcular_el_dia_no_pierde_reservas_en_curso(self):
+        # La mitad de los hilos reserva turnos distintos y la otra mitad recalcula el día
+        # (lo que hace el admin al guardar otra cita de esa fecha)
+        turnos = agenda.turnos_del_dia(FECHA_PRUEBA)
+        barrera = threading.Barrier(len(self.pacientes))
+
+        def trabajar(i, paciente):
+            try:
+                barrera.wait()
+                if i % 2:
+                    agenda.recalcular_dia(FECHA_PRUEBA)
+                else:
+                    agenda.reservar_cita(paciente, self.servicio, FECHA_PRUEBA, turnos[i // 2])
+            finally:
+                connection.close()
+
+        hilos = [threading.Thread(target=trabajar, args=(i, p)) for i, p in enumerate(self.pacientes)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        self.assertEqual(Cita.objects.filter(fecha=FECHA_PRUEBA).count(), self.HILOS // 2)
+        esperado = agenda.calcular_mapa(FECHA_PRUEBA, Cita.objects.values_list('hora', flat=True))
+        self.assertEqual(agenda.mapa_del_dia(FECHA_PRUEBA), esperado)
+
+
+class RestriccionTurnoTests(TestCase):
+    def setUp(self):
+        self.servicio = crear_servicio()
+        self.paciente = User.objects.create_user(username="ana", password="x", first_name="Ana")
+
+    def test_base_de_datos_rechaza_duplicado(self):
+        datos = dict(paciente=self.paciente, servicio=self.servicio, fecha=FECHA_PRUEBA, hora=time(10, 0))
+        Cita.objects.bulk_create([Cita(**datos)])
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Cita.objects.bulk_create([Cita(**datos)])
+
+    def test_base_de_datos_rechaza_otra_hora_del_mismo_turno(self):
+        datos = dict(paciente=self.paciente, servicio=self.servicio, fecha=FECHA_PRUEBA)
+        primera, = Cita.objects.bulk_create([Cita(hora=time(9, 15), **datos)])
+        self.assertEqual(primera.turno, time(9, 0))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Cita.objects.bulk_create([Cita(hora=time(9, 0), **datos)])
+        # Fuera de horario el turno es la propia hora
+        fuera, = Cita.objects.bulk_create([Cita(hora=time(7, 10), **datos)])
+        self.assertEqual(fuera.turno, time(7, 10))
+
+    def test_cita_cancelada_libera_el_turno(self):
+        datos = dict(paciente=self.paciente, servicio=self.servicio, fecha=FECHA_PRUEBA, hora=time(10, 0))
+        Cita.objects.bulk_create([Cita(estado='cancelada', **datos)])
+        Cita.objects.bulk_create([Cita(**datos)])
+        self.assertEqual(Cita.objects.count(), 2)
+
+    def test_crear_cita_turno_ocupado_muestra_error(self):
+        agenda.reservar_cita(self.paciente, self.servicio, FECHA_PRUEBA, time(10, 0))
+        self.client.force_login(self.paciente)
+
+        response = self.client.post('/crear-cita/', {
+            'servicio': self.servicio.id, 'fecha': '2030-01-07', 'hora': '10:15',
+        }, follow=True)
+
+        self.assertEqual(Cita.objects.count(), 1)
+        mensajes = [str(m) for m in response.context['messages']]
+        self.assertTrue(any('ya fue reservado' in m for m in mensajes))
+
+
+class DisponibilidadTests(TestCase):
+    def setUp(self):
+        self.servicio = crear_servicio()
+        self.paciente = User.objects.create_user(username="ana", password="x", first_name="Ana")
+        self.cita = agenda.reservar_cita(self.paciente, self.servicio, FECHA_PRUEBA, time(10, 0))
+        agenda.reservar_cita(self.paciente, self.servicio, FECHA_PRUEBA, time(11, 0), estado='cancelada')
+
+    def test_endpoint_lista_los_turnos_libres_con_una_consulta(self):
+        domingo = FECHA_PRUEBA + timedelta(days=6)
+        with self.assertNumQueries(1):
+            respuesta = self.client.get(reverse('disponibilidad'), {'desde': FECHA_PRUEBA.isoformat(), 'hasta': domingo.isoformat()})
+        datos = respuesta.json()
+        self.assertEqual(datos['duracion_minutos'], 30)
+        self.assertEqual(len(datos['dias']), 7)
+
+        lunes = datos['dias'][0]
+        self.assertEqual(lunes['fecha'], FECHA_PRUEBA.isoformat())
+        self.assertEqual(len(lunes['libres']), 21)  # 09:00-20:00 en turnos de 30 min, menos las 10:00
+        self.assertNotIn('10:00', lunes['libres'])
+        self.assertIn('11:00', lunes['libres'])  # la cancelada no ocupa el turno
+        self.assertEqual(datos['dias'][-1]['libres'], [])  # domingo cerrado
+
+        self.assertEqual(self.client.get(reverse('disponibilidad'), {'desde': 'mañana'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('disponibilidad'), {
+            'desde': domingo.isoformat(), 'hasta': FECHA_PRUEBA.isoformat(),
+        }).status_code, 400)
+
+    def test_clean_consulta_el_indice_del_dia(self):
+        mismo_turno = Cita(paciente=self.paciente, servicio=self.servicio, fecha=FECHA_PRUEBA, hora=time(10, 15))
+        with self.assertNumQueries(1), self.assertRaises(ValidationError):
+            mismo_turno.clean()
+        with self.assertNumQueries(1):
+            Cita(paciente=self.paciente, servicio=self.servicio, fecha=FECHA_PRUEBA, hora=time(11, 0)).clean()
+
+        # Editar la propia cita no choca consigo misma; al cancelarla el turno se libera
+        self.cita.clean()
+        self.cita.estado = 'cancelada'
+        self.cita.save()
+        self.assertFalse(agenda.turno_ocupado(FECHA_PRUEBA, time(10, 0)))
+        mismo_turno.clean()
+
+
+class InicioCitaTests(TestCase):
+    def setUp(self):
+        self.servicio = crear_servicio()
+        self.paciente = User.objects.create_user(username="ana", password="x", first_name="Ana")
+
+    def crear(self, fecha, hora):
+        return Cita.objects.create(paciente=self.paciente, servicio=self.servicio, fecha=fecha, hora=hora)
+
+    def inicios(self):
+        return {pk: timezone.localtime(inicio) for pk, inicio in Cita.objects.values_list('pk', 'inicio')}
+
+    def test_inicio_se_mantiene_en_save_y_en_operaciones_masivas(self):
+        cita = self.crear(FECHA_PRUEBA, time(10, 0))
+        self.assertEqual(timezone.localtime(cita.inicio), timezone.make_aware(datetime(2030, 1, 7, 10, 0)))
+        cita.hora = time(12, 30)
+        cita.save()
+        self.assertEqual(self.inicios()[cita.pk].time(), time(12, 30))
+
+        masiva, = Cita.objects.bulk_create([
+            Cita(paciente=self.paciente, servicio=self.servicio, fecha=FECHA_PRUEBA, hora=time(15, 0)),
+        ])
+        Cita.objects.filter(pk=cita.pk).update(fecha=F('fecha') + timedelta(days=1))
+        masiva.hora = time(16, 0)
+        Cita.objects.bulk_update([masiva], ['hora'])
+
+        inicios = self.inicios()
+        self.assertEqual(inicios[cita.pk], timezone.make_aware(datetime(2030, 1, 8, 12, 30)))
+        self.assertEqual(inicios[masiva.pk], timezone.make_aware(datetime(2030, 1, 7, 16, 0)))
+
+    def test_rangos_por_inicio(self):
+        lunes = self.crear(FECHA_PRUEBA, time(10, 0))
+        jueves = self.crear(FECHA_PRUEBA + timedelta(days=3), time(19, 30))
+        siguiente = self.crear(FECHA_PRUEBA + timedelta(days=8), time(9, 0))
+        fin_de_anio = self.crear(date(2030, 12, 31), time(19, 30))
+
+        def pks(consulta):
+            return set(consulta.values_list('pk', flat=True))
+
+        self.assertEqual(
+            pks(Cita.objects.entre(timezone.make_aware(datetime(2030, 1, 7, 10, 0)), timezone.make_aware(datetime(2030, 1, 10, 19, 30)))),
+            {lunes.pk},
+        )
+        with mock.patch('django.utils.timezone.now', return_value=timezone.make_aware(datetime(2030, 1, 7, 9, 0))):
+            self.assertEqual(pks(Cita.objects.proximos_dias(7)), {lunes.pk, jueves.pk})
+        self.assertEqual(pks(Cita.objects.del_mes(2030, 1)), {lunes.pk, jueves.pk, siguiente.pk})
+        self.assertEqual(pks(Cita.objects.del_mes(2030, 12)), {fin_de_anio.pk})
+        self.assertIn('inicio', str(Cita.objects.del_mes(2030, 1).query))
+
+
+# ---------------------------------------------------------
+# BANDEJA DE SALIDA DE CORREOS
+# ---------------------------------------------------------
+class BackendQueFalla(BaseEmailBackend):
+    def send_messages(self, email_messages):
+        raise ConnectionError("SMTP no disponible")
+
+
+class BackendQueSeInterrumpe(BackendEnMemoria):
+    """ Entrega los primeros `cupo` mensajes y luego el proceso muere a mitad del lote """
+    cupo = 0
+
+    def send_messages(self, email_messages):
+        if BackendQueSeInterrumpe.cupo < len(email_messages):
+            raise KeyboardInterrupt
+        BackendQueSeInterrumpe.cupo -= len(email_messages)
+        return super().send_messages(email_messages)
+
+
+class BandejaCorreosTests(TestCase):
+    def setUp(self):
+        self.servicio = crear_servicio()
+        self.paciente = User.objects.create_user(username="luis", password="x", first_name="Luis", email="luis@correo.com")
+
+    def test_crear_cita_encola_sin_enviar(self):
+        self.client.force_login(self.paciente)
+        self.client.post('/crear-cita/', {'servicio': self.servicio.id, 'fecha': '2030-01-07', 'hora': '10:00'})
+
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(CorreoPendiente.objects.filter(estado=CorreoPendiente.PENDIENTE).count(), 1)
+
+        self.assertEqual(correo.despachar_pendientes(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ["luis@correo.com"])
+        self.assertEqual(CorreoPendiente.objects.get().estado, CorreoPendiente.ENVIADO)
+
+    @override_settings(EMAIL_BACKEND='apps.core.tests.BackendQueFalla', CORREO_MAX_INTENTOS=2)
+    def test_reintento_con_espera_y_descarte(self):
+        pendiente = correo.encolar_correo("Prueba", ["luis@correo.com"], texto="hola")
+
+        self.assertEqual(correo.despachar_pendientes(), (0, 1))
+        pendiente.refresh_from_db()
+        self.assertEqual(pendiente.estado, CorreoPendiente.PENDIENTE)
+        self.assertEqual(pendiente.intentos, 1)
+        self.assertGreater(pendiente.proximo_intento, timezone.now())
+        self.assertIn("SMTP no disponible", pendiente.ultimo_error)
+
+        # Aún no vence la espera: no se vuelve a intentar
+        self.assertEqual(correo.despachar_pendientes(), (0, 0))
+
+        CorreoPendiente.objects.update(proximo_intento=timezone.now())
+        correo.despachar_pendientes()
+        pendiente.refresh_from_db()
+        self.assertEqual(pendiente.estado, CorreoPendiente.FALLIDO)
+
+    @mock.patch.object(BackendQueSeInterrumpe, 'cupo', 2)
+    def test_caida_a_mitad_del_lote_no_reenvia(self):
+        for i in range(3):
+            correo.encolar_correo("Prueba", [f"p{i}@correo.pe"], texto="hola")
+
+        with override_settings(EMAIL_BACKEND='apps.core.tests.BackendQueSeInterrumpe'), self.assertRaises(KeyboardInterrupt):
+            correo.despachar_lote()
+        self.assertEqual(CorreoPendiente.objects.filter(estado=CorreoPendiente.ENVIADO).count(), 2)
+
+        # Vence la reserva del lote interrumpido: solo queda el que no salió
+        CorreoPendiente.objects.filter(estado=CorreoPendiente.PENDIENTE).update(proximo_intento=timezone.now())
+        self.assertEqual(correo.despachar_pendientes(), (1, 0))
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), ["p0@correo.pe", "p1@correo.pe", "p2@correo.pe"])
+        self.assertEqual(set(CorreoPendiente.objects.values_list('estado', 'intentos')), {(CorreoPendiente.ENVIADO, 1)})
+
+
+# ---------------------------------------------------------
+# RECORDATORIOS DE CITAS
+# ---------------------------------------------------------
+class BackendQueSeCae(BackendEnMemoria):
+    """ Entrega los primeros `cupo` mensajes y luego falla (SMTP que se cae a mitad de un lote) """
+    cupo = 0
+
+    def send_messages(self, email_messages):
+        if BackendQueSeCae.cupo < len(email_messages):
+            raise ConnectionError("SMTP no disponible")
+        BackendQueSeCae.cupo -= len(email_messages)
+        return super().send_messages(email_messages)
+
+
+class RecordatoriosTests(TestCase):
+    # Domingo 19:00, víspera de FECHA_PRUEBA
+    AHORA = timezone.make_aware(datetime.combine(FECHA_PRUEBA - timedelta(days=1), time(19, 0)))
+
+    def setUp(self):
+        self.servicio = crear_servicio()
+
+    def cita(self, fecha, hora, email="eva@correo.pe", **datos):
+        paciente = User.objects.create_user(username=f"p{User.objects.count()}", first_name="Eva", email=email)
+        return Cita.objects.create(paciente=paciente, servicio=self.servicio, fecha=fecha, hora=hora, **datos)
+
+    def test_ventanas_de_cada_tipo(self):
+        manana = self.cita(FECHA_PRUEBA, time(9, 0))
+        self.cita(FECHA_PRUEBA + timedelta(days=1), time(9, 0))
+        self.cita(FECHA_PRUEBA, time(10, 0), estado='cancelada')
+        self.cita(FECHA_PRUEBA, time(11, 0), email='')
+        esta_noche = self.cita(FECHA_PRUEBA - timedelta(days=1), time(20, 30))
+        self.cita(FECHA_PRUEBA - timedelta(days=1), time(21, 30))  # fuera de las 2 horas
+
+        def pendientes(tipo):
+            return [fila[0] for fila in recordatorios.citas_por_recordar(tipo, self.AHORA)]
+
+        self.assertEqual(pendientes(Recordatorio.DIA_ANTERIOR), [manana.pk])
+        self.assertEqual(pendientes(Recordatorio.PROXIMAS_HORAS), [esta_noche.pk])
+        Recordatorio.objects.create(cita=manana, tipo=Recordatorio.DIA_ANTERIOR)
+        self.assertEqual(pendientes(Recordatorio.DIA_ANTERIOR), [])
+
+    @mock.patch.object(BackendQueSeCae, 'cupo', 2)
+    def test_repetir_tras_falla_parcial_no_duplica(self):
+        citas = [self.cita(FECHA_PRUEBA, time(9 + i, 0), email=f"p{i}@correo.pe") for i in range(3)]
+
+        with override_settings(EMAIL_BACKEND='apps.core.tests.BackendQueSeCae'), self.assertLogs('apps.core.recordatorios', 'WARNING'):
+            self.assertEqual(recordatorios.enviar_recordatorios(Recordatorio.DIA_ANTERIOR, ahora=self.AHORA), (2, 1))
+        self.assertEqual(set(Recordatorio.objects.values_list('cita_id', flat=True)), {citas[0].pk, citas[1].pk})
+
+        self.assertEqual(recordatorios.enviar_recordatorios(Recordatorio.DIA_ANTERIOR, ahora=self.AHORA), (1, 0))
+        self.assertEqual(recordatorios.enviar_recordatorios(Recordatorio.DIA_ANTERIOR, ahora=self.AHORA), (0, 0))
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), ["p0@correo.pe", "p1@correo.pe", "p2@correo.pe"])
+        self.assertIn("Eva", mail.outbox[0].body)
+
+
+# ---------------------------------------------------------
+# CACHÉ DEL PORTAL DEL PACIENTE
+# ---------------------------------------------------------
+class PortalCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.servicio = crear_servicio()
+        self.paciente = User.objects.create_user(username="rosa", password="x", first_name="Rosa")
+        self.cita = agenda.reservar_cita(self.paciente, self.servicio, FECHA_PRUEBA, time(10, 0))
+
+    def test_segunda_carga_no_consulta_la_base(self):
+        portal.datos_portal(self.paciente.pk)
+        with self.assertNumQueries(0):
+            datos = portal.datos_portal(self.paciente.pk)
+            self.assertEqual(datos['citas'][0].servicio.titulo, "Profilaxis")
+
+    def test_invalidacion_por_senales_y_acciones_masivas(self):
+        portal.datos_portal(self.paciente.pk)
+
+        self.servicio.titulo = "Limpieza profunda"
+        self.servicio.save()
+        self.assertEqual(portal.datos_portal(self.paciente.pk)['citas'][0].servicio.titulo, "Limpieza profunda")
+
+        CitaAdmin(Cita, None).marcar_como_cancelada(None, Cita.objects.all())
+        self.assertEqual(portal.datos_portal(self.paciente.pk)['citas'][0].estado, 'cancelada')
+
+
+# ---------------------------------------------------------
+# CACHÉ DE LA HOME PÚBLICA
+# ---------------------------------------------------------
+class PaginaPublicaCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.servicio = crear_servicio()
+        self.url = reverse('home')
+
+    def test_304_y_nuevo_etag_al_editar_un_servicio(self):
+        respuesta = self.client.get(self.url)
+        etag = respuesta['ETag']
+        self.assertContains(respuesta, "Profilaxis")
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            self.assertEqual(self.client.get(self.url)['ETag'], etag)
+
+        self.servicio.titulo = "Blanqueamiento"
+        self.servicio.save()
+        respuesta = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertNotEqual(respuesta['ETag'], etag)
+        self.assertContains(respuesta, "Blanqueamiento")
+
+    @mock.patch.object(paginas, 'brotli', None)
+    def test_gzip_solo_si_el_cliente_lo_acepta(self):
+        plano = self.client.get(self.url)
+        self.assertNotIn('Content-Encoding', plano)
+
+        comprimida = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(comprimida['Content-Encoding'], 'gzip')
+        self.assertEqual(int(comprimida['Content-Length']), len(comprimida.content))
+        self.assertEqual(gzip.decompress(comprimida.content), plano.content)
+        for respuesta in (plano, comprimida):
+            self.assertIn('Accept-Encoding', respuesta['Vary'])
+
+    def test_estampida_un_solo_worker_renderiza(self):
+        anterior = paginas._obtener_entrada('home', 1, lambda: b"<p>anterior</p>")
+        renderizar = mock.Mock(return_value=b"<p>nueva</p>")
+
+        # Otro worker tiene el candado: se sirve la copia anterior sin renderizar
+        self.assertTrue(cache.add('pagina:home:candado', 1))
+        self.assertEqual(paginas._obtener_entrada('home', 2, renderizar), anterior)
+
+        # Sin copia previa se espera a la que deja el otro worker
+        cache.delete('pagina:home')
+        nueva = {'version': 2, 'variantes': {'identity': b"<p>nueva</p>"}}
+        with mock.patch.object(paginas.time, 'sleep', side_effect=lambda _: cache.set('pagina:home', nueva, None)):
+            self.assertEqual(paginas._obtener_entrada('home', 2, renderizar), nueva)
+        renderizar.assert_not_called()
+
+        # Libre el candado, renderiza uno solo y lo suelta
+        cache.delete('pagina:home:candado')
+        self.assertEqual(paginas._obtener_entrada('home', 3, renderizar)['variantes']['identity'], b"<p>nueva</p>")
+        self.assertEqual(paginas._obtener_entrada('home', 3, renderizar)['version'], 3)
+        renderizar.assert_called_once()
+        self.assertIsNone(cache.get('pagina:home:candado'))
+
+
+# ---------------------------------------------------------
+# CHATBOT (MOTOR DE INTENCIONES)
+# ---------------------------------------------------------
+class ChatbotTests(SimpleTestCase):
+    def test_intenciones_con_errores_de_tipeo(self):
+        casos = {
+            "¿Cuál es el HORARIO?": 'horario',
+            "horaio de atención": 'horario',
+            "hroa": 'horario',
+            "hoal": 'saludo',
+            "quiero reservar un trno": 'cita',
+            "presio de la limpieza": 'precio',
+            "ubicasion": 'ubicacion',
+            "iniciar sesoin": 'cuenta',
+        }
+        for mensaje, intencion in casos.items():
+            with self.subTest(mensaje=mensaje):
+                self.assertEqual(chatbot.detectar_intencion(mensaje), intencion)
+
+    def test_palabras_comunes_no_se_corrigen(self):
+        # "otra" comparte el borrado "ora" con "hora" pero está a distancia 2
+        for mensaje in ["tengo otra pregunta", "estoy sola", "todo bien", "luego", "es otra cosa"]:
+            with self.subTest(mensaje=mensaje):
+                self.assertIsNone(chatbot.detectar_intencion(mensaje))
+        self.assertEqual(chatbot.distancia("otra", "hora"), 2)
+        self.assertEqual(chatbot.distancia("hroa", "hora"), 1)
+
+
+# ---------------------------------------------------------
+# VISTAS ASÍNCRONAS (MODO ASGI)
+# ---------------------------------------------------------
+class VistasAsincronasTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.servicio = servicio = crear_servicio()
+        paciente = User.objects.create(username="lucia")
+        agenda.reservar_cita(paciente, servicio, FECHA_PRUEBA, time(10, 0))
+
+    async def test_chatbot_y_disponibilidad_por_asgi(self):
+        respuesta = await self.async_client.get(reverse('bot_respuesta'), {'msg': 'cuanto cuesta?'})
+        self.assertIn("Profilaxis (S/ 50", respuesta.json()['respuesta'])
+
+        respuesta = await self.async_client.get(
+            reverse('disponibilidad'), {'desde': FECHA_PRUEBA.isoformat(), 'hasta': FECHA_PRUEBA.isoformat()}
+        )
+        libres = respuesta.json()['dias'][0]['libres']
+        self.assertIn('09:00', libres)
+        self.assertNotIn('10:00', libres)
+
+    async def test_aturnos_libres_igual_que_la_version_sincrona(self):
+        desde, hasta = FECHA_PRUEBA, FECHA_PRUEBA + timedelta(days=6)
+        self.assertEqual(await agenda.aturnos_libres(desde, hasta), await sync_to_async(agenda.turnos_libres)(desde, hasta))
+
+        respuesta = await self.async_client.get(reverse('disponibilidad'), {'desde': 'ayer'})
+        self.assertEqual(respuesta.status_code, 400)
+
+    async def test_aresponder_lee_el_catalogo_en_cache_e_invalidado(self):
+        self.assertEqual(await chatbot.aresponder("asdfgh"), chatbot.RESPUESTA_POR_DEFECTO)
+        self.assertEqual(await chatbot.aresponder("hola"), await sync_to_async(chatbot.responder)("hola"))
+
+        self.assertIn("Profilaxis (S/ 50", await chatbot.aresponder("precio"))
+        with mock.patch.object(Servicio.objects, 'all', side_effect=AssertionError("sin caché")):
+            self.assertIn("Profilaxis (S/ 50", await chatbot.aresponder("precio"))
+
+        self.servicio.precio_estimado = 65
+        await sync_to_async(self.servicio.save)()
+        respuesta = await self.async_client.get(reverse('bot_respuesta'), {'msg': 'precio'})
+        self.assertIn("Profilaxis (S/ 65", respuesta.json()['respuesta'])
+
+    def test_vistas_y_middleware_asincronos(self):
+        self.assertTrue(iscoroutinefunction(views.bot_respuesta))
+        self.assertTrue(iscoroutinefunction(views.disponibilidad))
+
+        async def siguiente(request):
+            return None
+        self.assertTrue(iscoroutinefunction(WhiteNoiseAsincrono(siguiente)))
+        self.assertFalse(iscoroutinefunction(WhiteNoiseAsincrono(lambda request: None)))
+
+
+# ---------------------------------------------------------
+# CACHÉ DE PDFs DE RECETAS
+# ---------------------------------------------------------
+class RecetaPdfTests(TestCase):
+    def setUp(self):
+        self.directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directorio.cleanup)
+        ajustes = override_settings(RECETAS_PDF_DIR=self.directorio.name)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+        self.paciente = User.objects.create_user(username="ana", password="x", first_name="Ana")
+        self.receta = Receta.objects.create(paciente=self.paciente, diagnostico="Caries", medicamentos="Ibuprofeno 400mg")
+        self.client.force_login(self.paciente)
+        self.url = reverse('descargar_receta', args=[self.receta.id])
+
+    def test_descarga_cacheada_con_etag_y_nueva_version_al_editar(self):
+        respuesta = self.client.get(self.url)
+        etag = respuesta['ETag']
+        contenido = b''.join(respuesta.streaming_content)
+        self.assertTrue(contenido.startswith(b'%PDF'))
+        self.assertEqual(int(respuesta['Content-Length']), len(contenido))
+
+        with mock.patch.object(recetas_pdf, 'renderizar_recetas') as renderizar:
+            self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            self.assertEqual(self.client.get(self.url)['ETag'], etag)
+            renderizar.assert_not_called()
+
+        self.receta.medicamentos = "Paracetamol 500mg"
+        self.receta.save()
+        self.assertNotEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)['ETag'], etag)
+
+    def generar(self):
+        archivo, clave = recetas_pdf.pdf_receta(self.receta)
+        archivo.close()
+        return recetas_pdf.ruta_en_cache(clave)
+
+    def test_desalojo_lru(self):
+        antigua = self.generar()
+        os.utime(antigua, (0, 0))
+        self.receta.diagnostico = "Gingivitis"
+        reciente = self.generar()
+
+        recetas_pdf.desalojar(max_bytes=os.path.getsize(antigua) + os.path.getsize(reciente) - 1)
+        self.assertFalse(os.path.exists(antigua))
+        self.assertTrue(os.path.exists(reciente))
+
+    def test_solo_se_recorre_la_carpeta_al_pasar_del_maximo(self):
+        cache.delete(recetas_pdf.CLAVE_TOTAL_BYTES)
+        with mock.patch.object(recetas_pdf.os, 'walk', wraps=os.walk) as recorrer:
+            ruta = self.generar()  # sin contador: se mide la carpeta una vez
+            self.assertEqual(recorrer.call_count, 1)
+            self.assertEqual(cache.get(recetas_pdf.CLAVE_TOTAL_BYTES), os.path.getsize(ruta))
+
+            for diagnostico in ("Gingivitis", "Sarro", "Control"):
+                self.receta.diagnostico = diagnostico
+                self.generar()
+            self.assertEqual(recorrer.call_count, 1)
+
+            with override_settings(RECETAS_PDF_MAX_MB=os.path.getsize(ruta) * 3.5 / 1024 / 1024):
+                self.receta.diagnostico = "Extracción"
+                self.generar()
+            self.assertEqual(recorrer.call_count, 2)
+        self.assertFalse(os.path.exists(ruta))
+
+    def test_pdf_desalojado_mientras_se_descarga(self):
+        ruta = self.generar()
+        abrir = open
+
+        def abrir_y_desalojar(nombre, *args, **kwargs):
+            archivo = abrir(nombre, *args, **kwargs)
+            if nombre == ruta:
+                os.unlink(ruta)  # otro worker lo desaloja justo después de encontrarlo
+            return archivo
+
+        with mock.patch('builtins.open', abrir_y_desalojar):
+            respuesta = self.client.get(self.url)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertTrue(b''.join(respuesta.streaming_content).startswith(b'%PDF'))
+
+        # Ya borrado antes de abrirlo: se vuelve a generar
+        self.assertFalse(os.path.exists(ruta))
+        respuesta = self.client.get(self.url)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertTrue(b''.join(respuesta.streaming_content).startswith(b'%PDF'))
+
+    @override_settings(RECETAS_PDF_PROCESOS=2)
+    def test_zip_por_paciente_en_paralelo(self):
+        otro = User.objects.create(username="beto", first_name="Beto", last_name="Paz")
+        Receta.objects.create(paciente=otro, diagnostico="Sarro", medicamentos="Enjuague")
+        Receta.objects.create(paciente=self.paciente, diagnostico="Control", medicamentos="Ninguno")
+
+        with mock.patch.object(recetas_pdf, 'RECETAS_POR_BLOQUE', 1), self.assertNumQueries(1):
+            contenido = b''.join(recetas_pdf.zip_recetas(Receta.objects.all()))
+
+        with zipfile.ZipFile(io.BytesIO(contenido)) as archivo_zip:
+            nombres = sorted(archivo_zip.namelist())
+            self.assertEqual(nombres, [f"ana_{self.paciente.pk}.pdf", f"paz-beto_{otro.pk}.pdf"])
+            self.assertTrue(all(archivo_zip.read(n).startswith(b'%PDF') for n in nombres))
+
+
+# ---------------------------------------------------------
+# EXPORTACIÓN DE CITAS
+# ---------------------------------------------------------
+class ExportacionTests(TestCase):
+    def setUp(self):
+        servicio = crear_servicio()
+        for i, hora in enumerate([time(9, 0), time(9, 30), time(10, 0)]):
+            paciente = User.objects.create(username=f"exp{i}", first_name=f"Paciente{i}", last_name="Ruiz")
+            cita = agenda.reservar_cita(paciente, servicio, FECHA_PRUEBA, hora)
+            if i == 0:
+                Pago.objects.create(cita=cita, monto_total=50, monto_pagado=20, metodo='efectivo')
+
+    def test_csv_y_xlsx_en_una_consulta(self):
+        with self.assertNumQueries(1):
+            contenido = b''.join(exportacion.generar_csv(exportacion.filas_citas(Cita.objects.order_by('hora'))))
+        filas = list(csv.reader(io.StringIO(contenido.decode('utf-8-sig'))))
+        self.assertEqual(filas[0], exportacion.COLUMNAS)
+        self.assertEqual(filas[1], ["Paciente0 Ruiz", "Profilaxis", "2030-01-07", "09:00:00", "Pendiente", "PARCIAL", "20.00"])
+        self.assertEqual(filas[2][5:], ["Sin pago", "0"])
+
+        with self.assertNumQueries(1):
+            contenido = b''.join(exportacion.generar_xlsx(exportacion.filas_citas(Cita.objects.all())))
+        with zipfile.ZipFile(io.BytesIO(contenido)) as libro:
+            hoja = libro.read('xl/worksheets/sheet1.xml').decode('utf-8')
+        self.assertEqual(hoja.count('<row>'), 4)
+        self.assertIn('<t>Paciente2 Ruiz</t>', hoja)
+
+    def exportar_desde_el_admin(self, consulta, **datos):
+        self.client.force_login(User.objects.get_or_create(username="admin", defaults={'is_staff': True, 'is_superuser': True})[0])
+        datos.update(action='exportar_en_segundo_plano', index=0)
+        respuesta = self.client.post(reverse('admin:core_cita_changelist') + consulta, datos)
+        self.assertEqual(respuesta.status_code, 302)
+        return Exportacion.objects.latest('pk')
+
+    def test_exportacion_en_segundo_plano(self):
+        Cita.objects.filter(hora=time(10, 0)).update(estado='cancelada')
+        with tempfile.TemporaryDirectory() as directorio, override_settings(EXPORTACIONES_DIR=directorio):
+            # "Seleccionar todas": se guardan los filtros del listado, no la consulta
+            trabajo = self.exportar_desde_el_admin('?estado__exact=pendiente', select_across='1', **{
+                helpers.ACTION_CHECKBOX_NAME: list(Cita.objects.filter(estado='pendiente').values_list('pk', flat=True)),
+            })
+            self.assertEqual(trabajo.criterio, {'filtros': {'estado__exact': ['pendiente']}, 'seleccion': None})
+            self.assertEqual(exportacion.procesar_pendientes(), 1)
+
+            trabajo.refresh_from_db()
+            self.assertEqual((trabajo.estado, trabajo.filas, trabajo.intentos), (Exportacion.LISTA, 2, 1))
+            with trabajo.archivo.open('rb') as archivo, zipfile.ZipFile(archivo) as libro:
+                self.assertEqual(libro.read('xl/worksheets/sheet1.xml').decode('utf-8').count('<row>'), 3)
+
+            # Solo las marcadas
+            marcada = Cita.objects.get(hora=time(9, 30))
+            seleccion = self.exportar_desde_el_admin('', **{helpers.ACTION_CHECKBOX_NAME: [marcada.pk]})
+            exportacion.procesar_pendientes()
+            seleccion.refresh_from_db()
+            self.assertEqual((seleccion.estado, seleccion.filas), (Exportacion.LISTA, 1))
+
+            for trabajo in Exportacion.objects.all():
+                trabajo.delete()
+            self.assertEqual(os.listdir(os.path.join(directorio, 'citas')), [])
+
+    def test_worker_caido_se_retoma(self):
+        hace_rato = timezone.now() - exportacion.LATIDO_VENCIDO - timedelta(minutes=1)
+        criterio = {'filtros': {}, 'seleccion': None}
+        admin_ = User.objects.create_superuser(username="admin", password="x")
+        huerfana = Exportacion.objects.create(formato='csv', criterio=criterio, solicitado_por=admin_, estado=Exportacion.PROCESANDO, latido=hace_rato, intentos=1)
+        viva = Exportacion.objects.create(formato='csv', criterio=criterio, solicitado_por=admin_, estado=Exportacion.PROCESANDO, latido=timezone.now(), intentos=1)
+        agotada = Exportacion.objects.create(formato='csv', criterio=criterio, solicitado_por=admin_, estado=Exportacion.PROCESANDO, latido=hace_rato, intentos=exportacion.MAX_INTENTOS)
+
+        with tempfile.TemporaryDirectory() as directorio, override_settings(EXPORTACIONES_DIR=directorio):
+            self.assertEqual(exportacion.procesar_pendientes(), 1)
+            huerfana.refresh_from_db()
+            self.assertEqual((huerfana.estado, huerfana.filas, huerfana.intentos), (Exportacion.LISTA, 3, 2))
+            huerfana.delete()
+        viva.refresh_from_db()
+        agotada.refresh_from_db()
+        self.assertEqual(viva.estado, Exportacion.PROCESANDO)
+        self.assertEqual(agotada.estado, Exportacion.FALLIDA)
+
+
+# ---------------------------------------------------------
+# LISTADO DE CITAS EN EL ADMIN
+# ---------------------------------------------------------
+class CitaAdminConsultasTests(TestCase):
+    def setUp(self):
+        self.servicio = crear_servicio()
+        self.client.force_login(User.objects.create_superuser(username="admin", password="x"))
+
+    def _crear_citas(self, cantidad):
+        inicio = Cita.objects.count()
+        for i in range(inicio, inicio + cantidad):
+            paciente = User.objects.create(username=f"p{i}", first_name="Eva", last_name=f"Soto{i}")
+            cita = Cita.objects.create(paciente=paciente, servicio=self.servicio, fecha=date(2030, 2, 1 + i % 28), hora=time(9 + i // 28, 0))
+            if i % 2:
+                Pago.objects.create(cita=cita, monto_total=50, monto_pagado=10 * (i % 6), metodo='efectivo')
+
+    def _consultas_del_listado(self):
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get(reverse('admin:core_cita_changelist'))
+        self.assertEqual(respuesta.status_code, 200)
+        return len(consultas), respuesta
+
+    def test_consultas_constantes_sin_importar_las_filas(self):
+        self._crear_citas(3)
+        pocas, _ = self._consultas_del_listado()
+        self._crear_citas(40)
+        muchas, respuesta = self._consultas_del_listado()
+
+        self.assertEqual(pocas, muchas)
+        self.assertLessEqual(muchas, 12)
+        self.assertContains(respuesta, "Eva Soto42")
+        self.assertContains(respuesta, "DEBE S/ 40.00")
+        self.assertContains(respuesta, "PAGADO")
+
+
+# ---------------------------------------------------------
+# TABLERO DEL ADMIN (RESÚMENES DIARIOS)
+# ---------------------------------------------------------
+class ResumenesTableroTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.servicio = crear_servicio()
+        self.hoy = timezone.localdate()
+
+    def _resumenes(self):
+        citas = set(ResumenCitasDia.objects.filter(cantidad__gt=0).values_list('fecha', 'servicio', 'estado', 'cantidad'))
+        pagos = set(ResumenPagosDia.objects.filter(cantidad__gt=0).values_list('fecha', 'metodo', 'cantidad', 'monto'))
+        return citas, pagos
+
+    def test_incremental_igual_a_recalcular_y_endpoint(self):
+        citas = []
+        for i in range(4):
+            paciente = User.objects.create(username=f"t{i}", first_name="Ana", last_name=f"Paz{i}")
+            citas.append(Cita.objects.create(paciente=paciente, servicio=self.servicio, fecha=self.hoy, hora=time(9 + i, 0)))
+        pago = Pago.objects.create(cita=citas[0], monto_total=50, monto_pagado=20, metodo='efectivo')
+        Pago.objects.create(cita=citas[1], monto_total=50, monto_pagado=50, metodo='yape_plin')
+
+        pago = Pago.objects.get(pk=pago.pk)
+        pago.monto_pagado = 35  # nuevo abono
+        pago.save()
+        cita = Cita.objects.get(pk=citas[2].pk)
+        cita.estado = 'cancelada'
+        cita.save()
+        citas[3].delete()
+        CitaAdmin(Cita, None)._actualizar_estado(Cita.objects.filter(pk=citas[1].pk), 'finalizada')
+
+        incremental = self._resumenes()
+        resumenes.recalcular_citas()
+        resumenes.recalcular_pagos()
+        self.assertEqual(incremental, self._resumenes())
+        self.assertIn((self.hoy, 'efectivo', 1, 35), incremental[1])
+
+        self.client.force_login(User.objects.create_superuser(username="admin", password="x"))
+        datos = self.client.get(reverse('tablero_admin')).json()
+        self.assertEqual(datos['pacientes_totales'], 4)
+        self.assertEqual(datos['citas_mes'], 2)  # la cancelada no cuenta
+        self.assertEqual(datos['ingresos_dia'], "85.00")
+        self.assertEqual(datos['citas_por_mes']['data'][-1], 2)
+        self.assertEqual(datos['tratamientos'], {'labels': ["Profilaxis"], 'data': [2]})
+
+        with self.assertNumQueries(0):
+            resumenes.tablero()  # cacheado
+
+    def test_resta_sin_fila_no_se_pierde(self):
+        cita = Cita.objects.create(paciente=User.objects.create(username="t0"), servicio=self.servicio, fecha=self.hoy, hora=time(9, 0))
+        ResumenCitasDia.objects.all().delete()  # resumen desfasado respecto de la tabla
+        cita.delete()
+        self.assertEqual(ResumenCitasDia.objects.get(fecha=self.hoy, estado='pendiente').cantidad, -1)
+
+        Cita.objects.create(paciente=User.objects.create(username="t1"), servicio=self.servicio, fecha=self.hoy, hora=time(9, 0))
+        self.assertEqual(ResumenCitasDia.objects.get(fecha=self.hoy, estado='pendiente').cantidad, 0)
+
+
+# ---------------------------------------------------------
+# CUENTAS POR COBRAR Y CIERRE DE CAJA
+# ---------------------------------------------------------
+class CajaTests(TestCase):
+    def setUp(self):
+        servicio = crear_servicio()
+        montos = [(50, 50, 'efectivo'), (80, 30, 'efectivo'), (60, 0, 'yape_plin'), (40, 10, 'tarjeta')]
+        self.pagos = []
+        for i, (total, pagado, metodo) in enumerate(montos):
+            paciente = User.objects.create(username=f"c{i}", first_name="Luis", last_name=f"Vega{i}")
+            cita = Cita.objects.create(paciente=paciente, servicio=servicio, fecha=FECHA_PRUEBA, hora=time(9 + i, 0))
+            self.pagos.append(Pago.objects.create(cita=cita, monto_total=total, monto_pagado=pagado, metodo=metodo))
+        # El de tarjeta se cobró hace 40 días: queda fuera del cierre del mes
+        Pago.objects.filter(pk=self.pagos[3].pk).update(fecha_pago=timezone.now() - timedelta(days=40))
+
+    def test_estado_en_sql_igual_que_en_python(self):
+        for estado, _ in caja.ESTADOS_PAGO:
+            en_sql = set(caja.filtrar_por_estado(Pago.objects.all(), estado).values_list('pk', flat=True))
+            en_python = {p.pk for p in Pago.objects.all() if p.estado_pago == estado}
+            self.assertEqual(en_sql, en_python)
+
+        with self.assertNumQueries(1):
+            cuentas = caja.cuentas_por_cobrar()
+        self.assertEqual((cuentas['por_cobrar'], cuentas['pacientes_con_deuda']), (140, 3))
+        self.assertEqual((cuentas['parciales'], cuentas['saldo_parciales']), (2, 80))
+        self.assertEqual((cuentas['pendientes'], cuentas['saldo_pendientes']), (1, 60))
+
+    def test_cierre_de_caja_en_una_consulta(self):
+        hoy = timezone.localdate()
+        with self.assertNumQueries(1):
+            cierre = caja.cierre_de_caja(hoy - timedelta(days=7), hoy)
+        self.assertEqual(cierre['totales']['pagos'], 3)
+        self.assertEqual(cierre['totales']['cobrado'], 80)
+        self.assertEqual([(m['metodo'], m['cobrado']) for m in cierre['por_metodo']], [('Efectivo', 80), ('Yape / Plin', 0)])
+
+        self.client.force_login(User.objects.create_superuser(username="admin", password="x"))
+        respuesta = self.client.get(reverse('admin:core_pago_cierre'), {'desde': hoy - timedelta(days=60), 'hasta': hoy})
+        self.assertContains(respuesta, "S/ 90.00")  # incluye el de tarjeta
+        self.assertContains(respuesta, "Luis Vega2")
+        respuesta = self.client.get(reverse('admin:core_pago_changelist'), {'estado_pago': caja.PARCIAL})
+        self.assertEqual({p.pk for p in respuesta.context['cl'].result_list}, {self.pagos[1].pk, self.pagos[3].pk})
+
+
+# ---------------------------------------------------------
+# ANALÍTICA (NUMPY)
+# ---------------------------------------------------------
+class AnaliticaTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        servicio = crear_servicio()
+        hoy = timezone.localdate()
+        citas = [
+            # (paciente, días atrás, hora, estado, abonado)
+            (1, 100, 9, 'finalizada', 50),
+            (1, 40, 10, 'finalizada', None),
+            (1, 0, 11, 'cancelada', None),
+            (2, 40, 11, 'finalizada', 30),
+            (3, 0, 12, 'cancelada', None),
+        ]
+        pacientes = {n: User.objects.create(username=f"an{n}") for n in (1, 2, 3)}
+        for paciente, atras, hora, estado, abonado in citas:
+            cita = Cita.objects.create(
+                paciente=pacientes[paciente], servicio=servicio, fecha=hoy - timedelta(days=atras), hora=time(hora, 0), estado=estado,
+            )
+            if abonado is not None:
+                Pago.objects.create(cita=cita, monto_total=50, monto_pagado=abonado, metodo='efectivo')
+
+    def test_reportes_vectorizados(self):
+        with self.assertNumQueries(1):
+            c = analitica.columnas()
+        self.assertEqual(len(c['paciente']), 5)
+        self.assertEqual(sorted(c['hora'].tolist()), [9, 10, 11, 11, 12])
+
+        cancelaciones = analitica.cancelaciones_por_servicio(c)
+        self.assertEqual((cancelaciones['total'].sum(), cancelaciones['canceladas'].sum()), (5, 2))
+
+        retorno = analitica.intervalos_de_retorno(c)
+        self.assertEqual((retorno['pacientes'], retorno['volvieron'], retorno['mediana']), (2, 1, 60))
+        self.assertIn(('1 a 3 meses', 1), retorno['tramos'])
+
+        cohortes = analitica.ingresos_por_cohorte(c)
+        self.assertEqual(cohortes['tamano'].sum(), 2)  # el paciente 3 solo canceló
+        self.assertEqual(cohortes['ingresos'].sum(), 80)
+
+        self.assertEqual(analitica.horas_pico(c)['citas'].sum(), 3)
+
+    def test_vista_del_admin(self):
+        self.client.force_login(User.objects.create_superuser(username="admin", password="x"))
+        respuesta = self.client.get(reverse('admin:core_cita_analitica'))
+        self.assertContains(respuesta, "Tasa de cancelación por servicio")
+        self.assertContains(respuesta, "<strong>1</strong> de 2 pacientes", html=False)
+
+
+# ---------------------------------------------------------
+# KARDEX E INVENTARIO
+# ---------------------------------------------------------
+class ConsumoConcurrenteTests(TransactionTestCase):
+    HILOS = 30
+
+    def test_sin_actualizaciones_perdidas_ni_stock_negativo(self):
+        insumo = Insumo.objects.create(nombre="Guantes", cantidad=20, stock_minimo=5)
+        barrera = threading.Barrier(self.HILOS)
+        resultados = []
+
+        def consumir():
+            try:
+                barrera.wait()
+                inventario.consumo(insumo.pk, 1, "Atención")
+                resultados.append('ok')
+            except inventario.StockInsuficiente:
+                resultados.append('sin stock')
+            finally:
+                connection.close()
+
+        hilos = [threading.Thread(target=consumir) for _ in range(self.HILOS)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        insumo.refresh_from_db()
+        self.assertEqual(resultados.count('ok'), 20)
+        self.assertEqual(resultados.count('sin stock'), self.HILOS - 20)
+        self.assertEqual((insumo.cantidad, insumo.estado_stock), (0, 'AGOTADO'))
+        # El kardex (stock inicial + consumos) cuadra con el stock
+        self.assertEqual(sum(insumo.movimientos.values_list('cantidad', flat=True)), 0)
+        self.assertEqual(sorted(insumo.movimientos.values_list('stock_resultante', flat=True)), list(range(21)))
+
+
+class InventarioTests(TestCase):
+    def setUp(self):
+        hoy = timezone.localdate()
+        self.gasas = Insumo.objects.create(nombre="Gasas", cantidad=50, stock_minimo=10, fecha_vencimiento=hoy + timedelta(days=10))
+        self.anestesia = Insumo.objects.create(nombre="Anestesia", cantidad=8, stock_minimo=10, fecha_vencimiento=hoy - timedelta(days=1))
+        self.resina = Insumo.objects.create(nombre="Resina", cantidad=0, fecha_vencimiento=hoy + timedelta(days=300))
+
+    def test_movimientos_y_estado_generado(self):
+        inventario.consumo(self.gasas, 45, "Cirugía")
+        self.assertEqual(self.gasas.cantidad, 5)
+        self.assertEqual(Insumo.objects.get(pk=self.gasas.pk).estado_stock, 'BAJO')
+        with self.assertRaises(inventario.StockInsuficiente):
+            inventario.consumo(self.gasas, 6)
+        inventario.entrada(self.resina, 12, "Compra")
+        inventario.ajustar(self.gasas, 3)
+        self.assertIsNone(inventario.ajustar(self.gasas, 3))
+
+        for insumo in Insumo.objects.all():
+            self.assertEqual(sum(insumo.movimientos.values_list('cantidad', flat=True)), insumo.cantidad)
+        ajuste = self.gasas.movimientos.first()
+        self.assertEqual((ajuste.tipo, ajuste.cantidad, ajuste.stock_resultante), (MovimientoStock.AJUSTE, -2, 3))
+
+    def test_alertas_y_panel_del_admin(self):
+        with self.assertNumQueries(3):
+            alertas = inventario.alertas()
+        self.assertEqual([i.nombre for i in alertas['bajo_stock']], ["Resina", "Anestesia"])
+        self.assertEqual(alertas['vencidos'], [self.anestesia])
+        self.assertEqual(alertas['por_vencer'], [self.gasas])
+
+        admin = User.objects.create_superuser(username="admin", password="x")
+        self.client.force_login(admin)
+        respuesta = self.client.get(reverse('admin:core_insumo_changelist'))
+        self.assertContains(respuesta, "Stock bajo o agotado (2)")
+        self.assertContains(respuesta, "(vencido)")
+
+        # El stock se cambia desde la ficha registrando un movimiento, no editando la cantidad
+        url = reverse('admin:core_insumo_change', args=[self.gasas.pk])
+        datos = {
+            'nombre': "Gasas", 'cantidad': 999, 'stock_minimo': 10, 'unidad': 'unidad', 'fecha_vencimiento': '',
+            'movimientos-TOTAL_FORMS': 1, 'movimientos-INITIAL_FORMS': 0,
+            'movimientos-0-tipo': MovimientoStock.CONSUMO, 'movimientos-0-cantidad': 4, 'movimientos-0-motivo': "Curación",
+        }
+        self.client.post(url, datos)
+        self.gasas.refresh_from_db()
+        self.assertEqual(self.gasas.cantidad, 46)
+        self.assertEqual(self.gasas.movimientos.first().usuario, admin)
+
+    def test_admin_no_guarda_una_salida_mayor_al_stock(self):
+        self.client.force_login(User.objects.create_superuser(username="admin", password="x"))
+        url = reverse('admin:core_insumo_change', args=[self.gasas.pk])
+        datos = {
+            'nombre': "Gasas", 'stock_minimo': 10, 'unidad': 'unidad', 'fecha_vencimiento': '',
+            'movimientos-TOTAL_FORMS': 2, 'movimientos-INITIAL_FORMS': 0,
+            'movimientos-0-tipo': MovimientoStock.CONSUMO, 'movimientos-0-cantidad': 60, 'movimientos-0-motivo': "Cirugía",
+            'movimientos-1-tipo': MovimientoStock.ENTRADA, 'movimientos-1-cantidad': 20, 'movimientos-1-motivo': "Compra",
+        }
+        # Se registran en orden: el consumo de 60 no cabe en las 50 que hay
+        movimientos = self.gasas.movimientos.count()
+        respuesta = self.client.post(url, datos)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertContains(respuesta, "faltan 10")
+        self.assertEqual(self.gasas.movimientos.count(), movimientos)
+
+        # Con la entrada primero sí alcanza
+        datos.update({'movimientos-0-tipo': MovimientoStock.ENTRADA, 'movimientos-0-cantidad': 20,
+                      'movimientos-1-tipo': MovimientoStock.CONSUMO, 'movimientos-1-cantidad': 60})
+        self.assertRedirects(self.client.post(url, datos), reverse('admin:core_insumo_changelist'))
+        self.gasas.refresh_from_db()
+        self.assertEqual(self.gasas.cantidad, 10)
+
+
+class ConsumoPorServicioTests(TestCase):
+    def setUp(self):
+        self.servicio = crear_servicio()
+        self.guantes = Insumo.objects.create(nombre="Guantes", cantidad=10, stock_minimo=4)
+        self.anestesia = Insumo.objects.create(nombre="Anestesia", cantidad=3, stock_minimo=1)
+        self.gasas = Insumo.objects.create(nombre="Gasas", cantidad=100)  # no lo usa el servicio
+        MaterialServicio.objects.create(servicio=self.servicio, insumo=self.guantes, cantidad=2)
+        MaterialServicio.objects.create(servicio=self.servicio, insumo=self.anestesia, cantidad=1)
+        self.paciente = User.objects.create(username="consumo")
+
+    def _cita(self, fecha, hora, **extra):
+        return Cita.objects.create(paciente=self.paciente, servicio=self.servicio, fecha=fecha, hora=time(hora, 0), **extra)
+
+    def test_descuento_al_finalizar(self):
+        cita = self._cita(FECHA_PRUEBA, 9)
+        cita.estado = 'finalizada'
+        cita.save()
+        cita.save()  # guardarla otra vez no descuenta de nuevo
+        self.assertEqual([i.cantidad for i in Insumo.objects.order_by('pk')], [8, 2, 100])
+
+        # Acción masiva: un movimiento por insumo para todo el lote; el faltante de anestesia queda anotado
+        citas = [self._cita(FECHA_PRUEBA, h) for h in (10, 11, 12)]
+        admin = User.objects.create_superuser(username="admin", password="x")
+        CitaAdmin(Cita, None).marcar_como_finalizada(mock.Mock(user=admin), Cita.objects.filter(pk__in=[c.pk for c in citas]))
+        self.assertEqual([i.cantidad for i in Insumo.objects.order_by('pk')], [2, 0, 100])
+        movimiento = self.anestesia.movimientos.first()
+        self.assertEqual((movimiento.cantidad, movimiento.usuario), (-2, admin))
+        self.assertIn("faltaron 1", movimiento.motivo)
+        self.assertEqual(self.guantes.movimientos.filter(tipo=MovimientoStock.CONSUMO).count(), 2)
+        self.assertFalse(Cita.objects.filter(materiales_descontados=False, estado='finalizada').exists())
+
+    def test_pronostico_de_agotamiento(self):
+        hoy = timezone.localdate()
+        for dia in (1, 1, 3, 6, 20):
+            self._cita(hoy + timedelta(days=dia), 9 + Cita.objects.filter(fecha=hoy + timedelta(days=dia)).count())
+        self._cita(hoy + timedelta(days=2), 9, estado='cancelada')  # no cuenta
+
+        self.assertEqual(inventario.actualizar_pronostico(dias=30), 1)
+        self.guantes.refresh_from_db()
+        self.anestesia.refresh_from_db()
+        self.gasas.refresh_from_db()
+        # Guantes: 10 - 4 (día 1) = 6; 6 - 2 (día 3) = 4, el mínimo; alcanza justo hasta el día 20
+        # Anestesia: 3 - 2 (día 1) = 1; 1 - 1 (día 3) = 0; el día 6 ya no alcanza
+        self.assertEqual(
+            (self.guantes.demanda_programada, self.guantes.reposicion_estimada, self.guantes.agotamiento_estimado),
+            (10, hoy + timedelta(days=3), None),
+        )
+        self.assertEqual(self.anestesia.agotamiento_estimado, hoy + timedelta(days=6))
+        self.assertEqual((self.gasas.demanda_programada, self.gasas.agotamiento_estimado), (0, None))
+        self.assertEqual(list(inventario.se_agotan()), [self.anestesia])
+
+
+# ---------------------------------------------------------
+# TIENDA: RESERVA DE STOCK Y PEDIDOS
+# ---------------------------------------------------------
+def crear_producto(nombre, stock, precio=20):
+    return Producto.objects.create(nombre=nombre, descripcion="-", precio=precio, imagen="productos/x.jpg", stock=stock)
+
+
+class CheckoutConcurrenteTests(TransactionTestCase):
+    HILOS = 40
+
+    def test_cero_sobreventas(self):
+        cepillo, pasta = crear_producto("Cepillo", 15), crear_producto("Pasta", 25)
+        compradores = [User.objects.create(username=f"comprador{i}") for i in range(self.HILOS)]
+        barrera = threading.Barrier(self.HILOS)
+        resultados = []
+
+        def comprar(comprador, carrito):
+            try:
+                barrera.wait()
+                pedidos.reservar_pedido(comprador, carrito)
+                resultados.append('ok')
+            except pedidos.SinStock:
+                resultados.append('sin stock')
+            finally:
+                connection.close()
+
+        # Unos compran solo cepillos, otros ambos productos (en distinto orden)
+        carritos = [{cepillo.pk: 1}, {pasta.pk: 2, cepillo.pk: 1}, {pasta.pk: 1}]
+        hilos = [threading.Thread(target=comprar, args=(c, carritos[i % 3])) for i, c in enumerate(compradores)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        self.assertEqual(len(resultados), self.HILOS)
+        self.assertEqual(resultados.count('ok'), Pedido.objects.count())
+        for producto, inicial in ((cepillo, 15), (pasta, 25)):
+            producto.refresh_from_db()
+            vendido = ItemPedido.objects.filter(producto=producto).aggregate(total=Sum('cantidad'))['total']
+            self.assertLessEqual(vendido, inicial)
+            self.assertEqual(producto.stock + vendido, inicial)
+        self.assertEqual(cepillo.stock, 0)  # con 40 compradores el cepillo se agota
+
+
+class PedidosTiendaTests(TestCase):
+    def setUp(self):
+        self.cepillo = crear_producto("Cepillo", 5, precio=12)
+        self.pasta = crear_producto("Pasta", 1, precio=8)
+        self.cliente = User.objects.create_user(username="cliente", password="x", first_name="Ana")
+        self.client.force_login(self.cliente)
+
+    def test_carrito_checkout_y_pago(self):
+        self.client.post(reverse('carrito_agregar', args=[self.cepillo.pk]), {'cantidad': 2})
+        self.client.post(reverse('carrito_agregar', args=[self.pasta.pk]))
+        self.assertContains(self.client.get(reverse('carrito')), "Total: S/ 32")
+
+        respuesta = self.client.post(reverse('confirmar_pedido'))
+        pedido = Pedido.objects.get()
+        self.assertRedirects(respuesta, reverse('pedido_detalle', args=[pedido.pk]))
+        self.assertEqual((pedido.total, pedido.estado), (32, Pedido.RESERVADO))
+        self.assertEqual(list(Producto.objects.order_by('pk').values_list('stock', flat=True)), [3, 0])
+        self.assertNotContains(self.client.get(reverse('tienda')), "Pasta")
+
+        # Otro cliente pide más de lo que queda: todo o nada, no se descuenta nada
+        otro = User.objects.create(username="otro")
+        with self.assertRaises(pedidos.SinStock):
+            pedidos.reservar_pedido(otro, {self.cepillo.pk: 1, self.pasta.pk: 1})
+        self.assertEqual(Producto.objects.get(pk=self.cepillo.pk).stock, 3)
+
+        # Un abono parcial lo protege del barrido; el pago completo lo marca pagado
+        pago = PagoPedido.objects.create(pedido=pedido, monto_total=32, monto_pagado=10, metodo='yape_plin')
+        Pedido.objects.filter(pk=pedido.pk).update(reservado_hasta=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(pedidos.liberar_vencidas(), 0)
+        pago.monto_pagado = 32
+        pago.save()
+        pedido.refresh_from_db()
+        self.assertEqual(pedido.estado, Pedido.PAGADO)
+        self.assertFalse(pedidos.cancelar_pedido(pedido))
+
+    def test_barrido_y_cancelacion_devuelven_stock(self):
+        vencido = pedidos.reservar_pedido(self.cliente, {self.cepillo.pk: 2, self.pasta.pk: 1})
+        cancelado = pedidos.reservar_pedido(self.cliente, {self.cepillo.pk: 1})
+        vigente = pedidos.reservar_pedido(self.cliente, {self.cepillo.pk: 1})
+        Pedido.objects.filter(pk=vencido.pk).update(reservado_hasta=timezone.now() - timedelta(minutes=1))
+
+        self.assertEqual(pedidos.liberar_vencidas(), 1)
+        self.client.post(reverse('cancelar_pedido', args=[cancelado.pk]))
+        self.assertEqual(
+            dict(Pedido.objects.values_list('pk', 'estado')),
+            {vencido.pk: Pedido.VENCIDO, cancelado.pk: Pedido.CANCELADO, vigente.pk: Pedido.RESERVADO},
+        )
+        self.assertEqual(list(Producto.objects.order_by('pk').values_list('stock', flat=True)), [4, 1])
+        with self.assertRaises(ValidationError):
+            PagoPedido(pedido=vencido, monto_total=32, monto_pagado=32, metodo='efectivo').full_clean()
+
+    def test_abono_parcial_no_retiene_el_stock_para_siempre(self):
+        olvidado = pedidos.reservar_pedido(self.cliente, {self.cepillo.pk: 2})
+        desistido = pedidos.reservar_pedido(self.cliente, {self.cepillo.pk: 1, self.pasta.pk: 1})
+        for pedido in (olvidado, desistido):
+            PagoPedido.objects.create(pedido=pedido, monto_total=pedido.total, monto_pagado=5, metodo='efectivo')
+        self.assertEqual(list(Producto.objects.order_by('pk').values_list('stock', flat=True)), [2, 0])
+
+        # El cliente no puede cancelar un pedido con abono, pero el personal sí
+        self.assertFalse(pedidos.cancelar_pedido(desistido))
+        admin = User.objects.create_superuser(username="admin", password="x")
+        self.client.force_login(admin)
+        respuesta = self.client.post(reverse('admin:core_pedido_changelist'), {
+            'action': 'cancelar_pedidos', helpers.ACTION_CHECKBOX_NAME: [desistido.pk],
+        }, follow=True)
+        self.assertContains(respuesta, f"abono que hay que devolver al cliente: #{desistido.pk}")
+
+        # El barrido respeta el plazo extendido del abono y luego lo vence
+        dias = pedidos.dias_reserva_con_abono()
+        self.assertEqual(pedidos.liberar_vencidas(ahora=timezone.now() + timedelta(days=dias - 1)), 0)
+        self.assertEqual(pedidos.liberar_vencidas(ahora=timezone.now() + timedelta(days=dias, hours=1)), 1)
+        self.assertEqual(
+            dict(Pedido.objects.values_list('pk', 'estado')),
+            {olvidado.pk: Pedido.VENCIDO, desistido.pk: Pedido.CANCELADO},
+        )
+        self.assertEqual(list(Producto.objects.order_by('pk').values_list('stock', flat=True)), [5, 1])
+
+    def test_admin_ajusta_stock_sin_pisar_reservas(self):
+        admin = User.objects.create_superuser(username="admin", password="x")
+        self.client.force_login(admin)
+        url = reverse('admin:core_producto_change', args=[self.cepillo.pk])
+        formulario = self.client.get(url).context['adminform'].form
+        pedidos.reservar_pedido(self.cliente, {self.cepillo.pk: 2})  # mientras el admin tiene el formulario abierto
+
+        # El admin repone 10 unidades (escribe 15 sobre las 5 que veía): quedan 3 + 10
+        datos = {**formulario.initial, 'stock': 15, 'initial-stock': 5, 'imagen': ''}
+        self.client.post(url, datos)
+        self.assertEqual(Producto.objects.get(pk=self.cepillo.pk).stock, 13)
+
+
+# ---------------------------------------------------------
+# VERSIONES REDUCIDAS DE LAS FOTOS
+# ---------------------------------------------------------
+def foto_jpeg(ancho, alto):
+    salida = io.BytesIO()
+    Image.new('RGB', (ancho, alto), (30, 120, 200)).save(salida, 'JPEG', quality=95)
+    return SimpleUploadedFile("foto.jpg", salida.getvalue(), content_type='image/jpeg')
+
+
+class ImagenesTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        ajustes = override_settings(MEDIA_ROOT=self.media)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+    def test_versiones_al_subir_y_srcset(self):
+        producto = Producto.objects.create(nombre="Cepillo", descripcion="-", precio=10, imagen=foto_jpeg(600, 400), stock=3)
+        carpeta = os.path.join(self.media, 'derivadas', f'v{imagenes.VERSION}', os.path.splitext(producto.imagen.name)[0])
+        # No se amplía: la foto de 600px solo da las versiones de 240 y 480
+        self.assertEqual(
+            sorted(os.listdir(carpeta)),
+            sorted(['miniatura-50.jpg', 'miniatura-50.webp', 'miniatura-100.jpg', 'miniatura-100.webp', 'miniatura.json',
+                    'producto-240.jpg', 'producto-240.webp', 'producto-480.jpg', 'producto-480.webp', 'producto.json']),
+        )
+        with Image.open(os.path.join(carpeta, 'miniatura-100.webp')) as miniatura:
+            self.assertEqual((miniatura.format, miniatura.size), ('WEBP', (100, 100)))
+
+        html = imagenes.picture(producto.imagen, 'producto', alt="Cepillo")
+        self.assertIn('type="image/webp"', html)
+        self.assertIn('producto-480.webp 480w', html)
+        self.assertNotIn(producto.imagen.url + '"', html)
+
+        self.client.force_login(User.objects.create_superuser(username="admin", password="x"))
+        self.assertContains(self.client.get(reverse('admin:core_producto_changelist')), 'miniatura-100.webp 2x')
+
+        producto.delete()
+        self.assertEqual(os.listdir(carpeta), [])
+
+    def test_generacion_perezosa_en_la_plantilla(self):
+        servicio = Servicio.objects.create(titulo="Limpieza", descripcion="-", imagen=foto_jpeg(1200, 800), precio_estimado=50)
+        imagenes.borrar(servicio.imagen.name)  # p. ej. foto subida antes de este cambio
+        cache.clear()
+
+        respuesta = self.client.get(reverse('home'))
+        self.assertContains(respuesta, 'servicio-960.webp 960w')
+        self.assertEqual(imagenes.anchos_disponibles(servicio.imagen, 'servicio'), [320, 640, 960])
+
+    def test_misma_version_en_paralelo_no_deja_copias(self):
+        ruta = imagenes._ruta('servicios/foto.jpg', 'servicio', 320, 'webp')
+        imagenes._guardar(ruta, b'primera')
+        # La otra petición la vuelve a escribir justo después de que esta la borrara
+        with mock.patch.object(imagenes.default_storage, 'delete'):
+            imagenes._guardar(ruta, b'segunda')
+
+        carpeta = os.path.dirname(os.path.join(self.media, ruta))
+        self.assertEqual(os.listdir(carpeta), ['servicio-320.webp'])
+        with open(os.path.join(carpeta, 'servicio-320.webp'), 'rb') as archivo:
+            self.assertEqual(archivo.read(), b'segunda')
+
+
+# ---------------------------------------------------------
+# DOCUMENTOS CLÍNICOS (DESCARGA PROTEGIDA)
+# ---------------------------------------------------------
+class DescargaDocumentoTests(TestCase):
+    CONTENIDO = bytes(range(256)) * 40  # 10 KB
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        ajustes = override_settings(MEDIA_ROOT=media)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.paciente = User.objects.create_user(username="rosa", password="x")
+        self.documento = Documento.objects.create(
+            paciente=self.paciente, titulo="Panorámica", archivo=SimpleUploadedFile("panoramica.jpg", self.CONTENIDO),
+        )
+        self.url = reverse('descargar_documento', args=[self.documento.pk])
+
+    def test_solo_el_dueno_o_el_personal(self):
+        self.assertEqual(self.client.get(self.url).status_code, 302)  # al login
+
+        self.client.force_login(User.objects.create_user(username="otro", password="x"))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+        self.client.force_login(User.objects.create_superuser(username="admin", password="x"))
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+        self.client.force_login(self.paciente)
+        respuesta = self.client.get(self.url)
+        self.assertEqual(b''.join(respuesta.streaming_content), self.CONTENIDO)
+        self.assertEqual((respuesta['Content-Type'], respuesta['Accept-Ranges']), ('image/jpeg', 'bytes'))
+        self.assertContains(self.client.get(reverse('dashboard')), self.url)
+
+    def test_range_y_peticiones_condicionales(self):
+        self.client.force_login(self.paciente)
+        completa = self.client.get(self.url)
+        etag = completa['ETag']
+
+        tramo = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(tramo.status_code, 206)
+        self.assertEqual(tramo['Content-Range'], f'bytes 100-199/{len(self.CONTENIDO)}')
+        self.assertEqual(b''.join(tramo.streaming_content), self.CONTENIDO[100:200])
+
+        final = self.client.get(self.url, HTTP_RANGE='bytes=-10')
+        self.assertEqual(b''.join(final.streaming_content), self.CONTENIDO[-10:])
+
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=999999-').status_code, 416)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # If-Range con otra versión del archivo: va entero
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"viejo"').status_code, 200)
+
+    @override_settings(DOCUMENTOS_ENVIO='x-accel')
+    def test_envio_delegado_a_nginx(self):
+        self.client.force_login(self.paciente)
+        respuesta = self.client.get(self.url)
+        self.assertEqual(respuesta['X-Accel-Redirect'], '/protegido/' + self.documento.archivo.name)
+        self.assertEqual(respuesta.content, b'')
+
+
+# ---------------------------------------------------------
+# ALMACÉN DEDUPLICADO DE DOCUMENTOS
+# ---------------------------------------------------------
+class AlmacenDeduplicadoTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        ajustes = override_settings(MEDIA_ROOT=self.media)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.paciente = User.objects.create_user(username="rosa", password="x")
+
+    def documento(self, contenido, nombre="rx.jpg"):
+        return Documento.objects.create(paciente=self.paciente, titulo="Rx", archivo=SimpleUploadedFile(nombre, contenido))
+
+    def archivos_en_disco(self):
+        return sorted(nombre for _, _, nombres in os.walk(os.path.join(self.media, 'historias_clinicas')) for nombre in nombres)
+
+    def test_misma_radiografia_se_guarda_una_vez(self):
+        primero, segundo = self.documento(b"radiografia" * 1000), self.documento(b"radiografia" * 1000, "otra.JPG")
+        self.documento(b"otra radiografia")
+
+        self.assertEqual(primero.archivo.name, segundo.archivo.name)
+        self.assertRegex(primero.archivo.name, r'^historias_clinicas/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$')
+        self.assertEqual(len(self.archivos_en_disco()), 2)
+        self.assertEqual(ArchivoDeduplicado.objects.get(nombre=primero.archivo.name).referencias, 2)
+        self.assertEqual(os.listdir(os.path.join(self.media, almacenamiento.CARPETA_TEMPORAL)), [])
+
+        # Las subidas grandes llegan en un temporal de Django: se mueve en vez de copiarse
+        subida = TemporaryUploadedFile("grande.jpg", "image/jpeg", 3, None)
+        subida.write(b"xyz")
+        subida.seek(0)
+        tercero = Documento.objects.create(paciente=self.paciente, titulo="Rx", archivo=subida)
+        self.assertFalse(os.path.exists(subida.temporary_file_path()))
+        subida.close()
+        with tercero.archivo.open('rb') as archivo:
+            self.assertEqual(archivo.read(), b"xyz")
+
+    def test_referencias_y_recoleccion(self):
+        primero, segundo = self.documento(b"A" * 5000), self.documento(b"A" * 5000)
+        nombre = primero.archivo.name
+
+        primero.delete()
+        self.assertEqual(almacenamiento.recolectar(gracia=timedelta(0)), (0, 0))  # el segundo aún lo usa
+
+        # Reemplazar el archivo de un documento suelta el anterior
+        segundo = Documento.objects.get(pk=segundo.pk)
+        segundo.archivo = SimpleUploadedFile("nueva.jpg", b"B" * 10)
+        segundo.save()
+        self.assertEqual(ArchivoDeduplicado.objects.get(nombre=nombre).referencias, 0)
+
+        self.assertEqual(almacenamiento.recolectar(), (0, 0))  # todavía dentro de la gracia
+        self.assertEqual(almacenamiento.recolectar(gracia=timedelta(0)), (1, 5000))
+        self.assertFalse(os.path.exists(os.path.join(self.media, nombre)))
+        self.assertEqual(self.archivos_en_disco(), [os.path.basename(segundo.archivo.name)])
+
+        # recontar() corrige un contador desfasado
+        ArchivoDeduplicado.objects.update(referencias=7)
+        self.assertEqual(almacenamiento.recontar(), 1)
+        self.assertEqual(ArchivoDeduplicado.objects.get().referencias, 1)
+
+    def test_subida_y_recoleccion_a_la_vez(self):
+        nombre = self.documento(b"C" * 100).archivo.name
+        Documento.objects.all().delete()
+        hace_dos_horas = timezone.now() - timedelta(hours=2)
+        volcar = almacenamiento.AlmacenDeduplicado._volcar
+
+        # La recolección termina mientras se calcula el hash: la subida vuelve a crear fila y archivo
+        def volcar_y_recolectar(almacen, content):
+            resultado = volcar(almacen, content)
+            self.assertEqual(almacenamiento.recolectar()[0], 1)
+            return resultado
+
+        ArchivoDeduplicado.objects.update(usado=hace_dos_horas)
+        with mock.patch.object(almacenamiento.AlmacenDeduplicado, '_volcar', volcar_y_recolectar):
+            documento = self.documento(b"C" * 100)
+        self.assertEqual(documento.archivo.name, nombre)
+        self.assertTrue(os.path.exists(os.path.join(self.media, nombre)))
+        self.assertEqual(ArchivoDeduplicado.objects.get().referencias, 1)
+
+        # Y si llega después de que la subida marcó la fila, ya no la toma
+        documento.delete()
+        ArchivoDeduplicado.objects.update(usado=hace_dos_horas)
+        existe, ruta_final, recolecciones = os.path.exists, os.path.join(self.media, nombre), []
+
+        def existe_tras_recolectar(ruta):
+            if ruta == ruta_final:
+                recolecciones.append(almacenamiento.recolectar())
+            return existe(ruta)
+
+        with mock.patch.object(almacenamiento.os.path, 'exists', existe_tras_recolectar):
+            documento = self.documento(b"C" * 100)
+        self.assertEqual(recolecciones, [(0, 0)])
+        self.assertTrue(os.path.exists(ruta_final))
+        self.assertEqual(ArchivoDeduplicado.objects.get().referencias, 1)
+
+
+# ---------------------------------------------------------
+# BÚSQUEDA DE TEXTO COMPLETO
+# ---------------------------------------------------------
+class BusquedaTests(TestCase):
+    def setUp(self):
+        self.paciente = User.objects.create_user(username="jnunez", first_name="José", last_name="Núñez", email="jose@correo.pe")
+        self.ficha = FichaMedica.objects.create(paciente=self.paciente, es_alergico=True, alergias_detalle="Penicilina, Látex")
+        self.receta = Receta.objects.create(paciente=self.paciente, diagnostico="Caries profunda", medicamentos="Amoxicilina 500mg")
+        otro = User.objects.create_user(username="ana", first_name="Ana")
+        Receta.objects.create(paciente=otro, diagnostico="Gingivitis", medicamentos="Clorhexidina")
+
+    def buscar(self, indice, consulta):
+        modelo = User if indice == 'paciente' else Receta
+        return list(busqueda.filtrar(modelo.objects.all(), indice, consulta).values_list('pk', flat=True))
+
+    def test_sin_acentos_por_prefijo_y_todas_las_palabras(self):
+        self.assertEqual(self.buscar('paciente', "nunez"), [self.paciente.pk])
+        self.assertEqual(self.buscar('paciente', "LATEX"), [self.paciente.pk])
+        self.assertEqual(self.buscar('paciente', "jose@correo.pe"), [self.paciente.pk])
+        self.assertEqual(self.buscar('receta', "amoxi"), [self.receta.pk])
+        self.assertEqual(self.buscar('receta', "josé caries"), [self.receta.pk])
+        self.assertEqual(self.buscar('receta', "josé gingivitis"), [])
+        self.assertEqual(self.buscar('receta', "¿?"), [])
+
+    def test_el_indice_sigue_los_cambios(self):
+        self.ficha.enfermedad_detalle = "Hipertensión"
+        self.ficha.save()
+        self.assertEqual(self.buscar('paciente', "hipertension"), [self.paciente.pk])
+
+        self.paciente.first_name = "Josefina"
+        self.paciente.save()
+        self.assertEqual(self.buscar('receta', "josefina"), [self.receta.pk])
+
+        self.receta.delete()
+        self.assertEqual(self.buscar('receta', "caries"), [])
+        self.assertEqual(busqueda.reconstruir(User, Receta), (2, 1))
+        self.assertEqual(self.buscar('paciente', "hipertension"), [self.paciente.pk])
+
+    def test_cajas_de_busqueda_del_admin(self):
+        self.client.force_login(User.objects.create_superuser(username="admin", password="x"))
+        respuesta = self.client.get(reverse('admin:core_paciente_changelist'), {'q': 'penicilina'})
+        self.assertContains(respuesta, "jnunez")
+        self.assertNotContains(respuesta, ">ana<")
+        respuesta = self.client.get(reverse('admin:core_receta_changelist'), {'q': 'clorhex'})
+        self.assertEqual(list(respuesta.context['cl'].result_list), list(Receta.objects.filter(diagnostico="Gingivitis")))
+
+
+# ---------------------------------------------------------
+# SELECTORES CON AUTOCOMPLETADO DEL ADMIN
+# ---------------------------------------------------------
+class AutocompletadoAdminTests(TestCase):
+    def setUp(self):
+        self.servicio = crear_servicio()
+        self.jose = User.objects.create_user(username="jnunez", first_name="José", last_name="Núñez")
+        self.cita = agenda.reservar_cita(self.jose, self.servicio, FECHA_PRUEBA, time(10, 0))
+        self.client.force_login(User.objects.create_superuser(username="admin", password="x"))
+
+    def crear_pacientes(self, desde, hasta):
+        for i in range(desde, hasta):
+            paciente = User.objects.create_user(username=f"paciente{i}")
+            agenda.reservar_cita(paciente, self.servicio, FECHA_PRUEBA + timedelta(weeks=i // 10 + 1), time(9 + i % 10, 0))
+
+    def consultas_formularios(self):
+        urls = [reverse(f'admin:core_{modelo}_add') for modelo in ('cita', 'receta', 'documento', 'pago')]
+        with CaptureQueriesContext(connection) as consultas:
+            for url in urls:
+                self.assertEqual(self.client.get(url).status_code, 200)
+        return len(consultas)
+
+    def test_formularios_no_dependen_del_tamano_de_las_tablas(self):
+        self.crear_pacientes(0, 10)
+        self.consultas_formularios()  # la primera carga llena cachés (tipos de contenido...)
+        antes = self.consultas_formularios()
+        self.crear_pacientes(10, 40)
+        self.assertEqual(self.consultas_formularios(), antes)
+        self.assertNotContains(self.client.get(reverse('admin:core_cita_add')), "paciente39")
+
+    def autocompletar(self, modelo, campo, termino):
+        respuesta = self.client.get(reverse('admin:autocomplete'), {
+            'app_label': 'core', 'model_name': modelo, 'field_name': campo, 'term': termino,
+        })
+        self.assertEqual(respuesta.status_code, 200)
+        return [r['text'] for r in respuesta.json()['results']]
+
+    def test_busqueda_de_pacientes_y_citas(self):
+        self.assertEqual(self.autocompletar('cita', 'paciente', "nunez"), ["jnunez"])
+        self.assertEqual(self.autocompletar('cita', 'paciente', "admin"), [])  # el personal no es paciente
+        self.assertEqual(self.autocompletar('receta', 'cita', "jose"), [str(self.cita)])
+        self.assertEqual(self.autocompletar('cita', 'servicio', "profi"), ["Profilaxis"])
+
+        # Recepción: ve pacientes y agenda citas, pero no administra al personal
+        recepcion = User.objects.create_user(username="recepcion", is_staff=True)
+        recepcion.user_permissions.set(Permission.objects.filter(codename__in=['view_paciente', 'add_cita', 'view_cita']))
+        self.client.force_login(recepcion)
+        self.assertEqual(self.autocompletar('cita', 'paciente', "jose"), ["jnunez"])
+        self.assertEqual(self.client.get(reverse('admin:auth_user_changelist')).status_code, 403)
+
+
+# ---------------------------------------------------------
+# LISTADOS GRANDES DEL ADMIN (PAGINACIÓN POR CURSOR)
+# ---------------------------------------------------------
+@mock.patch.object(CitaAdmin, 'list_per_page', 4)
+class PaginacionKeysetTests(TestCase):
+    def setUp(self):
+        servicio = crear_servicio()
+        paciente = User.objects.create_user(username="eva", first_name="Eva")
+        for i in range(10):
+            Cita.objects.create(paciente=paciente, servicio=servicio, fecha=FECHA_PRUEBA + timedelta(days=i // 4), hora=time(9 + i % 4, 0))
+        # Canceladas en los mismos turnos: empates de fecha y hora que desempata el id
+        for i in range(3):
+            Cita.objects.create(paciente=paciente, servicio=servicio, fecha=FECHA_PRUEBA, hora=time(9, 0), estado='cancelada')
+        self.orden = list(Cita.objects.order_by('-fecha', '-hora', '-id').values_list('pk', flat=True))
+        self.client.force_login(User.objects.create_superuser(username="admin", password="x"))
+
+    def listado(self, consulta=''):
+        respuesta = self.client.get(reverse('admin:core_cita_changelist') + consulta.replace('&amp;', '&'))
+        self.assertEqual(respuesta.status_code, 200)
+        return respuesta.context['cl']
+
+    def test_recorre_el_listado_hacia_adelante_y_hacia_atras(self):
+        recorridas, cl = [], self.listado()
+        self.assertTrue(cl.keyset)
+        while True:
+            recorridas.append([cita.pk for cita in cl.result_list])
+            if not cl.enlace_siguiente:
+                break
+            cl = self.listado(cl.enlace_siguiente)
+        self.assertEqual(sum(recorridas, []), self.orden)
+        self.assertEqual([len(pagina) for pagina in recorridas], [4, 4, 4, 1])
+
+        # Desde la última página (las 4 más antiguas) de vuelta al principio
+        cl = self.listado('?_antes=')
+        atras = []
+        while True:
+            atras.insert(0, [cita.pk for cita in cl.result_list])
+            if not cl.enlace_anterior:
+                break
+            cl = self.listado(cl.enlace_anterior)
+        self.assertEqual(sum(atras, []), self.orden)
+        self.assertIsNone(cl.enlace_primera)
+
+    def test_paginas_profundas_sin_offset(self):
+        primera = self.listado()
+        self.assertContains(self.client.get(reverse('admin:core_cita_changelist')), "Siguiente ›")
+        with CaptureQueriesContext(connection) as consultas:
+            self.listado(primera.enlace_siguiente)
+        self.assertFalse([c['sql'] for c in consultas if 'OFFSET' in c['sql']])
+
+        # Los filtros y el orden por columna vuelven a la primera página
+        cl = self.listado(primera.enlace_siguiente)
+        self.assertNotIn(paginacion.DESPUES_VAR, cl.get_query_string({'estado__exact': 'pendiente'}))
+        ordenado = self.listado('?o=4&p=2')
+        self.assertFalse(ordenado.keyset)
+        self.assertEqual(len(ordenado.result_list), 4)
+
+        respuesta = self.client.get(reverse('admin:core_cita_changelist') + '?_despues=no-es-un-cursor')
+        self.assertRedirects(respuesta, reverse('admin:core_cita_changelist') + '?e=1', fetch_redirect_response=False)
+
+    @override_settings(LISTADOS_CONTEO_EXACTO_MAX=5)
+    def test_conteo_acotado_y_estimado(self):
+        self.assertEqual(self.listado().etiqueta_conteo, f"≈ {Cita.objects.order_by('-pk')[0].pk}")  # sin ANALYZE: el id más alto
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE core_cita")
+        self.assertEqual(paginacion.contar(Cita.objects.all(), 5), (13, paginacion.ESTIMADO))
+        # SQLite no estima consultas filtradas: solo se sabe que pasan del umbral
+        self.assertEqual(self.listado('?estado__exact=pendiente').etiqueta_conteo, "más de 5")
+        self.assertEqual(self.listado('?estado__exact=cancelada').etiqueta_conteo, "3")
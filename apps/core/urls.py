@@ -17,6 +17,7 @@ urlpatterns = [
     
     # --- FUNCIONALIDAD DE CITAS ---
     path('crear-cita/', views.crear_cita, name='crear_cita'),
+    path('disponibilidad/', views.disponibilidad, name='disponibilidad'),
 
     # --- RUTA TEMPORAL ---
     path('ver-email/', views.test_email_design, name='test_email'),
@@ -24,7 +25,19 @@ urlpatterns = [
     # --- DESCARGAR PDF ---
     path('receta/pdf/<int:receta_id>/', views.descargar_receta_pdf, name='descargar_receta'),
 
+    # --- DOCUMENTOS CLÍNICOS (SOLO EL PACIENTE DUEÑO Y EL PERSONAL) ---
+    path('documento/<int:documento_id>/', views.descargar_documento, name='descargar_documento'),
+
+    # --- TABLERO DEL ADMIN (JSON) ---
+    path('panel/tablero/', views.tablero_admin, name='tablero_admin'),
+
     # --- TIENDA Y PAGOS (NUEVO) ---
     path('tienda/', views.tienda, name='tienda'),
+    path('tienda/carrito/', views.carrito, name='carrito'),
+    path('tienda/carrito/agregar/<int:producto_id>/', views.carrito_agregar, name='carrito_agregar'),
+    path('tienda/carrito/quitar/<int:producto_id>/', views.carrito_quitar, name='carrito_quitar'),
+    path('tienda/confirmar/', views.confirmar_pedido, name='confirmar_pedido'),
+    path('tienda/pedido/<int:pedido_id>/', views.pedido_detalle, name='pedido_detalle'),
+    path('tienda/pedido/<int:pedido_id>/cancelar/', views.cancelar_pedido, name='cancelar_pedido'),
     path('pagar-cita/<int:cita_id>/', views.pagar_cita, name='pagar_cita'),
 ]
\ No newline at end of file
@@ -1,55 +1,76 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse, HttpResponse 
+from django.http import Http404, JsonResponse, HttpResponse 
 from django.contrib.auth import login
 from django.contrib.auth.decorators import login_required
-from django.views.decorators.cache import never_cache # <--- IMPORTANTE: IMPORTAMOS ESTO
+from django.contrib.admin.views.decorators import staff_member_required
+from django.views.decorators.cache import cache_control, never_cache # <--- IMPORTANTE: IMPORTAMOS ESTO
+from django.views.decorators.http import require_POST
 from django.contrib import messages
-from .models import Servicio, Cita, Receta, Producto 
-from .forms import RegistroPacienteForm
+from .models import Servicio, Cita, Receta, Producto, Pedido, Documento
+from .forms import RegistroPacienteForm, ReservaCitaForm
+from django.core.exceptions import ValidationError
+from . import agenda, chatbot, documentos, paginas, pedidos, portal, recetas_pdf, resumenes
+from datetime import date, timedelta
+from django.utils import timezone
 
 # --- IMPORTACIONES PARA EL CORREO ---
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
-from django.utils.html import strip_tags
-from django.conf import settings
-
-# --- IMPORTACIONES PARA PDF (REPORTLAB) ---
-import io
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
+from .correo import encolar_correo
 
 # ---------------------------------------------------------
 # VISTAS PÚBLICAS
 # ---------------------------------------------------------
 
 def home(request):
-    servicios = Servicio.objects.all()
-    return render(request, 'core/home.html', {'servicios': servicios})
+    def renderizar():
+        servicios = Servicio.objects.all()
+        return render(request, 'core/home.html', {
+            'servicios': servicios,
+            'version_catalogo': paginas.version_catalogo(),
+        }).content
 
-def bot_respuesta(request):
-    mensaje = request.GET.get('msg', '').lower()
-    respuesta = "Lo siento, no entendí bien. ¿Puedes intentar con las opciones del menú?"
-    
-    if 'hola' in mensaje or 'buenos' in mensaje:
-        respuesta = "¡Hola! Soy el asistente virtual de la Dra. Jazmin. ¿En qué puedo ayudarte hoy?"
-    elif 'cita' in mensaje or 'turno' in mensaje or 'agendar' in mensaje:
-        respuesta = "¡Claro! Puedes agendar tu cita llenando el formulario que está más arriba en esta página, o registrándote en nuestro portal para gestionarlas mejor."
-    elif 'precio' in mensaje or 'costo' in mensaje or 'servicio' in mensaje:
-        servicios_db = Servicio.objects.all()[:3]
-        texto_servicios = ", ".join([f"{s.titulo} (S/ {s.precio_estimado})" for s in servicios_db])
-        if servicios_db:
-             respuesta = f"Nuestros precios referenciales son: {texto_servicios}... y más. Puedes ver todos en la sección de Servicios."
-        else:
-             respuesta = "La consulta básica cuesta S/ 30. Para tratamientos específicos, necesitamos evaluarte."
-    elif 'donde' in mensaje or 'ubicacion' in mensaje or 'direccion' in mensaje:
-        respuesta = "Estamos en Av. Principal 123, Lima. Justo frente al parque. ¡Es muy fácil llegar!"
-    elif 'horario' in mensaje or 'hora' in mensaje:
-        respuesta = "Atendemos de Lunes a Viernes de 9am a 8pm, y Sábados hasta las 6pm."
-    elif 'entrar' in mensaje or 'login' in mensaje or 'cuenta' in mensaje:
-        respuesta = "Puedes acceder a tu cuenta haciendo clic en el botón 'Ingresar' del menú superior."
+    # Los visitantes anónimos (tráfico de anuncios) reciben la página cacheada,
+    # comprimida y con ETag/Last-Modified; los usuarios logueados ven su menú
+    if not request.user.is_authenticated:
+        return paginas.pagina_cacheada(request, 'home', ['core/home.html', 'base/base.html'], renderizar)
+    return HttpResponse(renderizar())
 
+async def bot_respuesta(request):
+    # Intenciones compiladas una vez en chatbot.py (autómata + tildes + errores de tipeo).
+    # Vista asíncrona: con ASGI no ocupa un hilo mientras espera a la caché
+    respuesta = await chatbot.aresponder(request.GET.get('msg', ''))
     return JsonResponse({'respuesta': respuesta})
 
+# ---------------------------------------------------------
+# DISPONIBILIDAD DE TURNOS (JSON) 📅
+# ---------------------------------------------------------
+MAX_DIAS_DISPONIBILIDAD = 31
+
+async def disponibilidad(request):
+    """ Turnos libres entre ?desde= y ?hasta= (YYYY-MM-DD), leídos del índice de agenda """
+    hoy = timezone.localdate()
+    try:
+        desde = date.fromisoformat(request.GET['desde']) if request.GET.get('desde') else hoy
+        hasta = date.fromisoformat(request.GET['hasta']) if request.GET.get('hasta') else desde + timedelta(days=6)
+    except ValueError:
+        return JsonResponse({'error': 'Fechas inválidas. Usa el formato YYYY-MM-DD.'}, status=400)
+
+    desde = max(desde, hoy)
+    if hasta < desde:
+        return JsonResponse({'error': 'El rango de fechas está vacío.'}, status=400)
+    hasta = min(hasta, desde + timedelta(days=MAX_DIAS_DISPONIBILIDAD - 1))
+
+    ahora = timezone.localtime().time()
+    dias = []
+    for fecha, libres in (await agenda.aturnos_libres(desde, hasta)).items():
+        if fecha == hoy:
+            libres = [h for h in libres if h > ahora]
+        dias.append({'fecha': fecha.isoformat(), 'libres': [h.strftime('%H:%M') for h in libres]})
+
+    return JsonResponse({
+        'duracion_minutos': int(agenda.duracion_turno().total_seconds() // 60),
+        'dias': dias,
+    })
+
 # ---------------------------------------------------------
 # SISTEMA DE USUARIOS Y CITAS
 # ---------------------------------------------------------
@@ -80,59 +101,62 @@ def dashboard(request):
     """
     Portal privado del paciente. Muestra citas Y RECETAS.
     """
-    mis_citas = Cita.objects.filter(paciente=request.user).order_by('fecha', 'hora')
-    mis_recetas = Receta.objects.filter(paciente=request.user).order_by('-fecha_emision')
-    
-    servicios = Servicio.objects.all()
+    # Citas (con su servicio), recetas y catálogo salen de la caché del portal;
+    # se invalida con señales cuando algo cambia (ver portal.py)
+    datos = portal.datos_portal(request.user.pk)
     
     context = {
         'nombre_paciente': request.user.first_name,
-        'citas': mis_citas,
-        'recetas': mis_recetas,
-        'servicios': servicios
+        'citas': datos['citas'],
+        'recetas': datos['recetas'],
+        'documentos': datos['documentos'],
+        'servicios': datos['servicios']
     }
     return render(request, 'pacientes/dashboard.html', context)
 
 @login_required
 def crear_cita(request):
     if request.method == 'POST':
-        servicio_id = request.POST.get('servicio')
-        fecha = request.POST.get('fecha')
-        hora = request.POST.get('hora')
-        
-        servicio_obj = get_object_or_404(Servicio, id=servicio_id)
-        
-        Cita.objects.create(
-            paciente=request.user,
-            servicio=servicio_obj,
-            fecha=fecha,
-            hora=hora,
-            estado='pendiente'
-        )
-        
+        form = ReservaCitaForm(request.POST)
+        if not form.is_valid():
+            messages.error(request, " ".join(e for errores in form.errors.values() for e in errores))
+            return redirect('dashboard')
+
+        servicio_obj = form.cleaned_data['servicio']
+        fecha = form.cleaned_data['fecha']
+        hora = form.cleaned_data['hora']
+
+        # Reserva atómica: si otro paciente tomó el turno (o la base de datos
+        # rechaza el duplicado) lo mostramos como error del campo 'hora'
         try:
-            asunto = 'Confirmación de Reserva - Clínica Dra. Jazmin'
-            contexto_email = {
-                'nombre': request.user.first_name,
-                'tratamiento': servicio_obj.titulo,
-                'fecha': fecha,
-                'hora': hora,
-            }
-            html_message = render_to_string('emails/confirmacion_cita.html', contexto_email)
-            plain_message = strip_tags(html_message)
-            
-            send_mail(
-                asunto,
-                plain_message,
-                settings.EMAIL_HOST_USER,
+            agenda.reservar_cita(request.user, servicio_obj, fecha, hora)
+        except agenda.TurnoOcupado:
+            form.add_error('hora', f"Lo sentimos, el turno del {fecha} a las {hora:%H:%M} ya fue reservado. Elige otro horario.")
+        except ValidationError as e:
+            for campo, errores in e.message_dict.items():
+                for error in errores:
+                    form.add_error(campo if campo in form.fields else None, error)
+        if form.errors:
+            messages.error(request, " ".join(e for errores in form.errors.values() for e in errores))
+            return redirect('dashboard')
+        
+        # El correo se encola y lo envía el despachador (manage.py enviar_correos);
+        # la respuesta no espera al servidor SMTP
+        if request.user.email:
+            encolar_correo(
+                'Confirmación de Reserva - Clínica Dra. Jazmin',
                 [request.user.email],
-                html_message=html_message,
-                fail_silently=False,
+                template='emails/confirmacion_cita.html',
+                contexto={
+                    'nombre': request.user.first_name,
+                    'tratamiento': servicio_obj.titulo,
+                    'fecha': fecha,
+                    'hora': hora,
+                },
             )
-            messages.success(request, "¡Cita agendada! Te hemos enviado un correo de confirmación.")
-        except Exception as e:
-            print(f"❌ Error enviando correo: {e}")
-            messages.warning(request, "Cita agendada, pero no pudimos enviar el correo de confirmación.")
+            messages.success(request, "¡Cita agendada! En unos minutos recibirás un correo de confirmación.")
+        else:
+            messages.success(request, "¡Cita agendada!")
         
         return redirect('dashboard')
     return redirect('dashboard')
@@ -149,51 +173,32 @@ def test_email_design(request):
 # ---------------------------------------------------------
 # NUEVA VISTA: DESCARGAR RECETA PDF (PACIENTE)
 # ---------------------------------------------------------
-@never_cache # <--- Protegemos también la receta
+@cache_control(private=True, no_cache=True, must_revalidate=True) # <--- Protegemos la receta: el navegador siempre revalida (y tras logout lo redirige al login)
 @login_required
 def descargar_receta_pdf(request, receta_id):
-    receta = get_object_or_404(Receta, id=receta_id, paciente=request.user)
-
-    buffer = io.BytesIO()
-    p = canvas.Canvas(buffer, pagesize=A4)
-    width, height = A4
-
-    p.setFont("Helvetica-Bold", 16)
-    p.drawString(50, height - 50, "CLÍNICA DENTAL DRA. JAZMIN")
-    p.setFont("Helvetica", 10)
-    p.drawString(50, height - 70, "Av. Principal 123 - Lima, Perú | Tel: 999-999-999")
-    p.line(50, height - 80, width - 50, height - 80)
-
-    p.setFont("Helvetica-Bold", 12)
-    p.drawString(50, height - 110, f"PACIENTE: {receta.paciente.first_name} {receta.paciente.last_name}")
-    p.setFont("Helvetica", 10)
-    p.drawString(400, height - 110, f"FECHA: {receta.fecha_emision.strftime('%d/%m/%Y')}")
-
-    p.setFont("Helvetica-Bold", 11)
-    p.drawString(50, height - 150, "DIAGNÓSTICO:")
-    p.setFont("Helvetica", 10)
-    p.drawString(50, height - 165, receta.diagnostico)
-
-    p.setFont("Helvetica-Bold", 11)
-    p.drawString(50, height - 200, "INDICACIONES MÉDICAS (RP):")
-    
-    text_object = p.beginText(50, height - 220)
-    text_object.setFont("Helvetica", 10)
-    lines = receta.medicamentos.split('\n')
-    for line in lines:
-        text_object.textLine(line)
-    p.drawText(text_object)
-
-    p.line(50, 150, 250, 150)
-    p.setFont("Helvetica", 9)
-    p.drawString(80, 135, "Firma Dra. Jazmín")
-    p.drawString(50, 50, "Documento generado digitalmente desde el Portal del Paciente.")
-    
-    p.showPage()
-    p.save()
+    receta = get_object_or_404(Receta.objects.select_related('paciente'), id=receta_id, paciente=request.user)
+    # El PDF sale de la caché en disco (recetas_pdf.py); solo se dibuja si la receta cambió
+    return recetas_pdf.respuesta_pdf(request, receta, f"Receta_{receta.id}.pdf")
+
+# ---------------------------------------------------------
+# DOCUMENTOS CLÍNICOS (RADIOGRAFÍAS Y ESTUDIOS) 🩻
+# ---------------------------------------------------------
+@cache_control(private=True, no_cache=True, must_revalidate=True) # <--- Revalida siempre: un 304 barato, pero nunca sin sesión
+@login_required
+def descargar_documento(request, documento_id):
+    documento = get_object_or_404(Documento, id=documento_id)
+    if not documentos.puede_ver(request.user, documento):
+        raise Http404("Documento no encontrado") # <--- Igual que si no existiera
+    return documentos.respuesta_documento(request, documento)
 
-    buffer.seek(0)
-    return HttpResponse(buffer, content_type='application/pdf')
+# ---------------------------------------------------------
+# TABLERO DEL ADMIN 📈
+# ---------------------------------------------------------
+@never_cache
+@staff_member_required
+def tablero_admin(request):
+    """ Cifras y gráficos del index del admin (salen de los resúmenes diarios) """
+    return JsonResponse(resumenes.tablero())
 
 # ---------------------------------------------------------
 # TIENDA Y PAGOS 🛒
@@ -203,8 +208,76 @@ def descargar_receta_pdf(request, receta_id):
 @login_required
 def tienda(request):
     """ Muestra los productos disponibles """
-    productos = Producto.objects.filter(stock__gt=0) # Solo los que tienen stock
-    return render(request, 'pacientes/tienda.html', {'productos': productos})
+    productos = Producto.objects.filter(stock__gt=0) # Solo los que tienen stock (sin contar lo reservado)
+    return render(request, 'pacientes/tienda.html', {
+        'productos': productos,
+        'en_carrito': sum(pedidos.carrito(request.session).values()),
+    })
+
+@require_POST
+@login_required
+def carrito_agregar(request, producto_id):
+    producto = get_object_or_404(Producto, id=producto_id)
+    try:
+        cantidad = int(request.POST.get('cantidad', 1))
+    except ValueError:
+        cantidad = 1
+    pedidos.agregar_al_carrito(request.session, producto.id, cantidad)
+    messages.success(request, f"{producto.nombre} se agregó al carrito.")
+    return redirect('tienda')
+
+@require_POST
+@login_required
+def carrito_quitar(request, producto_id):
+    pedidos.quitar_del_carrito(request.session, producto_id)
+    return redirect('carrito')
+
+@never_cache
+@login_required
+def carrito(request):
+    return render(request, 'pacientes/carrito.html', {
+        **pedidos.detalle_carrito(request.session),
+        'minutos_reserva': pedidos.minutos_reserva(),
+    })
+
+@require_POST
+@login_required
+def confirmar_pedido(request):
+    """ Reserva el stock del carrito (todo o nada) y crea el pedido """
+    items = pedidos.carrito(request.session)
+    if not items:
+        messages.error(request, "Tu carrito está vacío.")
+        return redirect('tienda')
+    try:
+        pedido = pedidos.reservar_pedido(request.user, items)
+    except pedidos.SinStock as e:
+        messages.error(request, f"{e} Ajusta tu carrito e inténtalo de nuevo.")
+        return redirect('carrito')
+    pedidos.vaciar_carrito(request.session)
+    messages.success(request, f"¡Pedido #{pedido.id} reservado! Tienes {pedidos.minutos_reserva()} minutos para pagarlo.")
+    return redirect('pedido_detalle', pedido_id=pedido.id)
+
+@never_cache
+@login_required
+def pedido_detalle(request, pedido_id):
+    pedido = get_object_or_404(Pedido.objects.prefetch_related('items__producto'), id=pedido_id, cliente=request.user)
+    # El pago se confirma por WhatsApp (Yape/Plin) y el personal lo registra en el admin
+    telefono_clinica = "51999999999"
+    mensaje = f"Hola, soy {request.user.first_name}. Quiero pagar mi pedido #{pedido.id} de la tienda (S/ {pedido.total})."
+    return render(request, 'pacientes/pedido.html', {
+        'pedido': pedido,
+        'url_whatsapp': f"https://wa.me/{telefono_clinica}?text={mensaje}",
+    })
+
+@require_POST
+@login_required
+def cancelar_pedido(request, pedido_id):
+    pedido = get_object_or_404(Pedido, id=pedido_id, cliente=request.user)
+    if pedidos.cancelar_pedido(pedido):
+        messages.success(request, f"Pedido #{pedido.id} cancelado.")
+    else:
+        messages.error(request, "Este pedido ya no se puede cancelar.")
+    return redirect('pedido_detalle', pedido_id=pedido.id)
 
 @login_required
 def pagar_cita(request, cita_id):
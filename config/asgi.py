@@ -3,6 +3,8 @@ ASGI config for config project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Para producción: gunicorn config.asgi -c config/gunicorn_asgi.py
+
 For more information on this file, see
 https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
 """
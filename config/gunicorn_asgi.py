@@ -0,0 +1,25 @@
+"""
+Configuración de gunicorn para servir el proyecto en modo ASGI:
+
+    gunicorn config.asgi -c config/gunicorn_asgi.py
+
+Cada worker es un proceso uvicorn con su propio event loop. Las vistas
+asíncronas (bot_respuesta, disponibilidad) no bloquean al worker mientras
+esperan a la base de datos o a la caché; las vistas síncronas (admin, portal,
+PDFs) siguen funcionando y Django las ejecuta en un hilo.
+
+Variables de entorno:
+    PORT             puerto (lo define Railway/Heroku)
+    WEB_CONCURRENCY  número de procesos (por defecto 2 por núcleo + 1)
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+worker_class = 'uvicorn_worker.UvicornWorker'
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+
+# Conexiones keep-alive: el navegador reutiliza la conexión del chatbot
+keepalive = 5
+timeout = 30
+graceful_timeout = 30
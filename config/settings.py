@@ -55,7 +55,7 @@ INSTALLED_APPS = [
 # ---------------------------------------------------------
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware', # <--- Whitenoise para archivos estáticos
+    'apps.core.middleware.WhiteNoiseAsincrono', # <--- Whitenoise para archivos estáticos (WSGI y ASGI)
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -95,9 +95,55 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Con varios workers de gunicorn: esperar el bloqueo en vez de fallar
+            # y tomar el lock de escritura al abrir la transacción
+            'timeout': 20,
+            'transaction_mode': 'IMMEDIATE',
+        },
+        # Base de tests en archivo, no en memoria. Los tests de concurrencia
+        # (reservas, checkout de pedidos, consumo de insumos) abren una conexión
+        # por hilo; con la base en memoria compartida SQLite bloquea por tabla y
+        # falla al instante ("database table is locked") en vez de esperar el
+        # timeout con BEGIN IMMEDIATE como en producción. Solo lo usa manage.py test.
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
+# Caché compartida por todos los workers de gunicorn: Redis si está
+# configurado (REDIS_URL), si no una caché en disco (los tests usan memoria,
+# ver config/settings_test.py).
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.path.join(BASE_DIR, '.cache'),
+            'OPTIONS': {'MAX_ENTRIES': 20000},
+        }
+    }
+
+# PDFs de recetas ya generados (caché en disco direccionada por contenido, LRU)
+RECETAS_PDF_DIR = os.path.join(BASE_DIR, '.cache', 'recetas_pdf')
+RECETAS_PDF_MAX_MB = 200
+# Procesos para la impresión masiva de recetas (vacío = uno por núcleo)
+RECETAS_PDF_PROCESOS = int(os.environ.get('RECETAS_PDF_PROCESOS', 0)) or None
+
+# Exportaciones de citas: por encima de este número de filas el admin las
+# genera en segundo plano (manage.py procesar_exportaciones) en vez de en la petición
+EXPORTACIONES_DIR = os.path.join(BASE_DIR, 'exportaciones')
+EXPORTACION_MAX_DIRECTA = 50000
+
+# Listados grandes del admin (Citas, Pagos, Recetas): hasta este número de filas
+# se cuentan exactas; por encima se muestra un total estimado (ver paginacion.py)
+LISTADOS_CONTEO_EXACTO_MAX = 10000
+
 
 # ---------------------------------------------------------
 # 7. VALIDACIÓN DE CONTRASEÑAS
@@ -150,6 +196,12 @@ EMAIL_USE_TLS = True
 EMAIL_HOST_USER = 'tu_correo_real@gmail.com'
 EMAIL_HOST_PASSWORD = 'xxxx xxxx xxxx xxxx'
 
+# Bandeja de salida: los correos se encolan y los envía `manage.py enviar_correos`
+CORREO_LOTE = 50                    # mensajes por conexión SMTP
+CORREO_MAX_INTENTOS = 5             # luego se marca como fallido
+CORREO_ESPERA_BASE_SEGUNDOS = 60    # 1, 2, 4, 8... minutos entre reintentos
+RECORDATORIOS_LOTE = 200            # recordatorios por conexión SMTP (manage.py enviar_recordatorios)
+
 
 # ---------------------------------------------------------
 # 11. DISEÑO JAZZMIN (CONFIGURACIÓN VISUAL)
@@ -177,14 +229,18 @@ JAZZMIN_SETTINGS = {
         "core.Cita": "fas fa-calendar-check",
         "core.Servicio": "fas fa-tooth",
         "core.Documento": "fas fa-x-ray",
+        "core.ArchivoDeduplicado": "fas fa-hdd",
         "core.Paciente": "fas fa-user-injured",
         "core.Pago": "fas fa-cash-register",
         "core.Insumo": "fas fa-boxes",
+        "core.MovimientoStock": "fas fa-exchange-alt",
         "core.Receta": "fas fa-prescription-bottle-alt",
         
         # --- NUEVOS ÍCONOS ---
         "core.FichaMedica": "fas fa-file-medical-alt", 
         "core.Producto": "fas fa-shopping-cart",       
+        "core.CorreoPendiente": "fas fa-envelope",
+        "core.Pedido": "fas fa-receipt",
     },
     
     "order_with_respect_to": [
@@ -226,6 +282,45 @@ JAZZMIN_UI_TWEAKS = {
     }
 }
 
+
+# ---------------------------------------------------------
+# 12. AGENDA DE LA CLÍNICA (TURNOS)
+# ---------------------------------------------------------
+# Horario de atención por día de la semana (0 = Lunes ... 6 = Domingo).
+# Los días que no aparecen aquí se consideran cerrados.
+HORARIO_CLINICA = {
+    0: ('09:00', '20:00'),
+    1: ('09:00', '20:00'),
+    2: ('09:00', '20:00'),
+    3: ('09:00', '20:00'),
+    4: ('09:00', '20:00'),
+    5: ('09:00', '18:00'),
+}
+DURACION_TURNO_MINUTOS = 30
+
+# ---------------------------------------------------------
+# 13. TIENDA (PEDIDOS)
+# ---------------------------------------------------------
+# Minutos que un pedido confirmado retiene el stock esperando el pago; luego
+# `manage.py liberar_reservas` lo devuelve a la tienda
+TIENDA_MINUTOS_RESERVA = 30
+# Con un abono parcial la reserva se alarga estos días; si el pago no se
+# completa, el barrido también la vence (el abono se devuelve desde el admin)
+TIENDA_DIAS_RESERVA_CON_ABONO = 7
+# Unidades máximas de un mismo producto por pedido
+TIENDA_MAX_POR_PRODUCTO = 10
+
+# ---------------------------------------------------------
+# 14. DOCUMENTOS CLÍNICOS (DESCARGA PROTEGIDA)
+# ---------------------------------------------------------
+# Cómo sale el archivo una vez autorizado (ver apps/core/documentos.py):
+#   ''           -> lo transmite Django (FileResponse con Range y 304)
+#   'x-accel'    -> nginx: X-Accel-Redirect a DOCUMENTOS_ACCEL_PREFIJO + nombre.
+#                   Requiere una location `internal` con alias a MEDIA_ROOT.
+#   'x-sendfile' -> Apache (mod_xsendfile) o lighttpd: ruta absoluta del archivo
+DOCUMENTOS_ENVIO = os.environ.get('DOCUMENTOS_ENVIO', '')
+DOCUMENTOS_ACCEL_PREFIJO = '/protegido/'
+
 # --- CONFIGURACIÓN AVANZADA PARA PRODUCCIÓN ---
 if not DEBUG:
     STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
\ No newline at end of file
@@ -0,0 +1,14 @@
+"""
+Ajustes opcionales para correr los tests con la caché en memoria:
+
+    python manage.py test --settings=config.settings_test
+
+La base de tests en archivo ya está en settings.py (DATABASES['default']['TEST']),
+así que `python manage.py test` a secas también corre los tests de concurrencia.
+"""
+from .settings import *  # noqa: F401,F403
+
+# Caché en memoria: cada corrida empieza vacía y no toca la caché en disco de desarrollo
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+}
@@ -2,9 +2,15 @@
 URL configuration for config project.
 """
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
 from django.conf.urls.static import static
+from django.http import Http404
+
+
+def documento_privado(request):
+    raise Http404("Los documentos clínicos se descargan desde su enlace protegido")
+
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -13,6 +19,9 @@ urlpatterns = [
 
 # --- CONFIGURACIÓN PARA MODO DESARROLLO (DEBUG) ---
 if settings.DEBUG:
+    # 0. Los documentos clínicos NO: solo salen por la vista protegida (documento/<id>/)
+    urlpatterns += [re_path(r'^media/historias_clinicas/', documento_privado)]
+
     # 1. Multimedia (Fotos)
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
     